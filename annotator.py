@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
+import copy
+import hashlib
 import itertools
 import os
+import string
 import subprocess
 import tempfile
+import threading
+from collections import Counter, OrderedDict
 from functools import lru_cache
 
 import faiss
@@ -13,9 +18,14 @@ from allennlp.predictors.predictor import Predictor
 from loguru import logger
 from pytorch_transformers.tokenization_bert import BasicTokenizer
 
+from el.common.archival import has_flat_weights, load_flat_archive
 from predictor import load_model, load_parameters, process_dir
 from utils import file_utils
+from utils.precision import FLOAT32, apply_precision
 from utils.annotation import (
+    AttributeAnnotation,
+    BinaryRelationAnnotation,
+    EventAnnotation,
     NormalizationAnnotation,
     TextAnnotations,
     TextBoundAnnotationWithText,
@@ -25,6 +35,9 @@ import_submodules("el")
 
 CACHE_SIZE = 0
 
+# Number of sentences whose predictions are kept for the re-annotation of edited documents
+SENTENCE_CACHE_SIZE = 10000
+
 TOKENIZER = BasicTokenizer(do_lower_case=False)
 
 
@@ -33,6 +46,62 @@ def batchify(instances, batch_size):
         yield instances[i : i + batch_size]
 
 
+def model_version(*components):
+    """Hash of the settings and paths of a model and of the modification times of its files."""
+    digest = hashlib.sha1()
+
+    for component in components:
+        digest.update(repr(component).encode("UTF-8"))
+
+        if isinstance(component, str) and os.path.isdir(component):
+            paths = sorted(
+                os.path.join(component, name) for name in os.listdir(component)
+            )
+        elif isinstance(component, str) and os.path.isfile(component):
+            paths = [component]
+        else:
+            paths = []
+
+        for path in paths:
+            digest.update(repr((path, os.path.getmtime(path))).encode("UTF-8"))
+
+    return digest.hexdigest()
+
+
+class SentenceCache:
+    """LRU cache of the predictions of single sentences, by (model version, sentence)."""
+
+    def __init__(self, maxsize=SENTENCE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return self.entries[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
 class Standoffizer:
     def __init__(self, text, subs, start=0):
         self.text = text
@@ -87,8 +156,85 @@ class GeniassSentenceSplitter:
             return list(filter(None, map(str.strip, process.stdout.split("\n"))))
 
 
+def split_document(geniass, doc):
+    """
+    Splits a document into sentences and tokens, once for all the annotators.
+
+    Returns the sentences, the tokenized sentences, the sentence standoffs and the token
+    standoffs of each sentence.
+    """
+    sentences = geniass.split_sentences(doc)
+    newline_free_doc = doc.replace('\n', ' ')
+
+    sentence_standoffs = list(Standoffizer(newline_free_doc, sentences))
+
+    tokenized_sentences = []
+
+    offset_maps = []
+
+    for sentence, (sentence_start, _) in zip(sentences, sentence_standoffs):
+        tokenized_sentence = TOKENIZER.tokenize(sentence)
+
+        tokenized_sentences.append(tokenized_sentence)
+
+        offset_maps.append(
+            list(Standoffizer(sentence, tokenized_sentence, sentence_start))
+        )
+
+    return sentences, tokenized_sentences, sentence_standoffs, offset_maps
+
+
+def locate_span(start, end, sentence_standoffs, offset_maps):
+    """(sentence index, first token, last token) of a character span, None if it is not in a sentence."""
+    for sentence_index, ((sentence_start, sentence_end), offset_map) in enumerate(
+        zip(sentence_standoffs, offset_maps)
+    ):
+        if sentence_start <= start < sentence_end:
+            if end > sentence_end:
+                return None
+
+            tokens = [
+                token_index
+                for token_index, (token_start, token_end) in enumerate(offset_map)
+                if token_start < end and token_end > start
+            ]
+
+            if not tokens:
+                return None
+
+            return sentence_index, tokens[0], tokens[-1]
+
+    return None
+
+
+def gold_entity_model(model, parameters):
+    """
+    A view of a DeepEM model that shares its weights, but whose layers read `parameters`.
+
+    The layers read the prediction mode (gold_entities) from their own parameters at every
+    forward, so the model serving the predicted entities is left untouched.
+    """
+    view = copy.copy(model)
+    view.params = parameters
+    view._modules = OrderedDict(model._modules)
+
+    for name, layer in model.named_children():
+        if hasattr(layer, "params"):
+            view._modules[name] = copy.copy(layer)
+            view._modules[name].params = parameters
+
+    return view
+
+
 class DeepEMAnnotator:
-    def __init__(self, config_file, geniass_dir, cache_dir):
+    def __init__(
+        self,
+        config_file,
+        geniass_dir,
+        cache_dir,
+        precision=None,
+        sentence_cache_size=SENTENCE_CACHE_SIZE,
+    ):
         self.config_file = config_file
         self.geniass_dir = geniass_dir
         self.cache_dir = cache_dir
@@ -97,105 +243,314 @@ class DeepEMAnnotator:
         self.output_dir = os.path.join(self.cache_dir, "outputs")
 
         self.parameters = load_parameters(self.config_file)
+
+        # Overrides `inference_precision` of the yaml file
+        if precision:
+            self.parameters["inference_precision"] = precision
+
+        # The documents are raw text (empty .ann files), no gold annotation is ever used
+        self.parameters["inference"] = True
+
         self.model = load_model(self.parameters)
 
+        # Same weights, using the entities and triggers of the client (annotate_with_entities)
+        self.gold_parameters = dict(self.parameters, gold_entities=True)
+        self.gold_model = gold_entity_model(self.model, self.gold_parameters)
+
+        nn_mapping = self.parameters["mappings"]["nn_mapping"]
+
+        self.trigger_types = {
+            nn_mapping["id_tag_mapping"][label_id]
+            for label_id in nn_mapping["trTypes_Ids"]
+        }
+        self.entity_types = (
+            set(nn_mapping["tag_id_mapping"]) - self.trigger_types - {"O"}
+        )
+
+        self.model_version = model_version(
+            self.config_file,
+            self.parameters["joint_model_dir"],
+            self.parameters.get("joint_model_flat"),
+            self.parameters.get("inference_precision"),
+        )
+        self.sentence_cache = SentenceCache(sentence_cache_size)
+
         self.geniass = GeniassSentenceSplitter(
             self.geniass_dir, os.path.join(self.cache_dir, "geniass")
         )
 
     @lru_cache(maxsize=CACHE_SIZE)
     def __call__(self, doc):
-        with TextAnnotations(text=doc) as annotator:
-            sentence_standoffs = []
-            token_standoffs = []
+        return self.annotate_split(doc, split_document(self.geniass, doc))
 
-            sentences = self.geniass.split_sentences(doc)
-            newline_free_doc = doc.replace('\n', ' ')
+    def annotate_split(self, doc, split):
+        """Annotates a document already split by `split_document`."""
+        sentences, tokenized_sentences, sentence_standoffs, offset_maps = split
 
-            sentence_standoffs.extend(Standoffizer(newline_free_doc, sentences))
+        token_standoffs = list(itertools.chain.from_iterable(offset_maps))
 
-            tokenized_sentences = []
-            tokens = []
+        with TextAnnotations(text=doc) as annotator:
+            if len(tokenized_sentences) == 0:
+                return annotator, sentence_standoffs, token_standoffs
 
-            for sentence, (sentence_start, _) in zip(sentences, sentence_standoffs):
-                tokenized_sentence = TOKENIZER.tokenize(sentence)
+            # Only the sentences missing from the cache are predicted, once each
+            predictions = [
+                self.sentence_cache.get((self.model_version, sentence))
+                for sentence in sentences
+            ]
 
-                tokenized_sentences.append(" ".join(tokenized_sentence))
-                tokens.extend(tokenized_sentence)
-                token_standoffs.extend(
-                    Standoffizer(sentence, tokenized_sentence, sentence_start)
+            missing_sentences = OrderedDict(
+                (sentence, tokenized_sentence)
+                for sentence, tokenized_sentence, prediction in zip(
+                    sentences, tokenized_sentences, predictions
                 )
+                if prediction is None
+            )
+
+            if missing_sentences:
+                missing_predictions = dict(
+                    zip(
+                        missing_sentences,
+                        self.__predict(
+                            list(missing_sentences), list(missing_sentences.values())
+                        ),
+                    )
+                )
+
+                for sentence, prediction in missing_predictions.items():
+                    self.sentence_cache.put((self.model_version, sentence), prediction)
+
+                predictions = [
+                    missing_predictions[sentence] if prediction is None else prediction
+                    for sentence, prediction in zip(sentences, predictions)
+                ]
+
+            logger.info(
+                "Predicted {}/{} sentences, reused the others",
+                len(missing_sentences),
+                len(sentences),
+            )
+
+            self.__add_annotations(annotator, predictions, sentence_standoffs)
+
+            return annotator, sentence_standoffs, token_standoffs
+
+    def annotate_with_entities(self, doc, entities, split=None):
+        """
+        Annotates a document with the entities and triggers of the client in place of the ones
+        of NER, only the relation and event layers predict.
 
+        `entities` are the (start, end, type) character offsets of the entities and triggers, a
+        span is extended to the boundaries of its tokens. Raises ValueError for a type unknown to
+        the model or a span that covers no token or several sentences. The predictions depend on
+        the entities, so the sentence cache is not used.
+        """
+        for start, end, entity_type in entities:
+            if entity_type not in self.entity_types | self.trigger_types:
+                raise ValueError(f"Unknown entity type: {entity_type}")
+
+        if split is None:
+            split = split_document(self.geniass, doc)
+
+        sentences, tokenized_sentences, sentence_standoffs, offset_maps = split
+
+        located_entities = []
+
+        for start, end, entity_type in entities:
+            location = locate_span(start, end, sentence_standoffs, offset_maps)
+
+            if location is None:
+                raise ValueError(f"Span ({start}, {end}) is not in a sentence")
+
+            located_entities.append((*location, entity_type))
+
+        token_standoffs = list(itertools.chain.from_iterable(offset_maps))
+
+        with TextAnnotations(text=doc) as annotator:
             if len(tokenized_sentences) == 0:
                 return annotator, sentence_standoffs, token_standoffs
 
-            tokenized_doc = "\n".join(tokenized_sentences)
+            predictions = self.__predict(
+                sentences, tokenized_sentences, located_entities
+            )
 
-            offset_map = dict(
-                zip(
-                    itertools.chain.from_iterable(
-                        Standoffizer(tokenized_doc, tokens)
-                    ),
-                    itertools.chain.from_iterable(token_standoffs),
+            self.__add_annotations(annotator, predictions, sentence_standoffs)
+
+            return annotator, sentence_standoffs, token_standoffs
+
+    def __predict(self, sentences, tokenized_sentences, entities=None):
+        """
+        Predictions of each sentence. `entities` are the (sentence index, first token, last
+        token, type) of the entities and triggers given in place of the ones of NER, if any.
+        """
+        tokenized_doc = "\n".join(
+            " ".join(tokenized_sentence) for tokenized_sentence in tokenized_sentences
+        )
+
+        # Standoffs of the tokens in the tokenized document
+        doc_token_standoffs = list(
+            Standoffizer(
+                tokenized_doc, itertools.chain.from_iterable(tokenized_sentences)
+            )
+        )
+
+        # Offsets in the tokenized document -> (sentence index, offset in the sentence)
+        sentence_offsets = []
+
+        for sentence_index, (sentence, tokenized_sentence) in enumerate(
+            zip(sentences, tokenized_sentences)
+        ):
+            for start, end in Standoffizer(sentence, tokenized_sentence):
+                sentence_offsets.append((sentence_index, start))
+                sentence_offsets.append((sentence_index, end))
+
+        offset_map = dict(
+            zip(itertools.chain.from_iterable(doc_token_standoffs), sentence_offsets)
+        )
+
+        entity_lines = []
+
+        if entities is not None:
+            # Index of the first token of each sentence in the tokenized document
+            first_tokens = list(
+                itertools.accumulate(
+                    [0] + [len(tokenized_sentence) for tokenized_sentence in tokenized_sentences]
                 )
             )
 
-            file_utils.make_dirs(self.input_dir)
-            file_utils.make_dirs(self.output_dir)
+            for entity_index, (sentence_index, first, last, entity_type) in enumerate(
+                entities, start=1
+            ):
+                start = doc_token_standoffs[first_tokens[sentence_index] + first][0]
+                end = doc_token_standoffs[first_tokens[sentence_index] + last][1]
 
-            with tempfile.TemporaryDirectory(
-                dir=self.input_dir
-            ) as input_dir, tempfile.TemporaryDirectory(
-                dir=self.output_dir
-            ) as output_dir:
-                sample_filename = "sample"
+                # The loader tells the triggers (TR) from the entities (T) by their ids
+                prefix = "TR" if entity_type in self.trigger_types else "T"
 
-                file_utils.write_text(
-                    tokenized_doc, os.path.join(input_dir, sample_filename + ".txt")
+                entity_lines.append(
+                    f"{prefix}{entity_index}\t{entity_type} {start} {end}\t{tokenized_doc[start:end]}"
                 )
-                file_utils.write_lines(
-                    [], os.path.join(input_dir, sample_filename + ".ann")
+
+        if entities is None:
+            model, parameters = self.model, self.parameters
+        else:
+            model, parameters = self.gold_model, self.gold_parameters
+
+        file_utils.make_dirs(self.input_dir)
+        file_utils.make_dirs(self.output_dir)
+
+        with tempfile.TemporaryDirectory(
+            dir=self.input_dir
+        ) as input_dir, tempfile.TemporaryDirectory(
+            dir=self.output_dir
+        ) as output_dir:
+            sample_filename = "sample"
+
+            file_utils.write_text(
+                tokenized_doc, os.path.join(input_dir, sample_filename + ".txt")
+            )
+            file_utils.write_lines(
+                entity_lines, os.path.join(input_dir, sample_filename + ".ann")
+            )
+
+            process_dir(model, parameters, input_dir + "/", output_dir + "/")
+
+            prediction_dir = os.path.join(output_dir, "ev-last/ev-ann")
+
+            if not os.path.isdir(prediction_dir):
+                prediction_dir = os.path.join(output_dir, "rel-last/rel-ann")
+
+            with TextAnnotations(
+                document=os.path.join(prediction_dir, sample_filename)
+            ) as prediction:
+                return self.__split_annotations(
+                    prediction, offset_map, len(sentences)
                 )
 
-                process_dir(
-                    self.model, self.parameters, input_dir + "/", output_dir + "/"
+    @staticmethod
+    def __add_annotations(annotator, predictions, sentence_standoffs):
+        # The ids are numbered in document order, whichever sentences came from the cache
+        id_counts = Counter()
+
+        def new_id(prediction_id):
+            prefix = prediction_id.rstrip(string.digits)
+            id_counts[prefix] += 1
+            return prefix + str(id_counts[prefix])
+
+        id_maps = [{} for _ in predictions]
+
+        for prediction, id_map, (sentence_start, _) in zip(
+            predictions, id_maps, sentence_standoffs
+        ):
+            for entity_id, entity_type, spans in prediction["entities"]:
+                id_map[entity_id] = new_id(entity_id)
+
+                TextBoundAnnotationWithText(
+                    id=id_map[entity_id],
+                    spans=tuple(
+                        (sentence_start + start, sentence_start + end)
+                        for start, end in spans
+                    ),
+                    type=entity_type,
+                    text=annotator,
                 )
 
-                prediction_dir = os.path.join(output_dir, "ev-last/ev-ann")
+        for prediction, id_map in zip(predictions, id_maps):
+            for relation_id, relation_type, arg1l, arg1, arg2l, arg2, tail in prediction[
+                "relations"
+            ]:
+                id_map[relation_id] = new_id(relation_id)
+
+                annotator.add_annotation(
+                    BinaryRelationAnnotation(
+                        id_map[relation_id],
+                        relation_type,
+                        arg1l,
+                        id_map[arg1],
+                        arg2l,
+                        id_map[arg2],
+                        tail,
+                    )
+                )
 
-                if not os.path.isdir(prediction_dir):
-                    prediction_dir = os.path.join(output_dir, "rel-last/rel-ann")
+        for prediction, id_map in zip(predictions, id_maps):
+            for event_id, event_type, trigger, args, tail in prediction["events"]:
+                id_map[event_id] = new_id(event_id)
+
+                annotator.add_annotation(
+                    EventAnnotation(
+                        id_map[trigger],
+                        [(arg_role, id_map[arg_id]) for arg_role, arg_id in args],
+                        id_map[event_id],
+                        event_type,
+                        tail,
+                    )
+                )
 
-                with TextAnnotations(
-                    document=os.path.join(prediction_dir, sample_filename)
-                ) as prediction:
-                    self.__fix_annotations(annotator, prediction, offset_map)
+        for prediction, id_map in zip(predictions, id_maps):
+            for attribute_id, attribute_type, target, value, tail in prediction[
+                "attributes"
+            ]:
+                id_map[attribute_id] = new_id(attribute_id)
 
-            return annotator, sentence_standoffs, token_standoffs
+                annotator.add_annotation(
+                    AttributeAnnotation(
+                        id_map[target], id_map[attribute_id], attribute_type, tail, value
+                    )
+                )
 
     @staticmethod
-    def __fix_annotations(annotator, prediction, offset_map):
-        # V1: No filter
-        # for entity in prediction.get_textbounds():
-        #     TextBoundAnnotationWithText(
-        #         id=entity.id,
-        #         spans=[(offset_map[ss], offset_map[se]) for ss, se in entity.spans],
-        #         type=entity.type,
-        #         text=annotator,
-        #     )
-
-        # for relation in prediction.get_relations():
-        #     annotator.add_annotation(relation)
-
-        # for event in prediction.get_events():
-        #     annotator.add_annotation(event)
-
-        # for attribute in prediction.get_attributes():
-        #     annotator.add_annotation(attribute)
-
-        # V2: Filter duplicates
+    def __split_annotations(prediction, offset_map, num_sentences):
+        # The predictions of each sentence, with offsets relative to the sentence and
+        # the ids of the prediction, duplicates filtered
+        predictions = [
+            {"entities": [], "relations": [], "events": [], "attributes": []}
+            for _ in range(num_sentences)
+        ]
+
         seen_entities = {}
         identical_entities = {}
+        entity_sentences = {}
 
         num_entities = 0
         num_duplicate_entities = 0
@@ -214,14 +569,18 @@ class DeepEMAnnotator:
                     seen_entities[entity.type, spans],
                 )
             else:
-                TextBoundAnnotationWithText(
-                    id=entity.id,
-                    spans=spans,
-                    type=entity.type,
-                    text=annotator,
+                sentence_index = spans[0][0][0]
+
+                predictions[sentence_index]["entities"].append(
+                    (
+                        entity.id,
+                        entity.type,
+                        tuple((start, end) for (_, start), (_, end) in spans),
+                    )
                 )
 
                 seen_entities[entity.type, spans] = entity.id
+                entity_sentences[entity.id] = sentence_index
 
             identical_entities[entity.id] = seen_entities[entity.type, spans]
 
@@ -252,7 +611,17 @@ class DeepEMAnnotator:
                     seen_relations[relation.type, arg_1, arg_2],
                 )
             else:
-                annotator.add_annotation(relation)
+                predictions[entity_sentences[arg_1]]["relations"].append(
+                    (
+                        relation.id,
+                        relation.type,
+                        relation.arg1l,
+                        arg_1,
+                        relation.arg2l,
+                        arg_2,
+                        relation.tail,
+                    )
+                )
 
                 seen_relations[relation.type, arg_1, arg_2] = relation.id
 
@@ -267,6 +636,7 @@ class DeepEMAnnotator:
 
         seen_events = {}
         identical_events = {}
+        event_sentences = {}
 
         num_events = len(events)
         num_duplicate_events = 0
@@ -294,11 +664,14 @@ class DeepEMAnnotator:
             is_valid_event = event_hash not in seen_events
 
             if is_valid_event:
-                event.args = args
+                sentence_index = entity_sentences[event.trigger]
 
-                annotator.add_annotation(event)
+                predictions[sentence_index]["events"].append(
+                    (event.id, event.type, event.trigger, args, event.tail)
+                )
 
                 seen_events[event_hash] = event.id
+                event_sentences[event.id] = sentence_index
             else:
                 logger.info(
                     "Skipped duplicate event: {} -> {}",
@@ -340,7 +713,15 @@ class DeepEMAnnotator:
                     seen_attributes[attribute.type, attribute.target, attribute.value],
                 )
             else:
-                annotator.add_annotation(attribute)
+                predictions[event_sentences[attribute.target]]["attributes"].append(
+                    (
+                        attribute.id,
+                        attribute.type,
+                        attribute.target,
+                        attribute.value,
+                        attribute.tail,
+                    )
+                )
 
                 seen_attributes[
                     attribute.type, attribute.target, attribute.value
@@ -353,15 +734,32 @@ class DeepEMAnnotator:
             num_attributes and num_duplicate_attributes / num_attributes * 100,
         )
 
+        return predictions
+
+
+def load_predictor(model_dir, cuda_device=-1, precision=FLOAT32):
+    # Prefer the memory-mapped weights written by convert_checkpoints.py
+    if os.path.isdir(model_dir) and has_flat_weights(model_dir):
+        archive = load_flat_archive(model_dir, cuda_device=cuda_device)
+    else:
+        archive = load_archive(model_dir, cuda_device=cuda_device)
+
+    predictor = Predictor.from_archive(archive)
+
+    apply_precision(predictor._model, precision)
+
+    return predictor
+
 
 class NERPredictor:
-    def __init__(self, model_dir, batch_size=32, cuda_device=-1):
+    def __init__(self, model_dir, batch_size=32, cuda_device=-1, precision=FLOAT32):
         self.model_dir = model_dir
         self.batch_size = batch_size
         self.cuda_device = cuda_device
+        self.precision = precision
 
-        self.predictor = Predictor.from_archive(
-            load_archive(self.model_dir, cuda_device=self.cuda_device)
+        self.predictor = load_predictor(
+            self.model_dir, cuda_device=self.cuda_device, precision=self.precision
         )
 
     def __call__(self, tokenized_sentences):
@@ -403,6 +801,7 @@ class CGPredictor:
         top_k=50,
         batch_size=512,
         cuda_device=-1,
+        precision=FLOAT32,
     ):
         self.model_dir = model_dir
         self.faiss_indexer = faiss_indexer
@@ -410,9 +809,10 @@ class CGPredictor:
         self.top_k = top_k
         self.batch_size = batch_size
         self.cuda_device = cuda_device
+        self.precision = precision
 
-        self.predictor = Predictor.from_archive(
-            load_archive(self.model_dir, cuda_device=self.cuda_device)
+        self.predictor = load_predictor(
+            self.model_dir, cuda_device=self.cuda_device, precision=self.precision
         )
 
     def __call__(self, docs):
@@ -473,13 +873,14 @@ class CGPredictor:
 
 
 class CRPredictor:
-    def __init__(self, model_dir, batch_size=128, cuda_device=-1):
+    def __init__(self, model_dir, batch_size=128, cuda_device=-1, precision=FLOAT32):
         self.model_dir = model_dir
         self.batch_size = batch_size
         self.cuda_device = cuda_device
+        self.precision = precision
 
-        self.predictor = Predictor.from_archive(
-            load_archive(self.model_dir, cuda_device=self.cuda_device)
+        self.predictor = load_predictor(
+            self.model_dir, cuda_device=self.cuda_device, precision=self.precision
         )
 
     def __call__(self, docs):
@@ -513,6 +914,10 @@ class SemELAnnotator:
         geniass_dir,
         cache_dir,
         enable_linking=True,
+        ner_precision=FLOAT32,
+        cg_precision=FLOAT32,
+        cr_precision=FLOAT32,
+        sentence_cache_size=SENTENCE_CACHE_SIZE,
     ):
         self.ner_dir = ner_dir
         self.cg_dir = cg_dir
@@ -522,7 +927,7 @@ class SemELAnnotator:
         self.cache_dir = cache_dir
         self.enable_linking = enable_linking
 
-        self.ner_predictor = NERPredictor(self.ner_dir)
+        self.ner_predictor = NERPredictor(self.ner_dir, precision=ner_precision)
 
         if self.enable_linking:
             self.concepts = file_utils.read_json(
@@ -540,9 +945,21 @@ class SemELAnnotator:
             self.faiss_indexer.add(self.concept_embeddings)
 
             self.cg_predictor = CGPredictor(
-                self.cg_dir, self.faiss_indexer, self.concepts
+                self.cg_dir, self.faiss_indexer, self.concepts, precision=cg_precision
             )
-            self.cr_predictor = CRPredictor(self.cr_dir)
+            self.cr_predictor = CRPredictor(self.cr_dir, precision=cr_precision)
+
+        self.model_version = model_version(
+            self.ner_dir,
+            self.cg_dir,
+            self.cr_dir,
+            self.kbe_dir,
+            self.enable_linking,
+            ner_precision,
+            cg_precision,
+            cr_precision,
+        )
+        self.sentence_cache = SentenceCache(sentence_cache_size)
 
         self.geniass = GeniassSentenceSplitter(
             self.geniass_dir, os.path.join(self.cache_dir, "geniass")
@@ -550,55 +967,195 @@ class SemELAnnotator:
 
     @lru_cache(maxsize=CACHE_SIZE)
     def __call__(self, doc):
-        with TextAnnotations(text=doc) as annotator:
-            sentence_standoffs = []
-            token_standoffs = []
+        return self.annotate_many([doc])[0]
+
+    def annotate_many(self, docs, splits=None):
+        """
+        Annotates several documents at once, their sentences share the batches of NER, CG and CR.
+
+        `splits` are the documents already split by `split_document`, if any. Returns the
+        (annotations, sentence standoffs, token standoffs) of each document.
+        """
+        if splits is None:
+            splits = [split_document(self.geniass, doc) for doc in docs]
+
+        mentions = iter(
+            self.__predict_mentions(
+                list(
+                    itertools.chain.from_iterable(
+                        sentences for sentences, _, _, _ in splits
+                    )
+                ),
+                list(
+                    itertools.chain.from_iterable(
+                        tokenized_sentences for _, tokenized_sentences, _, _ in splits
+                    )
+                ),
+            )
+        )
+
+        results = []
+
+        for doc, (sentences, _, sentence_standoffs, offset_maps) in zip(docs, splits):
+            with TextAnnotations(text=doc) as annotator:
+                self.__fix_annotations(
+                    annotator, list(itertools.islice(mentions, len(sentences))), offset_maps
+                )
 
-            sentences = self.geniass.split_sentences(doc)
-            newline_free_doc = doc.replace('\n', ' ')
+            token_standoffs = list(itertools.chain.from_iterable(offset_maps))
 
-            sentence_standoffs.extend(Standoffizer(newline_free_doc, sentences))
+            results.append((annotator, sentence_standoffs, token_standoffs))
 
-            tokenized_sentences = []
+        return results
 
-            offset_maps = []
+    def link(self, doc, mentions, split=None):
+        """
+        Links mentions found by the client, without NER: only the candidate generation and the
+        re-ranking are run.
 
-            for sentence, (sentence_start, _) in zip(sentences, sentence_standoffs):
-                tokenized_sentence = TOKENIZER.tokenize(sentence)
+        `mentions` are the (start, end, type) character offsets of the mentions. A mention is linked
+        in the context of its sentence, the ones that cover no token or several sentences are kept
+        unlinked. Returns the (annotations, sentence standoffs, token standoffs) of the document, the
+        mentions are T1, T2, ... in the given order.
+        """
+        assert self.enable_linking
 
-                tokenized_sentences.append(tokenized_sentence)
+        if split is None:
+            split = split_document(self.geniass, doc)
 
-                sentence_token_standoffs = list(
-                    Standoffizer(sentence, tokenized_sentence, sentence_start)
+        _, tokenized_sentences, sentence_standoffs, offset_maps = split
+
+        # sentence index -> sentence with the mentions to link
+        linked_sentences = {}
+        linked_mentions = []
+
+        for mention_index, (start, end, mention_type) in enumerate(mentions, start=1):
+            location = locate_span(start, end, sentence_standoffs, offset_maps)
+
+            if location is None:
+                logger.warning("Mention ({}, {}) not in a sentence, not linked", start, end)
+                linked_mentions.append(None)
+                continue
+
+            sentence_index, token_start, token_end = location
+
+            mention = {
+                "id": f"T{mention_index}",
+                "start": token_start,
+                "end": token_end,
+                "label": mention_type,
+                "references": {},
+            }
+
+            linked_sentences.setdefault(
+                sentence_index,
+                {"tokens": tokenized_sentences[sentence_index], "mentions": []},
+            )["mentions"].append(mention)
+            linked_mentions.append(mention)
+
+        if linked_sentences:
+            # The references of the mentions are filled in place
+            self.cr_predictor(
+                self.cg_predictor(
+                    {
+                        "sample.ann": {
+                            "sentences": [
+                                linked_sentences[sentence_index]
+                                for sentence_index in sorted(linked_sentences)
+                            ]
+                        }
+                    }
                 )
+            )
 
-                token_standoffs.extend(sentence_token_standoffs)
+        with TextAnnotations(text=doc) as annotator:
+            for mention_index, ((start, end, mention_type), mention) in enumerate(
+                zip(mentions, linked_mentions), start=1
+            ):
+                mention_id = f"T{mention_index}"
 
-                offset_maps.append(sentence_token_standoffs)
+                TextBoundAnnotationWithText(
+                    id=mention_id, spans=[(start, end)], type=mention_type, text=annotator
+                )
 
-            if len(tokenized_sentences) == 0:
-                return annotator, sentence_standoffs, token_standoffs
+                if mention is None:
+                    continue
 
-            prediction = self.ner_predictor(tokenized_sentences)
+                for (source, concept_id), confidence in mention["references"].items():
+                    if source.startswith("PRED"):
+                        annotator.add_annotation(
+                            NormalizationAnnotation(
+                                id=annotator.get_new_id("N"),
+                                type="Reference",
+                                target=mention_id,
+                                refdb="UMLS",
+                                refid=concept_id,
+                                tail=f"\tConf: {confidence}",
+                            )
+                        )
+
+        token_standoffs = list(itertools.chain.from_iterable(offset_maps))
+
+        return annotator, sentence_standoffs, token_standoffs
+
+    def __predict_mentions(self, sentences, tokenized_sentences):
+        if len(sentences) == 0:
+            return []
+
+        # Only the sentences missing from the cache are predicted, once each
+        mentions = [
+            self.sentence_cache.get((self.model_version, sentence))
+            for sentence in sentences
+        ]
+
+        missing_sentences = OrderedDict(
+            (sentence, tokenized_sentence)
+            for sentence, tokenized_sentence, sentence_mentions in zip(
+                sentences, tokenized_sentences, mentions
+            )
+            if sentence_mentions is None
+        )
+
+        if missing_sentences:
+            prediction = self.ner_predictor(list(missing_sentences.values()))
 
             if self.enable_linking:
                 prediction = self.cg_predictor(prediction)
                 prediction = self.cr_predictor(prediction)
 
-            prediction = prediction["sample.ann"]
+            missing_mentions = {
+                sentence: predicted_sentence["mentions"]
+                for sentence, predicted_sentence in zip(
+                    missing_sentences, prediction["sample.ann"]["sentences"]
+                )
+            }
 
-            self.__fix_annotations(annotator, prediction, offset_maps)
+            for sentence, sentence_mentions in missing_mentions.items():
+                self.sentence_cache.put(
+                    (self.model_version, sentence), sentence_mentions
+                )
 
-            return annotator, sentence_standoffs, token_standoffs
+            mentions = [
+                missing_mentions[sentence]
+                if sentence_mentions is None
+                else sentence_mentions
+                for sentence, sentence_mentions in zip(sentences, mentions)
+            ]
 
-    @staticmethod
-    def __fix_annotations(annotator, prediction, offset_maps):
-        sentences = prediction["sentences"]
+        logger.info(
+            "Predicted {}/{} sentences, reused the others",
+            len(missing_sentences),
+            len(sentences),
+        )
+
+        return mentions
 
-        assert len(sentences) == len(offset_maps)
+    @staticmethod
+    def __fix_annotations(annotator, mentions, offset_maps):
+        assert len(mentions) == len(offset_maps)
 
-        for sentence, offset_map in zip(sentences, offset_maps):
-            for mention in sentence["mentions"]:
+        for sentence_mentions, offset_map in zip(mentions, offset_maps):
+            for mention in sentence_mentions:
                 mention_id = annotator.get_new_id("T")
 
                 TextBoundAnnotationWithText(
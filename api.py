@@ -1,26 +1,84 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import itertools
 import json
 import os
 import socket
 import tempfile
+import time
 from dataclasses import asdict
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 import fastapi
+import httpx
+import orjson
 import pandas as pd
 import regex
-import requests
 import uvicorn
-from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi import Body, FastAPI, File, Header, HTTPException, Query, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from loguru import logger
 from pydantic import Field, parse_obj_as
 from pydantic.dataclasses import dataclass
 
 from utils import file_utils
+from utils.api_annotations import (
+    Entity,
+    Event,
+    LinkedEntity,
+    Relation,
+    Span,
+    build_annotations,
+)
+from utils.jobs import DONE, FAILED, JobQueue, JobQueueFull
+from utils.response_cache import ResponseCache
+from utils.upstream import UpstreamPool
 
 EXTERNAL_API_BASE_URL = os.environ.get('EXTERNAL_API_BASE_URL', 'http://127.0.0.1:9091')
 
+# The model servers (replicas) the requests are balanced over, comma-separated in EXTERNAL_API_BASE_URL
+UPSTREAM_URLS = [url.strip() for url in EXTERNAL_API_BASE_URL.split(",")]
+
+# The number of documents of a batch request annotated at the same time
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# `format=columnar` returns the spans, entities and relations as parallel arrays
+ResponseFormat = Literal["objects", "columnar"]
+
+FORMAT_DESCRIPTION = (
+    "`columnar` to return the spans, entities, relations and events as parallel arrays "
+    "(one array per field) instead of one object each"
+)
+
+# The tables of the response of each task, the columnar responses skip the response model
+TASK_TABLES = {
+    "ner": ("entities",),
+    "re": ("entities", "relations"),
+    "ee": ("entities", "events"),
+    "el": ("entities",),
+}
+
+# The responses of the model server are cached for RESPONSE_CACHE_TTL seconds, the least
+# recently used ones overflow to RESPONSE_CACHE_DIR (if set) past RESPONSE_CACHE_SIZE entries
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR')
+
+# How long the model versions of the model server are trusted before being asked again
+MODEL_VERSION_TTL = 60
+
+# The documents longer than ASYNC_JOB_THRESHOLD characters are annotated as background jobs (see
+# /api/jobs), JOB_CONCURRENCY at a time and at most JOB_QUEUE_SIZE waiting or running, their
+# results are kept JOB_RESULT_TTL seconds, for the last JOB_MAX_FINISHED finished jobs at most
+ASYNC_JOB_THRESHOLD = int(os.environ.get('ASYNC_JOB_THRESHOLD', 100000))
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 60 * 60))
+JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', 1000))
+
 # LOG_FILE = "logs/api.log"
 
 # file_utils.make_dirs(os.path.dirname(LOG_FILE))
@@ -83,73 +141,34 @@ app = FastAPI(
     redoc_url=None,
 )
 
+# Shared by all the requests, keeps the connections to the model servers alive
+upstream = UpstreamPool(UPSTREAM_URLS)
 
-@dataclass
-class Span:
-    start: int = Field(
-        ..., title="The index of the first character of the span in the document"
-    )
-    end: int = Field(
-        ..., title="The index of the first character after the span in the document"
-    )
-
-
-@dataclass
-class Entity:
-    id: str = Field(..., title="The ID of the predicted entity")
-    type: str = Field(..., title="The entity type of the predicted entity")
-    span: Span = Field(
-        ..., title="The position of the predicted entity in the document"
-    )
-    text: str = Field(..., title="The mention text of the predicted entity")
-
-
-@dataclass
-class LinkedEntity(Entity):
-    concept_id: Optional[str] = Field(
-        None, title="The UMLS concept ID linked to the predicted entity mention"
-    )
-    concept_name: Optional[str] = Field(
-        None, title="The UMLS canonical name corresponding to the UMLS concept ID"
-    )
-
+if RESPONSE_CACHE_DIR:
+    file_utils.make_dirs(RESPONSE_CACHE_DIR)
 
-@dataclass
-class Relation:
-    id: str = Field(..., title="The ID of the predicted relation")
-    type: str = Field(..., title="The relation type of the predicted relation")
-    left_arg_id: str = Field(
-        ...,
-        title="The entity ID serving as the left argument of the predicted relation",
-    )
-    right_arg_id: str = Field(
-        ...,
-        title="The entity ID serving as the right argument of the predicted relation",
-    )
+response_cache = ResponseCache(
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_SIZE,
+    disk_path=RESPONSE_CACHE_DIR and os.path.join(RESPONSE_CACHE_DIR, "responses.sqlite"),
+)
 
+# task -> (expiry time, model version)
+model_versions = {}
 
-@dataclass
-class EventArgument:
-    arg_role: str = Field(..., title="The role of the argument")
-    arg_id: str = Field(..., title="The entity or event ID serving as the argument")
+job_queue = JobQueue(JOB_CONCURRENCY, JOB_RESULT_TTL, JOB_QUEUE_SIZE, JOB_MAX_FINISHED)
 
 
-@dataclass
-class Modality:
-    id: str = Field(..., title="The ID of the predicted modality")
-    type: str = Field(..., title="The modality type of the predicted modality")
+@app.on_event("startup")
+async def start_upstream():
+    await upstream.start()
 
 
-@dataclass
-class Event:
-    id: str = Field(..., title="The ID of the predicted event")
-    trigger_id: str = Field(..., title="The trigger ID of the predicted event")
-    args: List[EventArgument] = Field(
-        ..., title="The list of arguments of the predicted event"
-    )
-    modalities: List[Modality] = Field(
-        [], title="The list of modalities of the predicted event"
-    )
+@app.on_event("shutdown")
+async def close_upstream():
+    job_queue.close()
+    await upstream.close()
+    response_cache.close()
 
 
 @dataclass
@@ -192,6 +211,74 @@ class EntityLinkingData(NamedEntityRecognitionData):
     )
 
 
+@dataclass
+class RelationExtractionAnnotations:
+    entities: List[Entity] = Field(..., title="The list of predicted entities")
+    relations: List[Relation] = Field(..., title="The list of predicted relations")
+
+
+@dataclass
+class EventExtractionAnnotations:
+    entities: List[Entity] = Field(..., title="The list of predicted entities")
+    events: List[Event] = Field(..., title="The list of predicted events")
+
+
+@dataclass
+class AllAnnotationsData(AnnotatedDoc):
+    named_entity_recognition: List[Entity] = Field(
+        ..., title="The list of entities predicted by the named entity recognition model"
+    )
+    entity_linking: List[LinkedEntity] = Field(
+        ...,
+        title="The list of entity mentions linked to UMLS concepts "
+        "by the entity linking model",
+    )
+    relation_extraction: RelationExtractionAnnotations = Field(
+        ..., title="The entities and relations predicted by the relation extraction model"
+    )
+    event_extraction: EventExtractionAnnotations = Field(
+        ..., title="The entities and events predicted by the event extraction model"
+    )
+
+
+@dataclass
+class Mention:
+    span: Span = Field(..., title="The position of the mention in the document")
+    type: str = Field("Entity", title="The entity type of the mention")
+
+
+@dataclass
+class MentionDoc(Doc):
+    mentions: List[Mention] = Field(..., title="The list of mentions to link")
+
+
+@dataclass
+class GivenEntity:
+    span: Span = Field(..., title="The position of the entity or trigger in the document")
+    type: str = Field(..., title="The entity or trigger type, one of the types of the model")
+
+
+@dataclass
+class EntityDoc(Doc):
+    entities: List[GivenEntity] = Field(
+        ..., title="The list of entities and triggers to extract from"
+    )
+
+
+@dataclass
+class JobData:
+    id: str = Field(..., title="The ID of the job")
+    task: str = Field(..., title="The annotation task of the job")
+    status: str = Field(
+        ..., title="The status of the job: queued, running, done, failed or cancelled"
+    )
+    submitted_at: float = Field(..., title="The submission time of the job (UNIX time)")
+    finished_at: Optional[float] = Field(
+        None, title="The time the job finished (UNIX time), if it did"
+    )
+    error: Optional[str] = Field(None, title="The error of the job, if it failed")
+
+
 @dataclass
 class DiseaseNetworkDoc:
     entities: List[Entity] = Field(
@@ -303,83 +390,357 @@ def verify_email(email):
     return EMAIL_PATTERN.fullmatch(email)
 
 
-def annotate_doc(doc, task):
-    task = {
-        "ner": "named_entity_recognition",
-        "re": "relation_extraction",
-        "ee": "event_extraction",
-        "el": "entity_linking",
-    }[task]
+async def get_model_version(task):
+    expiry, version = model_versions.get(task, (0, None))
 
-    response = requests.post(
-        f"{EXTERNAL_API_BASE_URL}/{task}/annotate", data={"text": doc.text}
+    if expiry <= time.time():
+        try:
+            version = (await upstream.get(f"/{task}/version"))["version"]
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            logger.warning("Could not get the model version of {}: {!r}", task, e)
+            version = None
+
+        model_versions[task] = (time.time() + MODEL_VERSION_TTL, version)
+
+    return version
+
+
+async def fetch_annotations(
+    task, text, cache_control=None, route="annotate_compact", payload=None
+):
+    # Cache-Control: no-cache refreshes the cached response, no-store bypasses the cache
+    directives = {
+        directive.strip().lower() for directive in (cache_control or "").split(",")
+    }
+
+    # The compact columnar annotations of the model server, see wsgi.frontend.compact_doc_data
+    path = f"/{task}/{route}"
+
+    if payload is None:
+        request = {"data": {"text": text}}
+        key = text
+    else:
+        # The mentions or entities of the client, they are part of the key
+        request = {"json": {"text": text, **payload}}
+        key = orjson.dumps(request["json"]).decode("UTF-8")
+
+    # An unknown model version (the version call failed) could be a replaced model, skip the cache
+    version = await get_model_version(task)
+    cacheable = version is not None
+
+    return await response_cache.get_or_fetch(
+        ResponseCache.make_key(path, key, version),
+        lambda: upstream.post(path, **request),
+        read=cacheable and "no-cache" not in directives and "no-store" not in directives,
+        write=cacheable and "no-store" not in directives,
     )
 
-    response.raise_for_status()
 
-    annotations = response.json()
+async def annotate_doc(doc, task, cache_control=None, response_format="objects"):
+    annotations = await fetch_annotations(
+        {
+            "ner": "named_entity_recognition",
+            "re": "relation_extraction",
+            "ee": "event_extraction",
+            "el": "entity_linking",
+        }[task],
+        doc.text,
+        cache_control,
+    )
 
-    doc = annotations["text"]
+    if response_format == "columnar":
+        return build_columnar_annotations(doc.text, annotations, task)
 
-    entities = []
+    return build_annotations(doc.text, annotations)
 
-    for entity_id, entity_type, entity_spans in (
-        annotations["entities"] + annotations["triggers"]
-    ):
-        entity_starts, entity_ends = zip(*entity_spans)
 
-        entity_span = Span(min(entity_starts), max(entity_ends))
+async def annotate_all_tasks(doc, cache_control=None, response_format="objects"):
+    # One request to the model server, which splits the document once for the four tasks
+    annotations = await fetch_annotations("annotate_all", doc.text, cache_control)
 
-        entities.append(
-            LinkedEntity(
-                entity_id,
-                entity_type,
-                entity_span,
-                doc[entity_span.start : entity_span.end],
-            )
-        )
+    if response_format == "columnar":
+        results = {
+            task: build_columnar_annotations(doc.text, task_annotations, task)
+            for task, task_annotations in annotations.items()
+        }
+    else:
+        results = {
+            task: build_annotations(doc.text, task_annotations)
+            for task, task_annotations in annotations.items()
+        }
 
-    id_entities = {entity.id: entity for entity in entities}
+    return {
+        "text": doc.text,
+        "named_entity_recognition": results["ner"]["entities"],
+        "entity_linking": results["el"]["entities"],
+        "relation_extraction": {
+            table: results["re"][table] for table in TASK_TABLES["re"]
+        },
+        "event_extraction": {
+            table: results["ee"][table] for table in TASK_TABLES["ee"]
+        },
+        "token_boundaries": results["el"]["token_boundaries"],
+        "sentence_boundaries": results["el"]["sentence_boundaries"],
+    }
 
-    for _, _, entity_id, _, concept_id, _ in annotations["normalizations"]:
-        entity = id_entities[entity_id]
 
-        entity.concept_id = concept_id
-        entity.concept_name = annotations["cui_data"][concept_id]
+def format_response(result, response_format):
+    # The columnar responses are plain lists, they go to orjson without the response model
+    if response_format == "columnar":
+        return ORJSONResponse(result)
 
-    relations = []
+    return result
 
-    for (
-        relation_id,
-        relation_type,
-        ((_, relation_left_arg_id), (_, relation_right_arg_id)),
-    ) in annotations["relations"]:
-        relations.append(
-            Relation(
-                relation_id, relation_type, relation_left_arg_id, relation_right_arg_id
+
+def build_columnar_annotations(doc, annotations, task):
+    """
+    The tables of a task as parallel arrays, reusing the columns of the model server. The
+    arguments and the modalities of the i-th event are at arg_offsets[i]:arg_offsets[i + 1] and
+    modality_offsets[i]:modality_offsets[i + 1] of their arrays.
+    """
+    entity_columns = annotations["entities"]
+
+    entities = {
+        "ids": entity_columns["ids"],
+        "types": entity_columns["types"],
+        "starts": entity_columns["starts"],
+        "ends": entity_columns["ends"],
+        "texts": [
+            doc[start:end]
+            for start, end in zip(entity_columns["starts"], entity_columns["ends"])
+        ],
+    }
+
+    if task == "el":
+        normalization_columns = annotations["normalizations"]
+
+        concepts = dict(
+            zip(
+                normalization_columns["targets"],
+                zip(normalization_columns["refids"], normalization_columns["names"]),
             )
         )
 
-    events = parse_obj_as(List[Event], annotations["events"])
+        entities["concept_ids"] = [
+            concepts.get(entity_id, (None, None))[0] for entity_id in entities["ids"]
+        ]
+        entities["concept_names"] = [
+            concepts.get(entity_id, (None, None))[1] for entity_id in entities["ids"]
+        ]
 
-    id_events = {event.id: event for event in events}
+    event_columns = annotations["events"]
+    attribute_columns = annotations["attributes"]
 
-    for attribute_id, attribute_type, attribute_target, _ in annotations["attributes"]:
-        id_events[attribute_target].modalities.append(
-            Modality(attribute_id, attribute_type)
-        )
+    event_modalities = {event_id: [] for event_id in event_columns["ids"]}
 
-    return {
-        "text": doc,
+    for attribute_id, attribute_type, attribute_target in zip(
+        attribute_columns["ids"],
+        attribute_columns["types"],
+        attribute_columns["targets"],
+    ):
+        event_modalities[attribute_target].append((attribute_id, attribute_type))
+
+    modality_offsets = [0]
+
+    for modalities in event_modalities.values():
+        modality_offsets.append(modality_offsets[-1] + len(modalities))
+
+    tables = {
         "entities": entities,
-        "relations": relations,
-        "events": events,
-        "token_boundaries": parse_obj_as(List[Span], annotations["token_offsets"]),
-        "sentence_boundaries": parse_obj_as(
-            List[Span], annotations["sentence_offsets"]
+        "relations": annotations["relations"],
+        "events": dict(
+            event_columns,
+            modality_offsets=modality_offsets,
+            modality_ids=[
+                modality_id
+                for modalities in event_modalities.values()
+                for modality_id, _ in modalities
+            ],
+            modality_types=[
+                modality_type
+                for modalities in event_modalities.values()
+                for _, modality_type in modalities
+            ],
         ),
     }
 
+    return {
+        "text": doc,
+        **{table: tables[table] for table in TASK_TABLES[task]},
+        "token_boundaries": annotations["tokens"],
+        "sentence_boundaries": annotations["sentences"],
+    }
+
+
+def read_jsonl_docs(file):
+    """Documents of a JSONL file, one by one; the lines that are not documents give their error."""
+    for line in file:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        try:
+            yield Doc(**json.loads(line))
+        except (ValueError, TypeError) as e:
+            yield e
+
+
+async def annotate_indexed_doc(
+    index, doc, task, response_model, cache_control, response_format
+):
+    try:
+        if isinstance(doc, Exception):
+            raise HTTPException(
+                fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY, f"Invalid document: {doc}"
+            )
+
+        result = await annotate_doc(doc, task, cache_control, response_format)
+
+        if response_format == "columnar":
+            return {"index": index, "result": result}
+
+        # Same fields as the response of the single-document endpoint
+        result = parse_obj_as(response_model, jsonable_encoder(result))
+
+        return {"index": index, "result": jsonable_encoder(result)}
+    except HTTPException as e:
+        return {"index": index, "error": {"status_code": e.status_code, "detail": e.detail}}
+    except Exception as e:
+        logger.exception("Failed to annotate document {}", index)
+
+        return {
+            "index": index,
+            "error": {
+                "status_code": fastapi.status.HTTP_502_BAD_GATEWAY,
+                "detail": repr(e),
+            },
+        }
+
+
+async def stream_annotations(
+    docs, task, response_model, cache_control=None, response_format="objects"
+):
+    """
+    Annotates the documents with at most BATCH_CONCURRENCY of them in flight and yields their
+    results as NDJSON lines, in completion order. The next document is only read when one of
+    them is done, and the results are only produced as fast as the client reads them.
+    """
+    docs = enumerate(docs)
+    pending = set()
+
+    try:
+        while True:
+            for index, doc in itertools.islice(docs, BATCH_CONCURRENCY - len(pending)):
+                pending.add(
+                    asyncio.ensure_future(
+                        annotate_indexed_doc(
+                            index, doc, task, response_model, cache_control, response_format
+                        )
+                    )
+                )
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for future in done:
+                yield orjson.dumps(future.result()) + b"\n"
+    finally:
+        # The client went away
+        for future in pending:
+            future.cancel()
+
+
+# job task -> (task, response model)
+JOB_TASKS = {
+    "named_entity_recognition": ("ner", NamedEntityRecognitionData),
+    "relation_extraction": ("re", RelationExtractionData),
+    "event_extraction": ("ee", EventExtractionData),
+    "entity_linking": ("el", EntityLinkingData),
+    "annotate_all": ("all", AllAnnotationsData),
+}
+
+JobTask = Literal[
+    "named_entity_recognition",
+    "relation_extraction",
+    "event_extraction",
+    "entity_linking",
+    "annotate_all",
+]
+
+# The answer of the annotation endpoints for the documents longer than ASYNC_JOB_THRESHOLD
+JOB_RESPONSES = {
+    fastapi.status.HTTP_202_ACCEPTED: {
+        "model": JobData,
+        "description": "The document is too long to be annotated while waiting, it is "
+        "annotated by a background job: poll the URL of the `Location` header, then get "
+        "the annotations from its `/result`",
+    }
+}
+
+
+async def annotate_job(doc, task, cache_control, response_format):
+    short_task, response_model = JOB_TASKS[task]
+
+    if short_task == "all":
+        result = await annotate_all_tasks(doc, cache_control, response_format)
+    else:
+        result = await annotate_doc(doc, short_task, cache_control, response_format)
+
+    if response_format == "columnar":
+        return result
+
+    # Same fields as the response of the synchronous endpoint
+    return jsonable_encoder(parse_obj_as(response_model, jsonable_encoder(result)))
+
+
+def job_data(job):
+    if job.error is None:
+        error = None
+    elif isinstance(job.error, HTTPException):
+        error = job.error.detail
+    else:
+        error = repr(job.error)
+
+    return JobData(
+        job.id, job.task, job.status, job.submitted_at, job.finished_at, error
+    )
+
+
+def submit_job(email, doc, task, cache_control, response_format):
+    try:
+        job = job_queue.submit(
+            task,
+            email,
+            lambda: annotate_job(doc, task, cache_control, response_format),
+        )
+    except JobQueueFull:
+        raise HTTPException(
+            fastapi.status.HTTP_503_SERVICE_UNAVAILABLE, "Too many jobs, retry later"
+        )
+
+    logger.info("User: {}, job {} ({} characters)", email, job.id, len(doc.text))
+
+    return JSONResponse(
+        jsonable_encoder(job_data(job)),
+        status_code=fastapi.status.HTTP_202_ACCEPTED,
+        headers={"Location": f"{URL_PREFIX}/jobs/{job.id}"},
+    )
+
+
+def get_job(job_id, email):
+    job = job_queue.get(job_id)
+
+    # The jobs of the other users are not found either
+    if job is None or job.owner != email:
+        raise HTTPException(fastapi.status.HTTP_404_NOT_FOUND, "Job not found")
+
+    return job
+
 
 @app.get(
     f"{URL_PREFIX}/status",
@@ -389,19 +750,56 @@ def annotate_doc(doc, task):
     description="Use this to check the current status of the API server",
     response_description="Status OK",
 )
-def status():
+async def status():
     return StatusData("Running")
 
 
+@app.get(
+    f"{URL_PREFIX}/cache_stats",
+    tags=["Status"],
+    summary="Check the response cache",
+    description="Use this to check the hit ratio, the size and the evictions "
+    "of the response cache of the API server",
+    response_description="The statistics of the response cache",
+)
+async def cache_stats():
+    return response_cache.stats()
+
+
+@app.get(
+    f"{URL_PREFIX}/job_stats",
+    tags=["Status"],
+    summary="Check the background jobs",
+    description="Use this to check the number of background jobs of the API server "
+    "by status",
+    response_description="The number of jobs by status",
+)
+async def job_stats():
+    return job_queue.stats()
+
+
+@app.get(
+    f"{URL_PREFIX}/upstream_stats",
+    tags=["Status"],
+    summary="Check the model servers",
+    description="Use this to check the health, the load and the errors of the model "
+    "servers behind the API server",
+    response_description="The statistics of the model servers",
+)
+async def upstream_stats():
+    return upstream.stats()
+
+
 @app.post(
     f"{URL_PREFIX}/named_entity_recognition",
+    responses=JOB_RESPONSES,
     response_model=NamedEntityRecognitionData,
     tags=["Models"],
     summary="Named Entity Recognition Model",
     description="Use this model to extract named entities from a given document",
     response_description="Return the list of predicted entities",
 )
-def named_entity_recognition(
+async def named_entity_recognition(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -415,17 +813,32 @@ def named_entity_recognition(
             )
         ),
     ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
 ):
     logger.info("User: {}", email)
 
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "ner")
+    if len(doc.text) > ASYNC_JOB_THRESHOLD:
+        return submit_job(email, doc, "named_entity_recognition", cache_control, response_format)
+
+    return format_response(
+        await annotate_doc(doc, "ner", cache_control, response_format),
+        response_format,
+    )
 
 
 @app.post(
     f"{URL_PREFIX}/relation_extraction",
+    responses=JOB_RESPONSES,
     response_model=RelationExtractionData,
     tags=["Models"],
     summary="Relation Extraction Model",
@@ -433,7 +846,7 @@ def named_entity_recognition(
     "from a given document",
     response_description="Return the list of predicted entities and relations",
 )
-def relation_extraction(
+async def relation_extraction(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -447,17 +860,32 @@ def relation_extraction(
             )
         ),
     ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
 ):
     logger.info("User: {}", email)
 
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "re")
+    if len(doc.text) > ASYNC_JOB_THRESHOLD:
+        return submit_job(email, doc, "relation_extraction", cache_control, response_format)
+
+    return format_response(
+        await annotate_doc(doc, "re", cache_control, response_format),
+        response_format,
+    )
 
 
 @app.post(
     f"{URL_PREFIX}/event_extraction",
+    responses=JOB_RESPONSES,
     response_model=EventExtractionData,
     tags=["Models"],
     summary="Event Extraction Model",
@@ -465,7 +893,7 @@ def relation_extraction(
     "from a given document",
     response_description="Return the list of predicted entities and events",
 )
-def event_extraction(
+async def event_extraction(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -481,17 +909,32 @@ def event_extraction(
             )
         ),
     ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
 ):
     logger.info("User: {}", email)
 
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "ee")
+    if len(doc.text) > ASYNC_JOB_THRESHOLD:
+        return submit_job(email, doc, "event_extraction", cache_control, response_format)
+
+    return format_response(
+        await annotate_doc(doc, "ee", cache_control, response_format),
+        response_format,
+    )
 
 
 @app.post(
     f"{URL_PREFIX}/entity_linking",
+    responses=JOB_RESPONSES,
     response_model=EntityLinkingData,
     tags=["Models"],
     summary="Entity Linking Model",
@@ -500,7 +943,55 @@ def event_extraction(
     response_description="Return the list of predicted entity mentions "
     "linked to UMLS concepts",
 )
-def entity_linking(
+async def entity_linking(
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+    doc: Doc = Body(
+        ...,
+        description="The document that needs to be annotated",
+        example=asdict(
+            Doc(
+                "BACKGROUND: Fibroblastic foci are characteristic features in "
+                "lung parenchyma of patients with idiopathic pulmonary fibrosis (IPF)."
+            )
+        ),
+    ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
+):
+    logger.info("User: {}", email)
+
+    if not verify_email(email):
+        raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+    if len(doc.text) > ASYNC_JOB_THRESHOLD:
+        return submit_job(email, doc, "entity_linking", cache_control, response_format)
+
+    return format_response(
+        await annotate_doc(doc, "el", cache_control, response_format),
+        response_format,
+    )
+
+
+@app.post(
+    f"{URL_PREFIX}/annotate_all",
+    responses=JOB_RESPONSES,
+    response_model=AllAnnotationsData,
+    tags=["Models"],
+    summary="All Models",
+    description="Use this to annotate a given document with the named entity recognition, "
+    "entity linking, relation extraction and event extraction models at once, "
+    "the document is split into sentences and tokens only once",
+    response_description="Return the predictions of the four models",
+)
+async def annotate_all(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -514,13 +1005,391 @@ def entity_linking(
             )
         ),
     ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
 ):
     logger.info("User: {}", email)
 
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "el")
+    if len(doc.text) > ASYNC_JOB_THRESHOLD:
+        return submit_job(email, doc, "annotate_all", cache_control, response_format)
+
+    return format_response(
+        await annotate_all_tasks(doc, cache_control, response_format),
+        response_format,
+    )
+
+
+@app.post(
+    f"{URL_PREFIX}/jobs",
+    response_model=JobData,
+    status_code=fastapi.status.HTTP_202_ACCEPTED,
+    tags=["Jobs"],
+    summary="Submit an annotation job",
+    description="Use this to annotate a long document in the background, whatever its "
+    "length: poll the status of the job, then get its result",
+    response_description="Return the submitted job",
+)
+async def submit_annotation_job(
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+    task: JobTask = Query(..., description="The model that annotates the document"),
+    doc: Doc = Body(
+        ...,
+        description="The document that needs to be annotated",
+        example=asdict(
+            Doc(
+                "BACKGROUND: Fibroblastic foci are characteristic features in "
+                "lung parenchyma of patients with idiopathic pulmonary fibrosis (IPF)."
+            )
+        ),
+    ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
+):
+    if not verify_email(email):
+        raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+    return submit_job(email, doc, task, cache_control, response_format)
+
+
+@app.get(
+    f"{URL_PREFIX}/jobs/{{job_id}}",
+    response_model=JobData,
+    tags=["Jobs"],
+    summary="Check an annotation job",
+    description="Use this to check the status of a job you submitted",
+    response_description="Return the job",
+)
+async def annotation_job(
+    job_id: str,
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+):
+    return job_data(get_job(job_id, email))
+
+
+@app.get(
+    f"{URL_PREFIX}/jobs/{{job_id}}/result",
+    tags=["Jobs"],
+    summary="Get the result of an annotation job",
+    description="Use this to get the annotations of a job once its status is `done`, "
+    "they are the response of the endpoint of its task",
+    response_description="Return the annotations of the document",
+)
+async def annotation_job_result(
+    job_id: str,
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+):
+    job = get_job(job_id, email)
+
+    if job.status == DONE:
+        return ORJSONResponse(job.result)
+
+    if job.status == FAILED:
+        if isinstance(job.error, HTTPException):
+            raise job.error
+
+        raise HTTPException(fastapi.status.HTTP_502_BAD_GATEWAY, repr(job.error))
+
+    raise HTTPException(fastapi.status.HTTP_409_CONFLICT, f"The job is {job.status}")
+
+
+@app.delete(
+    f"{URL_PREFIX}/jobs/{{job_id}}",
+    response_model=JobData,
+    tags=["Jobs"],
+    summary="Cancel an annotation job",
+    description="Use this to cancel a job that is queued or running",
+    response_description="Return the job",
+)
+async def cancel_annotation_job(
+    job_id: str,
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+):
+    return job_data(job_queue.cancel(get_job(job_id, email).id))
+
+
+@app.post(
+    f"{URL_PREFIX}/entity_linking/mentions",
+    response_model=EntityLinkingData,
+    tags=["Models"],
+    summary="Entity Linking Model (given mentions)",
+    description="Use this model to link the entity mentions you already found "
+    "in a given document to UMLS concepts, the mentions are not predicted. "
+    "A mention is linked in the context of its sentence, the mentions that span "
+    "several sentences are returned without a concept",
+    response_description="Return the given mentions linked to UMLS concepts, "
+    "their IDs are T1, T2, ... in the given order",
+)
+async def entity_linking_mentions(
+    email: str = Query(
+        ..., description="Your email address", example="example@domain.com"
+    ),
+    doc: MentionDoc = Body(
+        ...,
+        description="The document and the mentions that need to be linked",
+        example=asdict(
+            MentionDoc(
+                "BACKGROUND: Fibroblastic foci are characteristic features in "
+                "lung parenchyma of patients with idiopathic pulmonary fibrosis (IPF).",
+                [
+                    Mention(Span(12, 29), "Anatomical_entity"),
+                    Mention(Span(94, 123), "Disorder"),
+                ],
+            )
+        ),
+    ),
+    cache_control: Optional[str] = Header(
+        None,
+        description="`no-cache` to refresh the cached response, "
+        "`no-store` to bypass the response cache",
+    ),
+    response_format: ResponseFormat = Query(
+        "objects", alias="format", description=FORMAT_DESCRIPTION
+    ),
+):
+    logger.info("User: {}, {} mentions", email, len(doc.mentions))
+
+    if not verify_email(email):
+        raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+    for mention in doc.mentions:
+        if not 0 <= mention.span.start < mention.span.end <= len(doc.text):
+            raise HTTPException(
+                fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+                f"Invalid mention span: {mention.span}",
+            )
+
+    annotations = await fetch_annotations(
+        "entity_linking",
+        doc.text,
+        cache_control,
+        route="link_compact",
+        payload={
+            "mentions": [
+                {"start": mention.span.start, "end": mention.span.end, "type": mention.type}
+                for mention in doc.mentions
+            ]
+        },
+    )
+
+    if response_format == "columnar":
+        return format_response(
+            build_columnar_annotations(doc.text, annotations, "el"), response_format
+        )
+
+    return build_annotations(doc.text, annotations)
+
+
+ENTITY_TASKS = {
+    "re": ("relation_extraction", "Relation Extraction", "relations", RelationExtractionData),
+    "ee": ("event_extraction", "Event Extraction", "events", EventExtractionData),
+}
+
+
+def add_entity_endpoints(task, path, model_name, outputs, response_model):
+    @app.post(
+        f"{URL_PREFIX}/{path}/entities",
+        name=f"{path}_entities",
+        response_model=response_model,
+        tags=["Models"],
+        summary=f"{model_name} Model (given entities)",
+        description=f"Use this model to extract the {outputs} between the entities and "
+        "triggers you already found in a given document, they are not predicted. "
+        "A span is extended to the boundaries of its tokens, it must be in one sentence, "
+        "and its type must be one of the types of the model",
+        response_description=f"Return the given entities and the predicted {outputs}",
+    )
+    async def annotate_with_entities(
+        email: str = Query(
+            ..., description="Your email address", example="example@domain.com"
+        ),
+        doc: EntityDoc = Body(
+            ...,
+            description=f"The document and the entities that the {outputs} are extracted from",
+        ),
+        cache_control: Optional[str] = Header(
+            None,
+            description="`no-cache` to refresh the cached response, "
+            "`no-store` to bypass the response cache",
+        ),
+        response_format: ResponseFormat = Query(
+            "objects", alias="format", description=FORMAT_DESCRIPTION
+        ),
+    ):
+        logger.info("User: {}, {} entities", email, len(doc.entities))
+
+        if not verify_email(email):
+            raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+        for entity in doc.entities:
+            if not 0 <= entity.span.start < entity.span.end <= len(doc.text):
+                raise HTTPException(
+                    fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    f"Invalid entity span: {entity.span}",
+                )
+
+        try:
+            annotations = await fetch_annotations(
+                path,
+                doc.text,
+                cache_control,
+                route="entities_compact",
+                payload={
+                    "entities": [
+                        {"start": entity.span.start, "end": entity.span.end, "type": entity.type}
+                        for entity in doc.entities
+                    ]
+                },
+            )
+        except httpx.HTTPStatusError as e:
+            # An unknown type, or a span the model server could not locate
+            if e.response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY:
+                raise HTTPException(e.response.status_code, e.response.json()["detail"])
+
+            raise
+
+        if response_format == "columnar":
+            return format_response(
+                build_columnar_annotations(doc.text, annotations, task), response_format
+            )
+
+        return build_annotations(doc.text, annotations)
+
+
+for entity_task, (
+    entity_path,
+    entity_model_name,
+    entity_outputs,
+    entity_response_model,
+) in ENTITY_TASKS.items():
+    add_entity_endpoints(
+        entity_task, entity_path, entity_model_name, entity_outputs, entity_response_model
+    )
+
+
+BATCH_TASKS = {
+    "ner": ("named_entity_recognition", "Named Entity Recognition", NamedEntityRecognitionData),
+    "re": ("relation_extraction", "Relation Extraction", RelationExtractionData),
+    "ee": ("event_extraction", "Event Extraction", EventExtractionData),
+    "el": ("entity_linking", "Entity Linking", EntityLinkingData),
+}
+
+BATCH_RESPONSE_DESCRIPTION = (
+    "Return one JSON object per line, in completion order: "
+    '`{"index": <input index>, "result": <annotations>}`, or '
+    '`{"index": <input index>, "error": {"status_code": ..., "detail": ...}}`'
+)
+
+
+def add_batch_endpoints(task, path, model_name, response_model):
+    @app.post(
+        f"{URL_PREFIX}/{path}/batch",
+        name=f"{path}_batch",
+        tags=["Batch"],
+        summary=f"{model_name} Model (batch)",
+        description=f"Use this to annotate a list of documents with the {model_name} "
+        "model, the results are streamed back as soon as they are ready",
+        response_class=StreamingResponse,
+        response_description=BATCH_RESPONSE_DESCRIPTION,
+    )
+    async def annotate_batch(
+        email: str = Query(
+            ..., description="Your email address", example="example@domain.com"
+        ),
+        docs: List[Doc] = Body(
+            ...,
+            description="The list of documents that need to be annotated",
+        ),
+        cache_control: Optional[str] = Header(
+            None,
+            description="`no-cache` to refresh the cached response, "
+            "`no-store` to bypass the response cache",
+        ),
+        response_format: ResponseFormat = Query(
+            "objects", alias="format", description=FORMAT_DESCRIPTION
+        ),
+    ):
+        logger.info("User: {}, batch of {} documents", email, len(docs))
+
+        if not verify_email(email):
+            raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+        return StreamingResponse(
+            stream_annotations(
+                docs, task, response_model, cache_control, response_format
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+    @app.post(
+        f"{URL_PREFIX}/{path}/batch_file",
+        name=f"{path}_batch_file",
+        tags=["Batch"],
+        summary=f"{model_name} Model (JSONL file)",
+        description=f"Use this to annotate the documents of a JSONL file with the {model_name} "
+        "model, the file is read as the documents are annotated and the results are "
+        "streamed back as soon as they are ready",
+        response_class=StreamingResponse,
+        response_description=BATCH_RESPONSE_DESCRIPTION,
+    )
+    async def annotate_batch_file(
+        email: str = Query(
+            ..., description="Your email address", example="example@domain.com"
+        ),
+        file: UploadFile = File(
+            ...,
+            description='A JSONL file with one document per line: {"text": "..."}',
+        ),
+        cache_control: Optional[str] = Header(
+            None,
+            description="`no-cache` to refresh the cached response, "
+            "`no-store` to bypass the response cache",
+        ),
+        response_format: ResponseFormat = Query(
+            "objects", alias="format", description=FORMAT_DESCRIPTION
+        ),
+    ):
+        logger.info("User: {}, batch file {}", email, file.filename)
+
+        if not verify_email(email):
+            raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+
+        return StreamingResponse(
+            stream_annotations(
+                read_jsonl_docs(file.file),
+                task,
+                response_model,
+                cache_control,
+                response_format,
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+
+for batch_task, (batch_path, batch_model_name, batch_response_model) in BATCH_TASKS.items():
+    add_batch_endpoints(batch_task, batch_path, batch_model_name, batch_response_model)
 
 
 @app.post(
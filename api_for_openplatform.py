@@ -6,25 +6,29 @@ import socket
 
 # import tempfile
 from dataclasses import asdict
-from typing import List, Optional
+from typing import List
 
 import fastapi
 
 # import pandas as pd
 import regex
-import requests
 import uvicorn
 from fastapi import Body, FastAPI, HTTPException, Query
 from loguru import logger
-from pydantic import Field, parse_obj_as
+from pydantic import Field
 from pydantic.dataclasses import dataclass
 
 # import disease_network_generator_for_2d
 # import disease_network_generator_for_3d
 # from utils import file_utils
+from utils.api_annotations import Entity, LinkedEntity, Span, build_annotations
+from utils.upstream import UpstreamPool
 
 EXTERNAL_API_BASE_URL = os.environ.get('EXTERNAL_API_BASE_URL', 'http://127.0.0.1:9091')
 
+# The model servers (replicas) the requests are balanced over, comma-separated in EXTERNAL_API_BASE_URL
+UPSTREAM_URLS = [url.strip() for url in EXTERNAL_API_BASE_URL.split(",")]
+
 # LOG_FILE = "logs/api_for_openplatform.log"
 
 # file_utils.make_dirs(os.path.dirname(LOG_FILE))
@@ -81,35 +85,18 @@ app = FastAPI(
     redoc_url=None,
 )
 
+# Shared by all the requests, keeps the connections to the model servers alive
+upstream = UpstreamPool(UPSTREAM_URLS)
 
-@dataclass
-class Span:
-    start: int = Field(
-        ..., title="The index of the first character of the span in the document"
-    )
-    end: int = Field(
-        ..., title="The index of the first character after the span in the document"
-    )
 
-
-@dataclass
-class Entity:
-    id: str = Field(..., title="The ID of the predicted entity")
-    type: str = Field(..., title="The entity type of the predicted entity")
-    span: Span = Field(
-        ..., title="The position of the predicted entity in the document"
-    )
-    text: str = Field(..., title="The mention text of the predicted entity")
+@app.on_event("startup")
+async def start_upstream():
+    await upstream.start()
 
 
-@dataclass
-class LinkedEntity(Entity):
-    concept_id: Optional[str] = Field(
-        None, title="The UMLS concept ID linked to the predicted entity mention"
-    )
-    concept_name: Optional[str] = Field(
-        None, title="The UMLS canonical name corresponding to the UMLS concept ID"
-    )
+@app.on_event("shutdown")
+async def close_upstream():
+    await upstream.close()
 
 
 # @dataclass
@@ -307,7 +294,7 @@ def verify_email(email):
     return EMAIL_PATTERN.fullmatch(email)
 
 
-def annotate_doc(doc, task):
+async def annotate_doc(doc, task):
     task = {
         "ner": "named_entity_recognition",
         # "re": "relation_extraction",
@@ -315,74 +302,12 @@ def annotate_doc(doc, task):
         "el": "entity_linking",
     }[task]
 
-    response = requests.post(
-        f"{EXTERNAL_API_BASE_URL}/{task}/annotate", data={"text": doc.text}
+    # The compact columnar annotations of the model server, see wsgi.frontend.get_compact_doc_data
+    annotations = await upstream.post(
+        f"/{task}/annotate_compact", data={"text": doc.text}
     )
 
-    response.raise_for_status()
-
-    annotations = response.json()
-
-    doc = annotations["text"]
-
-    entities = []
-
-    for entity_id, entity_type, entity_spans in (
-        annotations["entities"] + annotations["triggers"]
-    ):
-        entity_starts, entity_ends = zip(*entity_spans)
-
-        entity_span = Span(min(entity_starts), max(entity_ends))
-
-        entities.append(
-            LinkedEntity(
-                entity_id,
-                entity_type,
-                entity_span,
-                doc[entity_span.start : entity_span.end],
-            )
-        )
-
-    id_entities = {entity.id: entity for entity in entities}
-
-    for _, _, entity_id, _, concept_id, _ in annotations["normalizations"]:
-        entity = id_entities[entity_id]
-
-        entity.concept_id = concept_id
-        entity.concept_name = annotations["cui_data"][concept_id]
-
-    # relations = []
-
-    # for (
-    #     relation_id,
-    #     relation_type,
-    #     ((_, relation_left_arg_id), (_, relation_right_arg_id)),
-    # ) in annotations["relations"]:
-    #     relations.append(
-    #         Relation(
-    #             relation_id, relation_type, relation_left_arg_id, relation_right_arg_id
-    #         )
-    #     )
-
-    # events = parse_obj_as(List[Event], annotations["events"])
-
-    # id_events = {event.id: event for event in events}
-
-    # for attribute_id, attribute_type, attribute_target, _ in annotations["attributes"]:
-    #     id_events[attribute_target].modalities.append(
-    #         Modality(attribute_id, attribute_type)
-    #     )
-
-    return {
-        "text": doc,
-        "entities": entities,
-        # "relations": relations,
-        # "events": events,
-        "token_boundaries": parse_obj_as(List[Span], annotations["token_offsets"]),
-        "sentence_boundaries": parse_obj_as(
-            List[Span], annotations["sentence_offsets"]
-        ),
-    }
+    return build_annotations(doc.text, annotations)
 
 
 @app.get(
@@ -393,7 +318,7 @@ def annotate_doc(doc, task):
     description="Use this to check the current status of the API server",
     response_description="Status OK",
 )
-def status():
+async def status():
     return StatusData("Running")
 
 
@@ -405,7 +330,7 @@ def status():
     description="Use this model to extract named entities from a given document",
     response_description="Return the list of predicted entities",
 )
-def named_entity_recognition(
+async def named_entity_recognition(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -425,7 +350,7 @@ def named_entity_recognition(
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "ner")
+    return await annotate_doc(doc, "ner")
 
 
 # @app.post(
@@ -437,7 +362,7 @@ def named_entity_recognition(
 #     "from a given document",
 #     response_description="Return the list of predicted entities and relations",
 # )
-# def relation_extraction(
+# async def relation_extraction(
 #     email: str = Query(
 #         ..., description="Your email address", example="example@domain.com"
 #     ),
@@ -457,7 +382,7 @@ def named_entity_recognition(
 #     if not verify_email(email):
 #         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-#     return annotate_doc(doc, "re")
+#     return await annotate_doc(doc, "re")
 
 
 # @app.post(
@@ -469,7 +394,7 @@ def named_entity_recognition(
 #     "from a given document",
 #     response_description="Return the list of predicted entities and events",
 # )
-# def event_extraction(
+# async def event_extraction(
 #     email: str = Query(
 #         ..., description="Your email address", example="example@domain.com"
 #     ),
@@ -491,7 +416,7 @@ def named_entity_recognition(
 #     if not verify_email(email):
 #         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-#     return annotate_doc(doc, "ee")
+#     return await annotate_doc(doc, "ee")
 
 
 @app.post(
@@ -504,7 +429,7 @@ def named_entity_recognition(
     response_description="Return the list of predicted entity mentions "
     "linked to UMLS concepts",
 )
-def entity_linking(
+async def entity_linking(
     email: str = Query(
         ..., description="Your email address", example="example@domain.com"
     ),
@@ -524,7 +449,7 @@ def entity_linking(
     if not verify_email(email):
         raise HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Not authenticated")
 
-    return annotate_doc(doc, "el")
+    return await annotate_doc(doc, "el")
 
 
 # @app.post(
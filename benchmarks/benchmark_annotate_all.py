@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the four annotation routes of the model server with the combined one (/annotate_all).
+
+    python -m benchmarks.benchmark_annotate_all <data_dir> [--base_url http://127.0.0.1:9091] [--repeat 3]
+
+Every *.txt file of the data directory is sent to a running model server, once to each task and once
+to the combined route, which splits the document once and runs the tasks in parallel. The report gives
+the mean latency per document of the sum of the four tasks, of the slowest of them and of the combined
+route, and checks that the combined route gives the same annotations as the four tasks. The sentence
+caches of the model server are bypassed by adding a unique line to each document of each run.
+"""
+import argparse
+import os
+import time
+from glob import glob
+
+import requests
+
+from utils import file_utils
+
+TASKS = {
+    "ner": "named_entity_recognition",
+    "el": "entity_linking",
+    "re": "relation_extraction",
+    "ee": "event_extraction",
+}
+
+
+def post(session, url, text):
+    start = time.perf_counter()
+
+    response = session.post(url, data={"text": text})
+    response.raise_for_status()
+
+    return response.json(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--base_url", default=os.environ.get("EXTERNAL_API_BASE_URL", "http://127.0.0.1:9091").split(",")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = [file_utils.read_text(path) for path in sorted(glob(os.path.join(args.data_dir, "*.txt")))]
+
+    timings = {"sum of tasks": [], "slowest task": [], "annotate_all": []}
+    identical = True
+
+    with requests.Session() as session:
+        for repeat in range(args.repeat):
+            for index, doc in enumerate(docs):
+                text = "{}\nRun {} of document {}.".format(doc, repeat, index)
+
+                separate = {}
+                task_timings = []
+
+                for task, path in TASKS.items():
+                    separate[task], timing = post(session, f"{args.base_url}/{path}/annotate_compact", text)
+                    task_timings.append(timing)
+
+                combined, timing = post(session, f"{args.base_url}/annotate_all/annotate_compact", text)
+
+                timings["sum of tasks"].append(sum(task_timings))
+                timings["slowest task"].append(max(task_timings))
+                timings["annotate_all"].append(timing)
+
+                identical = identical and combined == separate
+
+    print("{} documents, {} runs".format(len(docs), args.repeat))
+    for name, values in timings.items():
+        print("{:<14}{:>10.3f} s/doc".format(name, sum(values) / len(values)))
+
+    print("identical annotations:", identical)
+
+
+if __name__ == "__main__":
+    main()
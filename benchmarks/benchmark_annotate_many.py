@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the annotation of documents one by one with SemELAnnotator.annotate_many on the same documents.
+
+    python -m benchmarks.benchmark_annotate_many <data_dir> [--linking] [--gss_dir tools/geniass] [--cache_dir .cache]
+
+Every *.txt file of the data directory is annotated, the model paths are read from config.ini. The
+sentence cache is disabled so that both ways predict every sentence. The report gives the wall-clock
+time and the documents per second of both ways and checks that the annotations are identical (the same
+check runs with in-memory predictors in tests/test_semel_annotator.py).
+"""
+import argparse
+import os
+import time
+from glob import glob
+
+from annotator import SemELAnnotator
+from utils import file_utils
+from wsgi.config import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--linking", action="store_true")
+    parser.add_argument("--gss_dir", default=config["gss_dir"])
+    parser.add_argument("--cache_dir", default=".cache")
+    args = parser.parse_args()
+
+    annotator = SemELAnnotator(
+        config["ner_dir"],
+        config["cg_dir"],
+        config["cr_dir"],
+        config["kbe_dir"],
+        args.gss_dir,
+        args.cache_dir,
+        args.linking,
+        sentence_cache_size=0,
+    )
+
+    docs = [file_utils.read_text(path) for path in sorted(glob(os.path.join(args.data_dir, "*.txt")))]
+
+    # The first document warms up the models
+    annotator(docs[0])
+
+    start = time.perf_counter()
+    one_by_one = [annotator(doc) for doc in docs]
+    one_by_one_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pooled = annotator.annotate_many(docs)
+    pooled_time = time.perf_counter() - start
+
+    print("{} documents".format(len(docs)))
+    for name, timing in (("one by one", one_by_one_time), ("pooled", pooled_time)):
+        print("{:<12}{:>10.2f} s{:>10.2f} docs/s".format(name, timing, len(docs) / timing))
+
+    print("identical annotations:", all(
+        str(left[0]) == str(right[0]) and left[1:] == right[1:] for left, right in zip(one_by_one, pooled)
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the sequential batching of DeepEM sentences with the length-bucketed batching.
+
+    python -m benchmarks.benchmark_batching --yaml <predict yaml> --token_budget 4096 [--test_data <dir>] [--repeat 3]
+
+Reports the padding ratio of the subwords and spans and the wall-clock time of the forward passes.
+"""
+import argparse
+import time
+
+import torch
+
+from loader.prepData import prepdata
+from loader.prepNN import sampler
+from predictor import load_model, load_parameters, read_test_data
+from utils import utils
+
+
+def run(model, dataloader, nntest_data, params):
+    start = time.perf_counter()
+
+    with torch.no_grad():
+        for batch in dataloader:
+            tensors = utils.get_tensors(batch, nntest_data, params)
+            model(tensors)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yaml", required=True)
+    parser.add_argument("--token_budget", type=int, default=4096)
+    parser.add_argument("--max_batchsize", type=int, default=None)
+    parser.add_argument("--test_data", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = load_parameters(args.yaml)
+    if args.test_data:
+        params["test_data"] = args.test_data
+
+    model = load_model(params)
+    model.eval()
+
+    test_data = prepdata.prep_input_data(params["test_data"], params)
+
+    results = {}
+
+    for name, token_budget in (("sequential", None), ("bucketed", args.token_budget)):
+        run_params = params.copy()
+        run_params["batch_token_budget"] = token_budget
+        run_params["max_batchsize"] = args.max_batchsize
+
+        nntest_data, dataloader = read_test_data(test_data, run_params)
+
+        lengths, span_counts = sampler.get_sentence_lengths(nntest_data["nn_data"])
+        batches = [batch[0].tolist() for batch in dataloader]
+        token_padding, span_padding = sampler.padding_ratio(batches, lengths, span_counts)
+
+        # The first run warms up the allocator and the caches
+        run(model, dataloader, nntest_data, run_params)
+        timings = [run(model, dataloader, nntest_data, run_params) for _ in range(args.repeat)]
+
+        results[name] = (len(batches), token_padding, span_padding, min(timings))
+
+    print("{} sentences".format(len(lengths)))
+    print("{:<12}{:>10}{:>18}{:>16}{:>12}".format("", "batches", "subword padding", "span padding", "time (s)"))
+    for name, (num_batches, token_padding, span_padding, timing) in results.items():
+        print("{:<12}{:>10}{:>17.1f}%{:>15.1f}%{:>12.2f}".format(
+            name, num_batches, token_padding * 100, span_padding * 100, timing))
+
+    sequential_time, bucketed_time = results["sequential"][-1], results["bucketed"][-1]
+    print("speed-up: x{:.2f}".format(sequential_time / bucketed_time if bucketed_time else float("inf")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the padded and the unpadded execution of the BERT encoder (BertModel(..., unpad=True)).
+
+    python -m benchmarks.benchmark_bert_unpadding [--bert_model <dir with bert_config.json>] [--lengths <file>]
+                                                  [--batch_size 16] [--batches 20] [--repeat 3] [--device cpu]
+
+The sentence lengths (in subwords) are read from a file with one length per line, e.g. the lengths of a
+tokenized corpus, or drawn from a log-normal distribution close to the one of PubMed sentences (median
+around 30 subwords, long tail up to 256). Without --bert_model, a BERT-base configuration with random
+weights is used. The report gives the padding ratio, the time of both modes and the largest difference
+between the hidden states of the real tokens, the only ones read by NestedNERModel (the same hidden states
+are tested on a tiny configuration in tests/test_bert_unpadding.py).
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from bert.modeling import BertConfig, BertModel
+
+
+def sentence_lengths(args, rng):
+    if args.lengths:
+        with open(args.lengths) as f:
+            lengths = np.array([int(line) for line in f if line.strip()])
+        return rng.choice(lengths, size=args.batch_size * args.batches)
+
+    lengths = rng.lognormal(mean=np.log(30), sigma=0.5, size=args.batch_size * args.batches)
+    return np.clip(lengths.astype(int), 3, 256)
+
+
+def make_batches(lengths, batch_size, vocab_size, rng):
+    batches = []
+    for start in range(0, len(lengths), batch_size):
+        batch_lengths = lengths[start:start + batch_size]
+        max_length = batch_lengths.max()
+
+        input_ids = torch.zeros((len(batch_lengths), max_length), dtype=torch.long)
+        attention_mask = torch.zeros((len(batch_lengths), max_length), dtype=torch.long)
+        for xx, length in enumerate(batch_lengths):
+            input_ids[xx, :length] = torch.tensor(rng.integers(1, vocab_size, size=length))
+            attention_mask[xx, :length] = 1
+
+        batches.append((input_ids, attention_mask))
+
+    return batches
+
+
+def run(model, batches, unpad, device):
+    outputs = []
+
+    with torch.no_grad():
+        for input_ids, attention_mask in batches:
+            embeddings, _ = model(input_ids, attention_mask=attention_mask, output_all_encoded_layers=False,
+                                  unpad=unpad)
+            outputs.append(embeddings[attention_mask.bool()])
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bert_model", default=None)
+    parser.add_argument("--lengths", default=None)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    rng = np.random.default_rng(args.seed)
+
+    if args.bert_model:
+        model = BertModel.from_pretrained(args.bert_model)
+    else:
+        model = BertModel(BertConfig(vocab_size_or_config_json_file=30522))
+    model.to(device)
+    model.eval()
+
+    lengths = sentence_lengths(args, rng)
+    batches = [(input_ids.to(device), attention_mask.to(device))
+               for input_ids, attention_mask in make_batches(lengths, args.batch_size,
+                                                             model.config.vocab_size, rng)]
+
+    real_tokens = sum(int(attention_mask.sum()) for _, attention_mask in batches)
+    padded_tokens = sum(attention_mask.numel() for _, attention_mask in batches)
+
+    results = {}
+    for name, unpad in (("padded", False), ("unpadded", True)):
+        # The first run warms up the allocator and the caches
+        outputs = run(model, batches, unpad, device)
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run(model, batches, unpad, device)
+            timings.append(time.perf_counter() - start)
+
+        results[name] = (outputs, min(timings))
+
+    print("{} sentences in {} batches, median length {:.0f}, padding {:.1f}%".format(
+        len(lengths), len(batches), np.median(lengths), 100 * (1 - real_tokens / padded_tokens)))
+    for name, (_, timing) in results.items():
+        print("{:<10}{:>10.2f} s".format(name, timing))
+
+    padded_time, unpadded_time = results["padded"][1], results["unpadded"][1]
+    print("speed-up: x{:.2f}".format(padded_time / unpadded_time if unpadded_time else float("inf")))
+
+    max_difference = max((padded - unpadded).abs().max().item()
+                         for padded, unpadded in zip(results["padded"][0], results["unpadded"][0]))
+    print("max abs difference on the real tokens: {:.2e}".format(max_difference))
+
+
+if __name__ == "__main__":
+    main()
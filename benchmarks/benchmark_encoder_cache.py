@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the predictions of DeepEM with and without the cache of the BERT encodings (bert_cache_mb).
+
+    python -m benchmarks.benchmark_encoder_cache --yaml <predict yaml> [--test_data <dir>] [--cache_mb 256]
+                                                 [--fp16] [--repeat 3]
+
+The test data is predicted without the cache, then with an empty cache (all misses) and with the cache
+filled by the previous runs (re-annotation of the same documents). The report gives the wall-clock time
+of each run, the hit rate, the size and the evictions of the cache, and checks that the predictions are
+identical to the ones without the cache (with --fp16, small differences of the scores can flip a label).
+It needs a trained model; the cached encodings themselves are tested against the encoder in
+tests/test_encoder_cache.py.
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.benchmark_inference import run, same
+from loader.prepData import prepdata
+from predictor import load_model, load_parameters, read_test_data
+from utils.encoder_cache import EncoderCache
+
+
+def measure(model, dataloader, nntest_data, params, repeat, before_run=None):
+    timings = []
+    for _ in range(repeat):
+        if before_run is not None:
+            before_run()
+        start = time.perf_counter()
+        outputs = run(model, dataloader, nntest_data, params, inference=False)
+        timings.append(time.perf_counter() - start)
+
+    return outputs, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yaml", required=True)
+    parser.add_argument("--test_data", default=None)
+    parser.add_argument("--cache_mb", type=float, default=256)
+    parser.add_argument("--fp16", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = load_parameters(args.yaml)
+    if args.test_data:
+        params["test_data"] = args.test_data
+
+    if params["use_lstm"]:
+        parser.error("The encoder cache only applies to the BERT encoder")
+
+    model = load_model(params)
+    model.eval()
+
+    ner_layer = model.NER_layer
+    cache = EncoderCache(int(args.cache_mb * 2 ** 20), fp16=args.fp16)
+
+    test_data = prepdata.prep_input_data(params["test_data"], params)
+    nntest_data, dataloader = read_test_data(test_data, params)
+
+    # The first run warms up the allocator and the caches
+    ner_layer.encoder_cache = None
+    run(model, dataloader, nntest_data, params, inference=False)
+
+    results = {"no cache": measure(model, dataloader, nntest_data, params, args.repeat)}
+
+    ner_layer.encoder_cache = cache
+    results["cold cache"] = measure(model, dataloader, nntest_data, params, args.repeat, before_run=cache.clear)
+
+    cache.hits = cache.misses = 0
+    results["warm cache"] = measure(model, dataloader, nntest_data, params, args.repeat)
+
+    print("{} sentences, {} batches".format(len(nntest_data["nn_data"]["ids"]), len(dataloader)))
+    for name, (_, timing) in results.items():
+        print("{:<12}{:>10.2f} s".format(name, timing))
+
+    stats = cache.stats()
+    print("warm hit rate: {:.1f}%".format(100 * stats["hit_rate"]))
+    print("cache: {} entries, {:.1f} / {:.1f} MB, {} evictions".format(
+        stats["entries"], stats["bytes"] / 2 ** 20, stats["max_bytes"] / 2 ** 20, stats["evictions"]))
+
+    for name in ("cold cache", "warm cache"):
+        print("identical predictions ({}):".format(name), same(results["no cache"][0], results[name][0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Check and time the pruned event candidate enumeration of EV_Generator on a worst-case trigger.
+
+    python -m benchmarks.benchmark_event_candidates --yaml <predict yaml> [--n_args 16] [--repeat 3]
+
+The trigger is given `n_args` arguments drawn from the (relation type, argument type) pairs of the event
+structures of the trigger type with the most structures, so that most combinations look plausible.
+The candidates (without `max_ev_cands_per_tr`) must be the same as the ones of the exhaustive enumeration
+of all combinations of up to 4 arguments, which is also timed for comparison (the equivalence is tested
+on random structures in tests/test_event_candidates.py).
+"""
+import argparse
+import collections
+import itertools
+import time
+
+import numpy as np
+
+from model.EVGen import EV_Generator
+from predictor import load_parameters
+
+
+def exhaustive_combinations(args_list, ev_structs, max_ev_args):
+    """Every combination of arguments checked against the structure lists, as before the pruning."""
+    max_n_args = 4 if max_ev_args == 4 else 3
+
+    combinations = []
+    for n_args in range(1, max_n_args + 1):
+        for arg_ids in itertools.combinations(range(len(args_list)), n_args):
+            cand_args = collections.Counter(args_list[xx] for xx in arg_ids)
+            if ev_structs[n_args] != -1 and cand_args in ev_structs[n_args]:
+                combinations.append(arg_ids)
+
+    return combinations
+
+
+def worst_case_trigger(structs_map, n_args):
+    """Trigger type with the most structures and a list of arguments cycling over its argument pairs."""
+    def count_structs(typeid):
+        return sum(len(structs) for structs in structs_map[typeid][1:] if structs != -1)
+
+    typeid = max(range(len(structs_map)), key=count_structs)
+
+    pairs = sorted({pair for structs in structs_map[typeid][1:] if structs != -1
+                    for struct in structs for pair in struct})
+
+    args_list = [pairs[xx % len(pairs)] for xx in range(n_args)]
+
+    # same format as EV_Generator.group_rels: [trigger type, relation id, (rtype, etype), (batch id, entity id)]
+    rels_group = [[typeid, xx, pair, (0, xx + 1)] for xx, pair in enumerate(args_list)]
+
+    return typeid, args_list, rels_group
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yaml", required=True)
+    parser.add_argument("--n_args", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = load_parameters(args.yaml)
+    params["max_ev_cands_per_tr"] = None
+
+    generator = EV_Generator(params)
+    generator.eval()
+
+    structs_map = params["mappings"]["flat_types_id_map"]
+    typeid, args_list, rels_group = worst_case_trigger(structs_map, args.n_args)
+    ev_structs = structs_map[typeid]
+
+    # no truth: eval-mode candidates
+    ev_truth = -1 * np.ones(params["max_ev_args"] + 1, dtype=object)
+    trid = (0, 0)
+
+    def pruned():
+        return generator.create_multiple_flat_arg_candidates(trid, rels_group, args_list, len(args_list), ev_truth,
+                                                             [-1], ev_structs)
+
+    def exhaustive():
+        return exhaustive_combinations(args_list, ev_structs, params["max_ev_args"])
+
+    pruned_ids = sorted(tuple(cand[5]) for cand in pruned())
+    exhaustive_ids = sorted(exhaustive())
+
+    timings = {}
+    for name, enumerate_candidates in (("exhaustive", exhaustive), ("pruned", pruned)):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            enumerate_candidates()
+            times.append(time.perf_counter() - start)
+        timings[name] = min(times)
+
+    print("trigger type id {}, {} arguments, {} candidates".format(typeid, len(args_list), len(pruned_ids)))
+    for name, timing in timings.items():
+        print("{:<12}{:>10.1f} ms".format(name, timing * 1000))
+    print("speed-up: x{:.2f}".format(timings["exhaustive"] / timings["pruned"] if timings["pruned"] else float("inf")))
+    print("same candidates:", pruned_ids == exhaustive_ids)
+
+
+if __name__ == "__main__":
+    main()
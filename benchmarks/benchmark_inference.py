@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the prediction path of DeepEM with the inference-only path on raw text.
+
+    python -m benchmarks.benchmark_inference --yaml <predict yaml> [--test_data <dir>] [--repeat 3]
+
+The yaml must be a joint prediction on raw text (predict, no gold_eval, no pipelines). Both paths are
+run on the same batches; the report gives the wall-clock time, the Python function calls and the peak
+of the Python allocations of each path, and checks that the predictions are identical.
+"""
+import argparse
+import cProfile
+import pstats
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+
+from loader.prepData import prepdata
+from predictor import load_model, load_parameters, read_test_data
+from utils import utils
+
+
+def run(model, dataloader, nntest_data, params, inference):
+    # the trigger ids of the predicted terms are numbered from the first batch
+    model.trigger_id = -1
+
+    outputs = []
+
+    with torch.no_grad():
+        for batch in dataloader:
+            tensors = utils.get_tensors(batch, nntest_data, params, inference=inference)
+            ner_out, rel_out, ev_out, _ = model(tensors, inference=inference)
+
+            outputs.append((
+                ner_out['preds'],
+                [dict(terms.id2term) for terms in ner_out['terms']],
+                rel_out['preds'] if rel_out is not None else None,
+                ev_out['output'] if ev_out is not None else None,
+            ))
+
+    return outputs
+
+
+def same(left, right):
+    if isinstance(left, torch.Tensor) or isinstance(right, torch.Tensor):
+        return torch.equal(torch.as_tensor(left), torch.as_tensor(right))
+    if isinstance(left, np.ndarray) or isinstance(right, np.ndarray):
+        return np.array_equal(left, right)
+    if isinstance(left, dict) and isinstance(right, dict):
+        return left.keys() == right.keys() and all(same(left[key], right[key]) for key in left)
+    if isinstance(left, (list, tuple)) and isinstance(right, (list, tuple)):
+        return len(left) == len(right) and all(same(l, r) for l, r in zip(left, right))
+    return left == right
+
+
+def measure(model, dataloader, nntest_data, params, inference, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = run(model, dataloader, nntest_data, params, inference)
+        timings.append(time.perf_counter() - start)
+
+    profiler = cProfile.Profile()
+    profiler.runcall(run, model, dataloader, nntest_data, params, inference)
+    calls = pstats.Stats(profiler).total_calls
+
+    tracemalloc.start()
+    run(model, dataloader, nntest_data, params, inference)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return outputs, min(timings), calls, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yaml", required=True)
+    parser.add_argument("--test_data", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = load_parameters(args.yaml)
+    if args.test_data:
+        params["test_data"] = args.test_data
+
+    params["inference"] = True
+    if not utils.is_inference(params):
+        parser.error("The inference path needs a joint prediction yaml (predict, no gold_eval, no pipelines)")
+
+    model = load_model(params)
+    model.eval()
+
+    test_data = prepdata.prep_input_data(params["test_data"], params)
+    nntest_data, dataloader = read_test_data(test_data, params)
+
+    # The first run warms up the allocator and the caches
+    run(model, dataloader, nntest_data, params, inference=False)
+
+    results = {}
+    for name, inference in (("predict", False), ("inference", True)):
+        results[name] = measure(model, dataloader, nntest_data, params, inference, args.repeat)
+
+    print("{} sentences, {} batches".format(len(nntest_data["nn_data"]["ids"]), len(dataloader)))
+    print("{:<12}{:>12}{:>18}{:>20}".format("", "time (s)", "python calls", "peak alloc (MB)"))
+    for name, (_, timing, calls, peak) in results.items():
+        print("{:<12}{:>12.2f}{:>18}{:>20.1f}".format(name, timing, calls, peak / 2 ** 20))
+
+    predict_outputs, predict_time = results["predict"][:2]
+    inference_outputs, inference_time = results["inference"][:2]
+    print("speed-up: x{:.2f}".format(predict_time / inference_time if inference_time else float("inf")))
+    print("identical predictions:", same(predict_outputs, inference_outputs))
+
+
+if __name__ == "__main__":
+    main()
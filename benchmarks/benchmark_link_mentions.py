@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Compare entity linking with NER (SemELAnnotator) with the linking of given mentions (SemELAnnotator.link).
+
+    python -m benchmarks.benchmark_link_mentions <data_dir> [--gss_dir tools/geniass] [--cache_dir .cache] [--repeat 3]
+
+Every *.txt file of the data directory is annotated, the model paths are read from config.ini. The
+mentions predicted by the full annotation are then given to SemELAnnotator.link, as a client with its
+own mentions would. The documents are split beforehand and the sentence cache is disabled, so that
+both ways only differ by NER. The report gives the wall-clock time of both ways and checks that the
+annotations are identical.
+"""
+import argparse
+import os
+import time
+from glob import glob
+
+from annotator import SemELAnnotator, split_document
+from utils import file_utils
+from wsgi.config import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--gss_dir", default=config["gss_dir"])
+    parser.add_argument("--cache_dir", default=".cache")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    annotator = SemELAnnotator(
+        config["ner_dir"],
+        config["cg_dir"],
+        config["cr_dir"],
+        config["kbe_dir"],
+        args.gss_dir,
+        args.cache_dir,
+        True,
+        sentence_cache_size=0,
+    )
+
+    docs = [file_utils.read_text(path) for path in sorted(glob(os.path.join(args.data_dir, "*.txt")))]
+    splits = [split_document(annotator.geniass, doc) for doc in docs]
+
+    # The first document warms up the models
+    annotator.annotate_many(docs[:1], splits[:1])
+
+    timings = {"ner + linking": float("inf"), "linking only": float("inf")}
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        full = [annotator.annotate_many([doc], [split])[0] for doc, split in zip(docs, splits)]
+        timings["ner + linking"] = min(timings["ner + linking"], time.perf_counter() - start)
+
+        mentions = [
+            [(ann.spans[0][0], ann.spans[0][1], ann.type) for ann in annotations.get_textbounds()]
+            for annotations, _, _ in full
+        ]
+
+        start = time.perf_counter()
+        linked = [
+            annotator.link(doc, doc_mentions, split)
+            for doc, doc_mentions, split in zip(docs, mentions, splits)
+        ]
+        timings["linking only"] = min(timings["linking only"], time.perf_counter() - start)
+
+    print("{} documents, {} mentions".format(len(docs), sum(map(len, mentions))))
+    for name, timing in timings.items():
+        print("{:<16}{:>10.2f} s{:>10.2f} docs/s".format(name, timing, len(docs) / timing))
+
+    print("identical annotations:", all(
+        str(left[0]) == str(right[0]) and left[1:] == right[1:] for left, right in zip(full, linked)
+    ))
+
+
+if __name__ == "__main__":
+    main()
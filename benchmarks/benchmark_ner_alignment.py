@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Check and time the tensor alignment of the NER predictions (NestedNERModel.align_preds) on synthetic spans.
+
+    python -m benchmarks.benchmark_ner_alignment [--sentences 64] [--length 60] [--max_span_width 10]
+                                                 [--num_labels 40] [--ner_label_limit 3] [--repeat 3]
+
+All the spans of each sentence up to max_span_width are scored, so that nested and overlapping spans are
+labelled, and some spans get several labels over the threshold. The alignment must give, for every span,
+the same gold slots as the former Python loop and the same set of labels in the other slots, with and
+without gold labels (tests/test_ner_alignment.py checks the same on small sentences and pins the top-k
+order of the other labels).
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from model.NERNet import NestedNERModel
+
+
+def loop_align_preds(all_preds, all_golds):
+    """The former alignment: one Python loop over the spans."""
+    all_aligned_preds = []
+    for preds, golds in zip(all_preds, all_golds):
+        aligned_preds = []
+        pred_set = set(preds) - {0}
+        gold_set = set(golds) - {0}
+        shared = pred_set & gold_set
+        diff = pred_set - shared
+        for gold in golds:
+            if gold in shared:
+                aligned_preds.append(gold)
+            else:
+                aligned_preds.append(diff.pop() if diff else 0)
+        all_aligned_preds.append(aligned_preds)
+
+    return np.array(all_aligned_preds, dtype=all_preds.dtype)
+
+
+def synthetic_spans(args, rng):
+    """Top-k label ids of the predictions and the golds of all the spans of the sentences."""
+    num_spans = sum(min(args.max_span_width, args.length - start)
+                    for start in range(args.length)) * args.sentences
+
+    label_ids = torch.arange(1, args.num_labels + 1, dtype=torch.uint8)
+
+    # a few labels per span over the threshold, sometimes several of them
+    scores = torch.tensor(rng.beta(0.3, 3.0, size=(num_spans, args.num_labels)), dtype=torch.float32)
+    golds = torch.tensor(rng.random((num_spans, args.num_labels)) < 0.05)
+
+    _, top_indices = torch.topk(scores, k=args.ner_label_limit, dim=-1)
+    preds = torch.gather((scores > 0.5) * label_ids, dim=1, index=top_indices)
+
+    golds, _ = torch.sort(golds * label_ids, dim=-1, descending=True)
+    golds = torch.narrow(golds, 1, 0, args.ner_label_limit)
+
+    return preds, golds
+
+
+def same_alignment(aligned, reference, golds):
+    # the gold slots are the same, the other slots hold the same labels in another order
+    gold_slots = (golds > 0) & (aligned == golds)
+    return bool(np.array_equal(gold_slots, (golds > 0) & (reference == golds))
+                and np.array_equal(np.sort(aligned, axis=-1), np.sort(reference, axis=-1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=64)
+    parser.add_argument("--length", type=int, default=60)
+    parser.add_argument("--max_span_width", type=int, default=10)
+    parser.add_argument("--num_labels", type=int, default=40)
+    parser.add_argument("--ner_label_limit", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    preds, golds = synthetic_spans(args, np.random.default_rng(args.seed))
+
+    np_preds = preds.numpy()
+    np_golds = golds.numpy()
+    no_golds = np.zeros_like(np_golds)
+
+    cases = {
+        "with golds": (lambda: NestedNERModel.align_preds(preds, golds).numpy(),
+                       lambda: loop_align_preds(np_preds, np_golds), np_golds),
+        "inference": (lambda: NestedNERModel.align_preds(preds).numpy(),
+                      lambda: loop_align_preds(np_preds, no_golds), no_golds),
+    }
+
+    print("{} spans, {} with several labels".format(len(np_preds), int(((np_preds > 0).sum(-1) > 1).sum())))
+    print("{:<12}{:>12}{:>12}{:>10}".format("", "loop (ms)", "tensor (ms)", "same"))
+
+    for name, (tensor_align, loop_align, case_golds) in cases.items():
+        timings = {}
+        for kind, align in (("loop", loop_align), ("tensor", tensor_align)):
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                aligned = align()
+                times.append(time.perf_counter() - start)
+            timings[kind] = (min(times), aligned)
+
+        same = same_alignment(timings["tensor"][1], timings["loop"][1], case_golds)
+        print("{:<12}{:>12.1f}{:>12.1f}{:>10}".format(name, timings["loop"][0] * 1000, timings["tensor"][0] * 1000,
+                                                      str(same)))
+
+
+if __name__ == "__main__":
+    main()
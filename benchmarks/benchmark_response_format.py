@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the gateway CPU time per request of the object responses with the columnar ones (format=columnar).
+
+    python -m benchmarks.benchmark_response_format <data_dir> [--task event_extraction]
+                                                   [--base_url http://127.0.0.1:9091] [--repeat 3]
+
+The compact payloads of every *.txt file of the data directory are fetched once from a running model
+server, then the endpoint of the task is called in-process with the upstream answering those payloads
+and the response cache bypassed, so that only the work of the gateway is measured: building the
+response, validating it against the response model and serializing it. The report gives the CPU time
+per request and the response size of both formats, and checks that they hold the same annotations (as
+tests/test_api_annotations.py does on a synthetic payload).
+"""
+import argparse
+import os
+import time
+from glob import glob
+
+import requests
+from fastapi.testclient import TestClient
+
+import api
+from benchmarks.benchmark_transport import TASKS, CompactUpstream
+from utils import file_utils
+
+
+def columnar_to_objects(result):
+    """The object response of the columnar one, for the comparison."""
+    def spans(columns):
+        return [{"start": start, "end": end} for start, end in zip(columns["starts"], columns["ends"])]
+
+    objects = {
+        "text": result["text"],
+        "token_boundaries": spans(result["token_boundaries"]),
+        "sentence_boundaries": spans(result["sentence_boundaries"]),
+    }
+
+    entities = result["entities"]
+    objects["entities"] = [
+        dict(zip(("id", "type", "span", "text"), entity))
+        for entity in zip(entities["ids"], entities["types"], spans(entities), entities["texts"])
+    ]
+
+    if "concept_ids" in entities:
+        for entity, concept_id, concept_name in zip(
+            objects["entities"], entities["concept_ids"], entities["concept_names"]
+        ):
+            entity.update(concept_id=concept_id, concept_name=concept_name)
+
+    if "relations" in result:
+        relations = result["relations"]
+        objects["relations"] = [
+            dict(zip(("id", "type", "left_arg_id", "right_arg_id"), relation))
+            for relation in zip(
+                relations["ids"], relations["types"], relations["left_arg_ids"], relations["right_arg_ids"]
+            )
+        ]
+
+    if "events" in result:
+        events = result["events"]
+        arg_offsets = events["arg_offsets"]
+        modality_offsets = events["modality_offsets"]
+
+        objects["events"] = [
+            {
+                "id": event_id,
+                "trigger_id": trigger_id,
+                "args": [
+                    {"arg_role": arg_role, "arg_id": arg_id}
+                    for arg_role, arg_id in zip(
+                        events["arg_roles"][arg_offsets[xx]:arg_offsets[xx + 1]],
+                        events["arg_ids"][arg_offsets[xx]:arg_offsets[xx + 1]],
+                    )
+                ],
+                "modalities": [
+                    {"id": modality_id, "type": modality_type}
+                    for modality_id, modality_type in zip(
+                        events["modality_ids"][modality_offsets[xx]:modality_offsets[xx + 1]],
+                        events["modality_types"][modality_offsets[xx]:modality_offsets[xx + 1]],
+                    )
+                ],
+            }
+            for xx, (event_id, trigger_id) in enumerate(zip(events["ids"], events["trigger_ids"]))
+        ]
+
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--task", default="event_extraction", choices=TASKS)
+    parser.add_argument("--base_url", default=api.UPSTREAM_URLS[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = [file_utils.read_text(path) for path in sorted(glob(os.path.join(args.data_dir, "*.txt")))]
+
+    with requests.Session() as session:
+        payloads = []
+
+        for doc in docs:
+            response = session.post(f"{args.base_url}/{args.task}/annotate_compact", data={"text": doc})
+            response.raise_for_status()
+            payloads.append(response.json())
+
+    # Without the context manager, the startup event (the real upstream client) is not run
+    client = TestClient(api.app)
+
+    results = {}
+    responses = {}
+
+    for response_format in ("objects", "columnar"):
+        cpu_time = float("inf")
+
+        for _ in range(args.repeat):
+            responses[response_format] = []
+            size = 0
+            start = time.process_time()
+
+            for doc, annotations in zip(docs, payloads):
+                api.upstream = CompactUpstream(annotations)
+
+                response = client.post(
+                    f"{api.URL_PREFIX}/{args.task}",
+                    params={"email": "benchmark@example.com", "format": response_format},
+                    headers={"Cache-Control": "no-store"},
+                    json={"text": doc},
+                )
+                response.raise_for_status()
+
+                responses[response_format].append(response)
+                size += len(response.content)
+
+            cpu_time = min(cpu_time, time.process_time() - start)
+
+        # Parsed out of the measure, it is the work of the client
+        responses[response_format] = [response.json() for response in responses[response_format]]
+
+        results[response_format] = (cpu_time, size)
+
+    print("{} documents, task {}".format(len(docs), args.task))
+    print("{:<10}{:>22}{:>16}".format("", "CPU (ms / request)", "response (KB)"))
+    for response_format, (cpu_time, size) in results.items():
+        print("{:<10}{:>22.2f}{:>16.1f}".format(response_format, cpu_time * 1000 / len(docs), size / 1024))
+
+    print("identical annotations:", responses["objects"] == [
+        columnar_to_objects(result) for result in responses["columnar"]
+    ])
+
+
+if __name__ == "__main__":
+    main()
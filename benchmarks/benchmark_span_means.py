@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the span mean embeddings of NestedNERModel computed from prefix sums with the former gathered means.
+
+    python -m benchmarks.benchmark_span_means [--tokens 4096] [--hidden 768] [--max_span_width 10] [--repeat 3]
+                                              [--device cpu]
+
+The tokens are one flattened batch, the spans are all the spans up to max_span_width that do not run past
+the last token (the sentence boundaries do not change the cost). The report gives the time and the peak
+allocation of both ways (CUDA only for the peak) and the largest difference between their means (the means
+of the model itself are compared with the gathered ones in tests/test_span_means.py).
+"""
+import argparse
+import time
+
+import torch
+from torch.nn import functional as F
+
+
+def all_spans(num_tokens, max_span_width, device):
+    starts = torch.arange(num_tokens, device=device).view(-1, 1).repeat(1, max_span_width)
+    ends = starts + torch.arange(max_span_width, device=device).view(1, -1)
+    mask = ends < num_tokens
+
+    return starts.masked_select(mask), ends.masked_select(mask)
+
+
+def gathered_means(embeddings, span_starts, span_ends, max_span_width):
+    """The former means: a (spans, max_span_width, H) gather of the token embeddings."""
+    mean_indices = span_starts.view(-1, 1) + torch.arange(max_span_width, device=embeddings.device).view(1, -1)
+    mean_indices_criteria = torch.gt(mean_indices, span_ends.view(-1, 1).repeat(1, max_span_width))
+    mean_indices = torch.min(mean_indices, span_ends.view(-1, 1).repeat(1, max_span_width))
+
+    span_mean_embeddings = torch.index_select(embeddings, 0, mean_indices.flatten()).view(*mean_indices.size(), -1)
+
+    coeffs = torch.ones(mean_indices.size(), dtype=embeddings.dtype, device=embeddings.device)
+    coeffs[mean_indices_criteria] = 0
+
+    span_mean_embeddings = span_mean_embeddings * coeffs.unsqueeze(-1)
+
+    return torch.sum(span_mean_embeddings, dim=1) / torch.sum(coeffs, dim=-1).view(-1, 1)
+
+
+def prefix_sum_means(embeddings, span_starts, span_ends):
+    """The means of NestedNERModel.forward."""
+    prefix_sums = F.pad(torch.cumsum(embeddings, dim=0, dtype=torch.float64), (0, 0, 1, 0))
+    span_widths = (span_ends - span_starts + 1).to(torch.float64)
+
+    return ((torch.index_select(prefix_sums, 0, span_ends + 1) - torch.index_select(prefix_sums, 0, span_starts))
+            / span_widths.view(-1, 1)).to(embeddings.dtype)
+
+
+def measure(compute, repeat, device):
+    timings = []
+    peak = None
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        means = compute()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+            peak = torch.cuda.max_memory_allocated()
+        timings.append(time.perf_counter() - start)
+
+    return means, min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=4096)
+    parser.add_argument("--hidden", type=int, default=768)
+    parser.add_argument("--max_span_width", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+
+    embeddings = torch.randn(args.tokens, args.hidden, device=device)
+    span_starts, span_ends = all_spans(args.tokens, args.max_span_width, device)
+
+    results = {
+        "gathered": measure(lambda: gathered_means(embeddings, span_starts, span_ends, args.max_span_width),
+                            args.repeat, device),
+        "prefix sums": measure(lambda: prefix_sum_means(embeddings, span_starts, span_ends), args.repeat, device),
+    }
+
+    print("{} tokens, {} spans, hidden size {}".format(args.tokens, len(span_starts), args.hidden))
+    print("{:<14}{:>12}{:>18}".format("", "time (ms)", "peak alloc (MB)"))
+    for name, (_, timing, peak) in results.items():
+        print("{:<14}{:>12.1f}{:>18}".format(name, timing * 1000, "-" if peak is None else
+                                             "{:.1f}".format(peak / 2 ** 20)))
+
+    gathered, prefix = results["gathered"][0], results["prefix sums"][0]
+    print("max abs difference: {:.2e}".format((gathered - prefix).abs().max().item()))
+    print("allclose:", torch.allclose(gathered, prefix, rtol=1e-5, atol=1e-6))
+
+
+if __name__ == "__main__":
+    main()
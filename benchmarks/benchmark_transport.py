@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the brat payload of the model server (/annotate) with the compact one (/annotate_compact).
+
+    python -m benchmarks.benchmark_transport <data_dir> [--task event_extraction]
+                                             [--base_url http://127.0.0.1:9091] [--repeat 3]
+
+Every *.txt file of the data directory is sent to a running model server with both routes. The report
+gives the payload size, the time of the requests (model and serialization, the model part is the same
+for both) and the time taken by the gateway to build its response from each payload, and checks that
+both payloads give the same response.
+"""
+import argparse
+import asyncio
+import os
+import time
+from glob import glob
+from typing import List
+
+import requests
+from pydantic import parse_obj_as
+
+import api
+from utils import file_utils
+
+TASKS = {
+    "named_entity_recognition": "ner",
+    "relation_extraction": "re",
+    "event_extraction": "ee",
+    "entity_linking": "el",
+}
+
+
+def brat_response(annotations):
+    """The former response building of api.annotate_doc, from the brat payload."""
+    doc = annotations["text"]
+
+    entities = []
+
+    for entity_id, entity_type, entity_spans in annotations["entities"] + annotations["triggers"]:
+        entity_starts, entity_ends = zip(*entity_spans)
+        entity_span = api.Span(min(entity_starts), max(entity_ends))
+
+        entities.append(
+            api.LinkedEntity(entity_id, entity_type, entity_span, doc[entity_span.start:entity_span.end])
+        )
+
+    id_entities = {entity.id: entity for entity in entities}
+
+    for _, _, entity_id, _, concept_id, _ in annotations["normalizations"]:
+        entity = id_entities[entity_id]
+        entity.concept_id = concept_id
+        entity.concept_name = annotations["cui_data"][concept_id]
+
+    relations = [
+        api.Relation(relation_id, relation_type, left_arg_id, right_arg_id)
+        for relation_id, relation_type, ((_, left_arg_id), (_, right_arg_id)) in annotations["relations"]
+    ]
+
+    events = parse_obj_as(List[api.Event], annotations["events"])
+    id_events = {event.id: event for event in events}
+
+    for attribute_id, attribute_type, attribute_target, _ in annotations["attributes"]:
+        id_events[attribute_target].modalities.append(api.Modality(attribute_id, attribute_type))
+
+    return {
+        "text": doc,
+        "entities": entities,
+        "relations": relations,
+        "events": events,
+        "token_boundaries": parse_obj_as(List[api.Span], annotations["token_offsets"]),
+        "sentence_boundaries": parse_obj_as(List[api.Span], annotations["sentence_offsets"]),
+    }
+
+
+class CompactUpstream:
+    """Stands for the upstream client of the gateway, answers with a payload already received."""
+
+    def __init__(self, annotations):
+        self.annotations = annotations
+
+    async def post(self, path, **kwargs):
+        return self.annotations
+
+    async def get(self, path, **kwargs):
+        return {"version": None}
+
+
+async def compact_responses(docs, payloads, task):
+    """The responses of api.annotate_doc, from the compact payloads (the response cache is bypassed)."""
+    responses = []
+
+    for doc, annotations in zip(docs, payloads):
+        api.upstream = CompactUpstream(annotations)
+        responses.append(await api.annotate_doc(api.Doc(doc), task, "no-store"))
+
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--task", default="event_extraction", choices=TASKS)
+    parser.add_argument("--base_url", default=api.UPSTREAM_URLS[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = [file_utils.read_text(path) for path in sorted(glob(os.path.join(args.data_dir, "*.txt")))]
+
+    results = {}
+    payloads = {}
+
+    with requests.Session() as session:
+        for name, route in (("brat", "annotate"), ("compact", "annotate_compact")):
+            size = 0
+            request_time = float("inf")
+
+            for repeat in range(args.repeat):
+                payloads[name] = []
+                start = time.perf_counter()
+
+                for doc in docs:
+                    response = session.post(f"{args.base_url}/{args.task}/{route}", data={"text": doc})
+                    response.raise_for_status()
+                    payloads[name].append(response.json())
+
+                    if repeat == 0:
+                        size += len(response.content)
+
+                request_time = min(request_time, time.perf_counter() - start)
+
+            results[name] = [size, request_time]
+
+    build = {
+        "brat": lambda: [brat_response(annotations) for annotations in payloads["brat"]],
+        "compact": lambda: asyncio.run(compact_responses(docs, payloads["compact"], TASKS[args.task])),
+    }
+
+    responses = {}
+
+    for name, build_responses in build.items():
+        build_time = float("inf")
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            responses[name] = build_responses()
+            build_time = min(build_time, time.perf_counter() - start)
+
+        results[name].append(build_time)
+
+    print("{} documents, task {}".format(len(docs), args.task))
+    print("{:<10}{:>14}{:>16}{:>16}".format("", "payload (KB)", "requests (s)", "gateway (ms)"))
+    for name, (size, request_time, build_time) in results.items():
+        print("{:<10}{:>14.1f}{:>16.2f}{:>16.1f}".format(name, size / 1024, request_time, build_time * 1000))
+
+    print("identical responses:", api.jsonable_encoder(responses["brat"]) == api.jsonable_encoder(responses["compact"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Exercise the load balancing of the API gateways (utils.upstream.UpstreamPool) on local stub model servers.
+
+    python -m benchmarks.benchmark_upstream_pool [--replicas 3] [--requests 400] [--concurrency 16] [--latency 0.02]
+
+Each stub answers POST /task/annotate_compact after a random latency (one request in twenty is ten
+times slower) and GET /health. The scenarios are:
+
+    balancing      one replica is twice as slow as the others, p2c and least-outstanding are compared
+                   with a single replica
+    ejection       one replica is down (nothing listens on its port), all the requests must succeed
+    hedging        the same requests without and with hedging at the 90th percentile of latency
+
+The report gives the requests answered by each replica, the failures, the p50/p99 latencies and the
+hedged requests of each scenario.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.upstream import UpstreamPool
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, data):
+        body = json.dumps(data).encode("UTF-8")
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The losing request of a hedge, cancelled by the gateway
+            pass
+
+    def do_GET(self):
+        self.reply({"status": "ok"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        latency = self.server.latency * random.uniform(0.5, 1.5)
+
+        if random.random() < 0.05:
+            latency *= 10
+
+        time.sleep(latency)
+
+        self.reply({"replica": self.server.name})
+
+
+def start_stub(name, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.name = name
+    server.latency = latency
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def free_url():
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def run(pool, num_requests, concurrency):
+    await pool.start()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    answers = []
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+
+        async with semaphore:
+            start = time.perf_counter()
+
+            try:
+                answers.append((await pool.post("/task/annotate_compact", data={"text": "x"}))["replica"])
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    try:
+        await asyncio.gather(*(one() for _ in range(num_requests)))
+    finally:
+        await pool.close()
+
+    latencies.sort()
+
+    return {
+        "replicas": {name: answers.count(name) for name in sorted(set(answers))},
+        "failures": failures,
+        "p50": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else float("nan"),
+        "hedges": pool.hedges,
+    }
+
+
+def report(name, result):
+    print("{:<28}{:>8}{:>10.1f}{:>10.1f}{:>8}   {}".format(
+        name,
+        result["failures"],
+        result["p50"] * 1000,
+        result["p99"] * 1000,
+        result["hedges"],
+        " ".join("{}={}".format(replica, count) for replica, count in result["replicas"].items()),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    # The last replica is twice as slow
+    stubs = [
+        start_stub(f"r{index}", args.latency * (2 if index == args.replicas - 1 else 1))
+        for index in range(args.replicas)
+    ]
+    urls = [url for _, url in stubs]
+
+    print("{:<28}{:>8}{:>10}{:>10}{:>8}   {}".format("", "failed", "p50 (ms)", "p99 (ms)", "hedges", "answers"))
+
+    scenarios = [
+        ("single replica", urls[:1], {}),
+        ("balancing (p2c)", urls, {"balancing": "p2c"}),
+        ("balancing (least)", urls, {"balancing": "least"}),
+        ("ejection (1 down)", urls + [free_url()], {"eject_failures": 1, "backoff": 0.01}),
+        ("no hedging", urls, {}),
+        ("hedging (p90)", urls, {"hedge_percentile": 90}),
+    ]
+
+    for name, scenario_urls, kwargs in scenarios:
+        pool = UpstreamPool(scenario_urls, health_interval=0, **kwargs)
+        report(name, asyncio.run(run(pool, args.requests, args.concurrency)))
+
+    for server, _ in stubs:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
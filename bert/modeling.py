@@ -280,6 +280,40 @@ class BertEmbeddings(nn.Module):
         return embeddings
 
 
+class UnpaddedBatch(object):
+    """Positions of the real tokens of a padded batch, to run the encoder without the padding tokens.
+
+    The real tokens are flattened to (num_tokens, ...) in row-major order, so that the tokens of a sequence are
+    contiguous. The sequences of the same length are grouped: `groups` holds, for each length, the
+    (sequences, length) positions of their tokens in the flat layout.
+    """
+
+    def __init__(self, attention_mask):
+        mask = attention_mask.bool()
+        self.shape = mask.shape
+        self.indices = mask.flatten().nonzero(as_tuple=False).flatten()
+
+        lengths = mask.sum(dim=1)
+        offsets = torch.cumsum(lengths, dim=0) - lengths
+
+        self.groups = []
+        for length in torch.unique(lengths).tolist():
+            if length > 0:
+                sequences = (lengths == length).nonzero(as_tuple=False).flatten()
+                positions = torch.arange(length, device=mask.device).view(1, -1)
+                self.groups.append(offsets[sequences].view(-1, 1) + positions)
+
+    def unpad(self, x):
+        """(batch_size, sequence_length, ...) -> (num_tokens, ...)"""
+        return x.reshape(-1, *x.shape[2:])[self.indices]
+
+    def pad(self, x):
+        """(num_tokens, ...) -> (batch_size, sequence_length, ...), zeros at the padding tokens"""
+        padded = x.new_zeros((self.shape[0] * self.shape[1],) + x.shape[1:])
+        padded[self.indices] = x
+        return padded.view(*self.shape, *x.shape[1:])
+
+
 class BertSelfAttention(nn.Module):
     def __init__(self, config):
         super(BertSelfAttention, self).__init__()
@@ -302,11 +336,14 @@ class BertSelfAttention(nn.Module):
         x = x.view(*new_x_shape)
         return x.permute(0, 2, 1, 3)
 
-    def forward(self, hidden_states, attention_mask):
+    def forward(self, hidden_states, attention_mask, unpadded_batch=None):
         mixed_query_layer = self.query(hidden_states)
         mixed_key_layer = self.key(hidden_states)
         mixed_value_layer = self.value(hidden_states)
 
+        if unpadded_batch is not None:
+            return self.unpadded_attention(mixed_query_layer, mixed_key_layer, mixed_value_layer, unpadded_batch)
+
         query_layer = self.transpose_for_scores(mixed_query_layer)
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
@@ -330,6 +367,27 @@ class BertSelfAttention(nn.Module):
         context_layer = context_layer.view(*new_context_layer_shape)
         return context_layer
 
+    def unpadded_attention(self, mixed_query_layer, mixed_key_layer, mixed_value_layer, unpadded_batch):
+        """Attention over the real tokens only (num_tokens, all_head_size), one batch per sequence length."""
+        context_layer = torch.empty_like(mixed_query_layer)
+
+        for token_ids in unpadded_batch.groups:
+            query_layer = self.transpose_for_scores(mixed_query_layer[token_ids])
+            key_layer = self.transpose_for_scores(mixed_key_layer[token_ids])
+            value_layer = self.transpose_for_scores(mixed_value_layer[token_ids])
+
+            # no mask: all the tokens of the group are real tokens
+            attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+            attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+
+            attention_probs = nn.Softmax(dim=-1)(attention_scores)
+            attention_probs = self.dropout(attention_probs)
+
+            group_context_layer = torch.matmul(attention_probs, value_layer).permute(0, 2, 1, 3)
+            context_layer[token_ids] = group_context_layer.reshape(*token_ids.size(), self.all_head_size)
+
+        return context_layer
+
 
 class BertSelfOutput(nn.Module):
     def __init__(self, config):
@@ -351,8 +409,8 @@ class BertAttention(nn.Module):
         self.self = BertSelfAttention(config)
         self.output = BertSelfOutput(config)
 
-    def forward(self, input_tensor, attention_mask):
-        self_output = self.self(input_tensor, attention_mask)
+    def forward(self, input_tensor, attention_mask, unpadded_batch=None):
+        self_output = self.self(input_tensor, attention_mask, unpadded_batch=unpadded_batch)
         attention_output = self.output(self_output, input_tensor)
         return attention_output
 
@@ -393,8 +451,8 @@ class BertLayer(nn.Module):
         self.intermediate = BertIntermediate(config)
         self.output = BertOutput(config)
 
-    def forward(self, hidden_states, attention_mask):
-        attention_output = self.attention(hidden_states, attention_mask)
+    def forward(self, hidden_states, attention_mask, unpadded_batch=None):
+        attention_output = self.attention(hidden_states, attention_mask, unpadded_batch=unpadded_batch)
         intermediate_output = self.intermediate(attention_output)
         layer_output = self.output(intermediate_output, attention_output)
         return layer_output
@@ -406,10 +464,10 @@ class BertEncoder(nn.Module):
         layer = BertLayer(config)
         self.layer = nn.ModuleList([copy.deepcopy(layer) for _ in range(config.num_hidden_layers)])
 
-    def forward(self, hidden_states, attention_mask, output_all_encoded_layers=True):
+    def forward(self, hidden_states, attention_mask, output_all_encoded_layers=True, unpadded_batch=None):
         all_encoder_layers = []
         for layer_module in self.layer:
-            hidden_states = layer_module(hidden_states, attention_mask)
+            hidden_states = layer_module(hidden_states, attention_mask, unpadded_batch=unpadded_batch)
             if output_all_encoded_layers:
                 all_encoder_layers.append(hidden_states)
         if not output_all_encoded_layers:
@@ -529,6 +587,34 @@ class BertPreTrainedModel(nn.Module):
         if isinstance(module, nn.Linear) and module.bias is not None:
             module.bias.data.zero_()
 
+    @classmethod
+    def from_config(cls, pretrained_model_name_or_path, cache_dir=None, *inputs, **kwargs):
+        """
+        Instantiate a BertPreTrainedModel from the configuration of a pre-trained model only.
+        The pre-trained weights are not read, so this is the cheap path when all the weights
+        are restored afterwards from a fine-tuned checkpoint.
+
+        Params:
+            pretrained_model_name_or_path: same as in `from_pretrained`
+            cache_dir: an optional path to a folder in which the pre-trained models will be cached.
+            *inputs, **kwargs: additional input for the specific Bert class
+        """
+        if pretrained_model_name_or_path in PRETRAINED_MODEL_ARCHIVE_MAP:
+            archive_file = PRETRAINED_MODEL_ARCHIVE_MAP[pretrained_model_name_or_path]
+        else:
+            archive_file = pretrained_model_name_or_path
+        resolved_archive_file = cached_path(archive_file, cache_dir=cache_dir)
+        if os.path.isdir(resolved_archive_file):
+            config = BertConfig.from_json_file(os.path.join(resolved_archive_file, CONFIG_NAME))
+        else:
+            # Read the config member only instead of extracting the whole archive
+            with tarfile.open(resolved_archive_file, 'r:gz') as archive:
+                member = next(m for m in archive.getmembers()
+                              if os.path.basename(m.name) == CONFIG_NAME)
+                config = BertConfig.from_dict(json.loads(archive.extractfile(member).read().decode('utf-8')))
+        logger.info("Model config {}".format(config))
+        return cls(config, *inputs, **kwargs)
+
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path, state_dict=None, cache_dir=None,
                         from_tf=False, *inputs, **kwargs):
@@ -672,6 +758,9 @@ class BertModel(BertPreTrainedModel):
             input sequence length in the current batch. It's the mask that we typically use for attention when
             a batch has varying length sentences.
         `output_all_encoded_layers`: boolean which controls the content of the `encoded_layers` output as described below. Default: `True`.
+        `unpad`: boolean, the encoder runs on the real tokens only (see `UnpaddedBatch`) and the hidden states of the
+            padding tokens are zeros. The hidden states of the real tokens are the same as with the padding,
+            up to floating point rounding. Default: `False`.
 
     Outputs: Tuple of (encoded_layers, pooled_output)
         `encoded_layers`: controled by `output_all_encoded_layers` argument:
@@ -706,7 +795,8 @@ class BertModel(BertPreTrainedModel):
         self.pooler = BertPooler(config)
         self.apply(self.init_bert_weights)
 
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True,
+                unpad=False):
         if attention_mask is None:
             attention_mask = torch.ones_like(input_ids)
         if token_type_ids is None:
@@ -728,9 +818,21 @@ class BertModel(BertPreTrainedModel):
         extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
 
         embedding_output = self.embeddings(input_ids, token_type_ids)
+
+        # drop the padding tokens before the encoder, and put them back (as zeros) after it
+        unpadded_batch = None
+        if unpad:
+            unpadded_batch = UnpaddedBatch(attention_mask)
+            embedding_output = unpadded_batch.unpad(embedding_output)
+
         encoded_layers = self.encoder(embedding_output,
                                       extended_attention_mask,
-                                      output_all_encoded_layers=output_all_encoded_layers)
+                                      output_all_encoded_layers=output_all_encoded_layers,
+                                      unpadded_batch=unpadded_batch)
+
+        if unpad:
+            encoded_layers = [unpadded_batch.pad(layer) for layer in encoded_layers]
+
         sequence_output = encoded_layers[-1]
         pooled_output = self.pooler(sequence_output)
         if not output_all_encoded_layers:
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Convert trained models to the memory-mapped flat tensor format used for serving.
+
+    # DeepEM: set `joint_model_flat` in the predict yaml to the output file
+    python convert_checkpoints.py deepem <joint_model_dir> <output.flat>
+
+    # allennlp (NER/CG/CR): writes weights.flat next to weights.th, archives are extracted
+    # first (into --output-dir), the resulting directory can then be used as ner_dir/cg_dir/cr_dir
+    python convert_checkpoints.py allennlp <serialization_dir or model.tar.gz> [--output-dir DIR]
+"""
+import argparse
+import os
+import tarfile
+from datetime import datetime
+from glob import glob
+
+import torch
+
+from utils import flat_tensors, utils
+
+ALLENNLP_WEIGHTS_NAME = "weights.th"
+FLAT_WEIGHTS_NAME = "weights.flat"
+
+
+def convert_deepem(checkpoint_dir, output_file):
+    # Same selection as utils.handle_checkpoints(resume=True)
+    checkpoint_files = sorted(glob(os.path.join(checkpoint_dir, "*.*")), reverse=True)
+
+    if len(checkpoint_files) == 0:
+        raise FileNotFoundError("No checkpoint found in {}".format(checkpoint_dir))
+
+    checkpoint = utils.load_checkpoint(checkpoint_files[0], map_location="cpu")
+
+    # Only the model weights are kept, the optimizer and random states are useless for serving
+    flat_tensors.save_flat_tensors(
+        checkpoint["model"],
+        output_file,
+        metadata={
+            "source": os.path.abspath(checkpoint_files[0]),
+            "converted_at": datetime.now().isoformat(),
+        },
+    )
+
+    print("Converted", checkpoint_files[0], "to", output_file)
+
+
+def convert_allennlp(archive_file, output_dir=None):
+    if os.path.isdir(archive_file):
+        serialization_dir = archive_file
+    else:
+        # Extract once here instead of into a temp dir on every start
+        serialization_dir = output_dir or os.path.splitext(os.path.splitext(archive_file)[0])[0]
+
+        with tarfile.open(archive_file, "r:gz") as archive:
+            archive.extractall(serialization_dir)
+
+    weights_file = os.path.join(serialization_dir, ALLENNLP_WEIGHTS_NAME)
+    output_file = os.path.join(serialization_dir, FLAT_WEIGHTS_NAME)
+
+    flat_tensors.save_flat_tensors(
+        torch.load(weights_file, map_location="cpu"),
+        output_file,
+        metadata={
+            "source": os.path.abspath(weights_file),
+            "converted_at": datetime.now().isoformat(),
+        },
+    )
+
+    print("Converted", weights_file, "to", output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="kind")
+    subparsers.required = True
+
+    deepem_parser = subparsers.add_parser("deepem")
+    deepem_parser.add_argument("checkpoint_dir")
+    deepem_parser.add_argument("output_file")
+
+    allennlp_parser = subparsers.add_parser("allennlp")
+    allennlp_parser.add_argument("archive_file")
+    allennlp_parser.add_argument("--output-dir", default=None)
+
+    args = parser.parse_args()
+
+    if args.kind == "deepem":
+        convert_deepem(args.checkpoint_dir, args.output_file)
+    else:
+        convert_allennlp(args.archive_file, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
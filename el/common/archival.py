@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+
+from allennlp.common import Params
+from allennlp.common.params import parse_overrides, unflatten, with_fallback
+from allennlp.data import Vocabulary
+from allennlp.models.archival import CONFIG_NAME, _FTA_NAME, Archive
+from allennlp.models.model import Model, remove_pretrained_embedding_params
+
+from utils.flat_tensors import assign_flat_tensors, load_flat_tensors
+
+logger = logging.getLogger(__name__)
+
+FLAT_WEIGHTS_NAME = "weights.flat"
+
+
+def has_flat_weights(serialization_dir):
+    return os.path.isfile(os.path.join(serialization_dir, FLAT_WEIGHTS_NAME))
+
+
+def load_flat_archive(serialization_dir, cuda_device=-1, overrides=""):
+    """
+    Same as allennlp's `load_archive` for an extracted serialization directory, but the
+    weights are memory-mapped from `weights.flat` instead of being unpickled from `weights.th`.
+    """
+    # Check for supplemental files in the archive (mirrors load_archive)
+    fta_filename = os.path.join(serialization_dir, _FTA_NAME)
+
+    if os.path.exists(fta_filename):
+        with open(fta_filename, "r") as fta_file:
+            files_to_archive = json.loads(fta_file.read())
+
+        replacements_dict = {}
+
+        for key in files_to_archive:
+            replacement_filename = os.path.join(serialization_dir, f"fta/{key}")
+
+            if os.path.exists(replacement_filename):
+                replacements_dict[key] = replacement_filename
+            else:
+                logger.warning(
+                    f"Archived file {replacement_filename} not found! At train time "
+                    f"this file was located at {files_to_archive[key]}. This may be "
+                    "because you are loading a serialization directory. Attempting to "
+                    "load the file from its train-time location."
+                )
+
+        overrides = json.dumps(
+            with_fallback(
+                preferred=parse_overrides(overrides),
+                fallback=unflatten(replacements_dict),
+            )
+        )
+
+    config = Params.from_file(os.path.join(serialization_dir, CONFIG_NAME), overrides)
+    config.loading_from_archive = True
+
+    model_config = config.duplicate()
+
+    vocab_params = model_config.get("vocabulary", Params({}))
+    vocab_choice = vocab_params.pop_choice("type", Vocabulary.list_available(), True)
+    vocab = Vocabulary.by_name(vocab_choice).from_files(
+        os.path.join(serialization_dir, "vocabulary")
+    )
+
+    model_params = model_config.get("model")
+    remove_pretrained_embedding_params(model_params)
+    model = Model.from_params(vocab=vocab, params=model_params)
+
+    state_dict, _ = load_flat_tensors(os.path.join(serialization_dir, FLAT_WEIGHTS_NAME))
+
+    if cuda_device >= 0:
+        model.cuda(cuda_device)
+        assign_flat_tensors(model, state_dict, device=f"cuda:{cuda_device}")
+    else:
+        model.cpu()
+        assign_flat_tensors(model, state_dict)
+
+    model.eval()
+
+    return Archive(model=model, config=config)
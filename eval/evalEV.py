@@ -23,11 +23,14 @@ def get_entity_attrs(e_idx, words, offset, span_indices, sub_to_words):
 
 # generate entity
 def generate_entities(fids, all_e_preds, all_words, all_offsets, all_span_terms, all_span_indices, all_sub_to_words,
-                      params):
+                      params, sentence_order=None):
     nn_tag2type_map = params['mappings']['nn_mapping']['tag2type_map']
 
     pred_ents_ = collections.defaultdict(list)
 
+    # predictions of each (batch, sentence) position
+    sentence_preds = collections.OrderedDict()
+
     for xi, (fids_, e_preds_, words_, offset_, span_indices_, sub_to_words_) in enumerate(
             zip(fids, all_e_preds, all_words, all_offsets, all_span_indices, all_sub_to_words)):
 
@@ -47,6 +50,12 @@ def generate_entities(fids, all_e_preds, all_words, all_offsets, all_span_terms,
                     else:
                         e_words, e_offset = get_entity_attrs(xx, words, offset, span_indices, sub_to_words)
                     preds[(xi, (xb, xx))] = [e_term, e_type_id, e_offset, e_words]
+            sentence_preds[(xi, xb)] = (fid, preds)
+
+    # batch order unless the batches were bucketed
+    for position in sentence_order or sentence_preds:
+        if position in sentence_preds:
+            fid, preds = sentence_preds[position]
             pred_ents_[fid].append(preds)
 
     pred_ents = collections.OrderedDict()
@@ -60,10 +69,18 @@ def generate_entities(fids, all_e_preds, all_words, all_offsets, all_span_terms,
 
 
 # generate event
-def generate_events(fids, all_ev_preds, params):
+def generate_events(fids, all_ev_preds, params, sentence_order=None):
     # store events in a map
     pred_evs = collections.defaultdict(list)
 
+    # rank of each (batch, sentence) position when the batches were bucketed
+    if sentence_order is not None:
+        sentence_ranks = {position: rank for rank, position in enumerate(sentence_order)}
+        ranked_evs = collections.defaultdict(list)
+
+        # the events are put back in the order of the batches of the sequential sampler
+        batch_size = params['batchsize']
+
     for xi, (fids_, ev_preds_levels_) in enumerate(
             zip(fids, all_ev_preds)):
 
@@ -174,11 +191,23 @@ def generate_events(fids, all_ev_preds, params):
                 ev_data.append(mod_pred)
 
                 # store this event
-                pred_evs[fid].append(ev_data)
+                if sentence_order is not None:
+                    rank = sentence_ranks[(xi, int(xb))]
+                    no_arg = len(rel_struct_list) == 0
+                    ranked_evs[fid].append(((rank // batch_size, level, no_arg, rank, xx1), ev_data))
+                else:
+                    pred_evs[fid].append(ev_data)
 
             # accumulate event number
             acc_evid += len(ev_preds_)
 
+    # order of the sequential batches: in a batch, the event generator outputs the events level by level,
+    # the flat events with arguments before the ones without argument, each group in sentence order
+    # (the triggers are grouped by sentence), and keeps the order of the events of a sentence
+    if sentence_order is not None:
+        for fid, evs_ in ranked_evs.items():
+            pred_evs[fid] = [ev_data for _, ev_data in sorted(evs_, key=lambda ev: ev[0])]
+
     return pred_evs
 
 
@@ -308,13 +337,6 @@ def generate_ev_output(pred_ents, pred_evs, params):
     return preds_output
 
 
-def convert_evid_to_number(str_evid):
-    evid = str_evid.split('_')
-    if evid[0] == '0':
-        return int('1000' + evid[1])
-    return int(evid[0] + evid[1])
-
-
 # write events to file
 def write_ev_2file(pred_output, result_dir, params):
     rev_type_map = params['mappings']['rev_type_map']
@@ -349,8 +371,8 @@ def write_ev_2file(pred_output, result_dir, params):
 
             for event_ in events:
 
-                # create event id
-                evid = convert_evid_to_number(event_[0])
+                # event id "<batch>_<index>", the output ids only depend on the order of the events
+                evid = event_[0]
 
                 # lookup in the map or create a new id
                 if evid in f_evid_map:
@@ -374,7 +396,7 @@ def write_ev_2file(pred_output, result_dir, params):
                     # check event or entity argument
                     if len(arg_) > 2:
                         argIdE = arg_[1]
-                        nest_evid = convert_evid_to_number(argIdE)
+                        nest_evid = argIdE
                         if nest_evid in f_evid_map:
                             nest_evid_out = f_evid_map[nest_evid]
                             idT = 'E' + str(nest_evid_out)
@@ -416,7 +438,7 @@ def write_ev_2file(pred_output, result_dir, params):
 
 # generate event output and evaluation
 def evaluate_ev(fids, all_ent_preds, all_words, all_offsets, all_span_terms, all_span_indices, all_sub_to_words,
-                all_ev_preds, params, gold_dir, result_dir):
+                all_ev_preds, params, gold_dir, result_dir, sentence_order=None):
     # generate predicted entities
     pred_ents = generate_entities(fids=fids,
                                   all_e_preds=all_ent_preds,
@@ -425,12 +447,14 @@ def evaluate_ev(fids, all_ent_preds, all_words, all_offsets, all_span_terms, all
                                   all_span_terms=all_span_terms,
                                   all_span_indices=all_span_indices,
                                   all_sub_to_words=all_sub_to_words,
-                                  params=params)
+                                  params=params,
+                                  sentence_order=sentence_order)
 
     # generate predicted events
     pred_evs = generate_events(fids=fids,
                                all_ev_preds=all_ev_preds,
-                               params=params)
+                               params=params,
+                               sentence_order=sentence_order)
 
     # generate event output
     preds_output = generate_ev_output(pred_ents, pred_evs, params)
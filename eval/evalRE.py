@@ -73,8 +73,10 @@ class SelectClass:
         if self.params['fp16']:
             y_lr = y_lr.float()
             y_rl = y_rl.float()
-        truth_lr = torch.tensor(truth_lr).long()
-        truth_rl = torch.tensor(truth_rl).long()
+        # no ground truth in inference
+        if truth_lr is not None:
+            truth_lr = torch.tensor(truth_lr).long()
+            truth_rl = torch.tensor(truth_rl).long()
 
         no_rel_matched_indices = 0
         no_rel_matched_types = 0
@@ -83,12 +85,17 @@ class SelectClass:
             labels_lr = y_lr.argmax(dim=1).view(-1)
             labels_rl = y_rl.argmax(dim=1).view(-1)
         except:
+            if truth_lr is None:
+                # same as the all -1 truth of raw text
+                return torch.full((y_lr.shape[0],), -1, dtype=torch.long), None, {
+                    'no_rel_matched_indices': no_rel_matched_indices,
+                    'no_rel_matched_types': no_rel_matched_types}
             return truth_lr, truth_lr, {'no_rel_matched_indices': no_rel_matched_indices,
                                         'no_rel_matched_types': no_rel_matched_types}
         m = torch.arange(labels_lr.shape[0])
 
         # count rel matched indices / types
-        if not self.params['predict']:
+        if not self.params['predict'] and truth_lr is not None:
             lr_ids = (truth_lr != -1).nonzero().transpose(0, 1)
             rl_ids = (truth_rl != -1).nonzero().transpose(0, 1)
 
@@ -167,6 +174,12 @@ def calc_stats(preds, ts, params):
     return new_preds, new_ts, no_matched_rels, tp_, fp_, fn_
 
 
+def select_preds(preds, params):
+    """Predicted relation types only, without ground truth and statistics (inference)."""
+    new_preds, _, _ = SelectClass(params)(preds[0], preds[1], None, None)
+    return new_preds
+
+
 def fbeta_score(precision, recall, beta=1.0):
     beta_square = beta * beta
     if (precision != 0.0) and (recall != 0.0):
@@ -265,11 +278,11 @@ def get_entity_attrs(e_span_indice, words, offsets, sub_to_words):
     return ' '.join(e_words), (e_offset[0], e_offset[1])
 
 
-def estimate_rel(ref_dir, result_dir, fids, ent_anns, rel_anns, params):
+def estimate_rel(ref_dir, result_dir, fids, ent_anns, rel_anns, params, sentence_order=None):
     """Evaluate entity and relation performance using n2c2 script"""
 
     # generate brat prediction
-    gen_annotation(fids, ent_anns, rel_anns, params, result_dir)
+    gen_annotation(fids, ent_anns, rel_anns, params, result_dir, sentence_order=sentence_order)
 
     if params['raw_text']:
         return {}
@@ -287,7 +300,7 @@ def estimate_rel(ref_dir, result_dir, fids, ent_anns, rel_anns, params):
     return scores
 
 
-def gen_annotation(fidss, ent_anns, rel_anns, params, result_dir):
+def gen_annotation(fidss, ent_anns, rel_anns, params, result_dir, sentence_order=None):
     """Generate entity and relation prediction"""
 
     dir2wr = ''.join([result_dir, 'rel-last/rel-ann/'])
@@ -305,50 +318,58 @@ def gen_annotation(fidss, ent_anns, rel_anns, params, result_dir):
         for fid in fids:
             map[fid] = {'ents': {}, 'rels': {}}
 
-    for xi, (fids, ent_ann, rel_ann) in enumerate(zip(fidss, ent_anns, rel_anns)):
-        # Mapping entities
-        entity_map = defaultdict()
-        for xb, (fid) in enumerate(fids):
-            span_indices = ent_ann['span_indices'][xb]
-            ner_terms = ent_ann['ner_terms'][xb]
-            ner_preds = ent_ann['ner_preds'][xb]
-            words = ent_ann['words'][xb]
-            offsets = ent_ann['offsets'][xb]
-            sub_to_words = ent_ann['sub_to_words'][xb]
-
-            entities = map[fid]['ents']
-            # e_count = len(entities) + 1
-
-            for x, pair in enumerate(span_indices):
-                if pair[0].item() == -1:
-                    break
-                if ner_preds[x] > 0:
-                    # e_id = 'T' + str(e_count)
-                    # e_count += 1
-                    try:
-                        e_id = ner_terms.id2term[x]
-                        e_type = params['mappings']['rev_type_map'][
-                            params['mappings']['nn_mapping']['tag2type_map'][ner_preds[x]]]
-                        if 'pipeline_entity_org_map' in params:
-                            if e_id in params['pipeline_entity_org_map'][fid]:
-                                e_words, e_offset = params['pipeline_entity_org_map'][fid][e_id]
-                            else:
-                                print(e_id)
-                                e_words, e_offset = get_entity_attrs(pair, words, offsets, sub_to_words)
+    # (batch, sentence) positions in output order: the batch order unless the batches were bucketed
+    if sentence_order is None:
+        sentence_order = [(xi, xb) for xi, fids in enumerate(fidss) for xb in range(len(fids))]
+
+    # Mapping entities
+    entity_maps = defaultdict(dict)
+    for xi, xb in sentence_order:
+        fid = fidss[xi][xb]
+        ent_ann = ent_anns[xi]
+        entity_map = entity_maps[xi]
+
+        span_indices = ent_ann['span_indices'][xb]
+        ner_terms = ent_ann['ner_terms'][xb]
+        ner_preds = ent_ann['ner_preds'][xb]
+        words = ent_ann['words'][xb]
+        offsets = ent_ann['offsets'][xb]
+        sub_to_words = ent_ann['sub_to_words'][xb]
+
+        entities = map[fid]['ents']
+        # e_count = len(entities) + 1
+
+        for x, pair in enumerate(span_indices):
+            if pair[0].item() == -1:
+                break
+            if ner_preds[x] > 0:
+                # e_id = 'T' + str(e_count)
+                # e_count += 1
+                try:
+                    e_id = ner_terms.id2term[x]
+                    e_type = params['mappings']['rev_type_map'][
+                        params['mappings']['nn_mapping']['tag2type_map'][ner_preds[x]]]
+                    if 'pipeline_entity_org_map' in params:
+                        if e_id in params['pipeline_entity_org_map'][fid]:
+                            e_words, e_offset = params['pipeline_entity_org_map'][fid][e_id]
                         else:
+                            print(e_id)
                             e_words, e_offset = get_entity_attrs(pair, words, offsets, sub_to_words)
-                        # entity_map[(xb, (pair[0].item(), pair[1].item()))] = (
-                        #     ner_preds[x], e_id, e_type, e_words, e_offset)
-                        entity_map[(xb, x)] = (
-                            ner_preds[x], e_id, e_type, e_words, e_offset)
-                        entities[e_id] = {"id": e_id, "type": e_type, "start": e_offset[0], "end": e_offset[1],
-                                          "ref": e_words}
-                    except KeyError as error:
-                        print('pred not map term', error)
+                    else:
+                        e_words, e_offset = get_entity_attrs(pair, words, offsets, sub_to_words)
+                    # entity_map[(xb, (pair[0].item(), pair[1].item()))] = (
+                    #     ner_preds[x], e_id, e_type, e_words, e_offset)
+                    entity_map[(xb, x)] = (
+                        ner_preds[x], e_id, e_type, e_words, e_offset)
+                    entities[e_id] = {"id": e_id, "type": e_type, "start": e_offset[0], "end": e_offset[1],
+                                      "ref": e_words}
+                except KeyError as error:
+                    print('pred not map term', error)
+
+    # Group the predicted pairs by sentence, keeping their order
+    sentence_pairs = defaultdict(list)
+    for xi, rel_ann in enumerate(rel_anns):
         if len(rel_ann) > 0:
-            # Mapping relations
-            pairs_idx = rel_ann['pairs_idx']
-            rel_preds = rel_ann['rel_preds']
             # positive_indices = rel_ann['positive_indices']
 
             # if positive_indices:
@@ -356,48 +377,55 @@ def gen_annotation(fidss, ent_anns, rel_anns, params, result_dir):
             # pairs_idx_j = pairs_idx[1][positive_indices]
             # pairs_idx_k = pairs_idx[2][positive_indices]
             # else:
-            pairs_idx_i = pairs_idx[0]
-            pairs_idx_j = pairs_idx[1]
-            pairs_idx_k = pairs_idx[2]
-
-            for x, i in enumerate(pairs_idx_i):
-                relations = map[fids[i]]['rels']
-                r_count = len(relations) + 1
-
-                j = pairs_idx_j[x]
-                k = pairs_idx_k[x]
-                rel = rel_preds[x].item()
-                role = params['mappings']['rev_rel_map'][rel].split(":")[1]
-                # role = params['mappings']['rev_rtype_map'][rel]
-                if role != 'Other':
-                    # arg1s = entity_map[
-                    #     (i.item(), (ent_ann['span_indices'][i][j][0].item(), ent_ann['span_indices'][i][j][1].item()))]
-                    # arg2s = entity_map[
-                    #     (i.item(), (ent_ann['span_indices'][i][k][0].item(), ent_ann['span_indices'][i][k][1].item()))]
-                    try:
-                        arg1s = entity_map[(i.item(), j.item())]
-                        arg2s = entity_map[(i.item(), k.item())]
-
-                        if int(params['mappings']['rev_rel_map'][rel].split(":")[0]) > int(
-                                params['mappings']['rev_rel_map'][rel].split(":")[-1]):
-                            arg1 = arg2s[1]
-                            arg2 = arg1s[1]
-                        else:
-                            arg1 = arg1s[1]
-                            arg2 = arg2s[1]
-                        r_id = 'R' + str(r_count)
-                        r_count += 1
-                        relations[r_id] = {"id": r_id, "role": role,
-                                           "left_arg": {"label": "Arg1", "id": arg1},
-                                           "right_arg": {"label": "Arg2", "id": arg2}}
-                    except KeyError as error:
-                        print('error relation', fids[i], error)
-
-                    # r_id = 'R' + str(r_count)
-                    # r_count += 1
-                    # relations[r_id] = {"id": r_id, "role": role,
-                    #                    "left_arg": {"label": "Arg1", "id": arg2},
-                    #                    "right_arg": {"label": "Arg2", "id": arg1}}
+            for x, i in enumerate(rel_ann['pairs_idx'][0]):
+                sentence_pairs[(xi, i.item())].append(x)
+
+    # Mapping relations
+    for xi, xb in sentence_order:
+        fids = fidss[xi]
+        entity_map = entity_maps[xi]
+        pairs_idx = rel_anns[xi].get('pairs_idx')
+        rel_preds = rel_anns[xi].get('rel_preds')
+
+        for x in sentence_pairs.get((xi, xb), []):
+            i = pairs_idx[0][x]
+            relations = map[fids[i]]['rels']
+            r_count = len(relations) + 1
+
+            j = pairs_idx[1][x]
+            k = pairs_idx[2][x]
+            rel = rel_preds[x].item()
+            role = params['mappings']['rev_rel_map'][rel].split(":")[1]
+            # role = params['mappings']['rev_rtype_map'][rel]
+            if role != 'Other':
+                # arg1s = entity_map[
+                #     (i.item(), (ent_ann['span_indices'][i][j][0].item(), ent_ann['span_indices'][i][j][1].item()))]
+                # arg2s = entity_map[
+                #     (i.item(), (ent_ann['span_indices'][i][k][0].item(), ent_ann['span_indices'][i][k][1].item()))]
+                try:
+                    arg1s = entity_map[(i.item(), j.item())]
+                    arg2s = entity_map[(i.item(), k.item())]
+
+                    if int(params['mappings']['rev_rel_map'][rel].split(":")[0]) > int(
+                            params['mappings']['rev_rel_map'][rel].split(":")[-1]):
+                        arg1 = arg2s[1]
+                        arg2 = arg1s[1]
+                    else:
+                        arg1 = arg1s[1]
+                        arg2 = arg2s[1]
+                    r_id = 'R' + str(r_count)
+                    r_count += 1
+                    relations[r_id] = {"id": r_id, "role": role,
+                                       "left_arg": {"label": "Arg1", "id": arg1},
+                                       "right_arg": {"label": "Arg2", "id": arg2}}
+                except KeyError as error:
+                    print('error relation', fids[i], error)
+
+                # r_id = 'R' + str(r_count)
+                # r_count += 1
+                # relations[r_id] = {"id": r_id, "role": role,
+                #                    "left_arg": {"label": "Arg1", "id": arg2},
+                #                    "right_arg": {"label": "Arg2", "id": arg1}}
 
     for fid, ners_rels in map.items():
         write_annotation_file(ann_file=dir2wr + fid + '.ann', entities=ners_rels['ents'], relations=ners_rels['rels'])
@@ -5,6 +5,7 @@ from tqdm import tqdm
 
 from eval.evalEV import evaluate_ev
 from eval.evalRE import estimate_perf, estimate_rel
+from loader.prepNN import sampler
 # from eval.evalNER import eval_nner
 # from scripts.pipeline_process import gen_ner_ann_files, gen_rel_ann_files
 from utils import utils
@@ -23,6 +24,9 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
 
     fidss, wordss, offsetss, sub_to_wordss, span_indicess = [], [], [], [], []
 
+    # data ids of each batch, to restore the document order of bucketed batches
+    data_idss = []
+
     rel_anns = []
     ent_anns = []
 
@@ -39,11 +43,14 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
     is_eval_rel = False
     is_eval_ev = False
 
+    # raw text: no gold annotation to load, align or score
+    inference = utils.is_inference(params)
+
     for step, batch in enumerate(
-            tqdm(eval_dataloader, desc="Iteration", leave=False)
+            tqdm(eval_dataloader, desc="Iteration", leave=False, disable=inference)
     ):
         eval_data_ids = batch
-        tensors = utils.get_tensors(eval_data_ids, eval_data, params)
+        tensors = utils.get_tensors(eval_data_ids, eval_data, params, inference=inference)
 
         nn_tokens, nn_ids, nn_token_mask, nn_attention_mask, nn_span_indices, nn_span_labels, nn_span_labels_match_rel, nn_entity_masks, nn_trigger_masks, nn_gtruth, nn_l2r, _, \
         nn_truth_ev, nn_ev_idxs, ev_lbls, etypes, _ = tensors
@@ -66,7 +73,7 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
             eval_data["subwords"][data_id]
             for data_id in eval_data_ids[0].tolist()
         ]
-        gold_entities = [
+        gold_entities = [] if inference else [
             eval_data["entities"][data_id]
             for data_id in eval_data_ids[0].tolist()
         ]
@@ -75,7 +82,7 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
             if not params['predict']:
                 ner_out, rel_out, ev_out, loss = model(tensors, epoch)
             else:
-                ner_out, rel_out, ev_out, loss = model(tensors)
+                ner_out, rel_out, ev_out, loss = model(tensors, inference=inference)
 
         ner_preds = ner_out['preds']
 
@@ -98,12 +105,17 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
                 else:
                     ner_terms = ner_out['gold_terms']
                     ner_preds = ner_out['golds']
+            # The entities are given, only the relations and events are predicted
+            elif params.get('gold_entities', False):
+                ner_terms = ner_out['gold_terms']
+                ner_preds = ner_out['golds']
             else:
                 ner_terms = ner_out['terms']
 
         all_ner_terms.append(ner_terms)
 
-        for sentence_idx, ner_pred in enumerate(ner_preds):
+        # only for the NER scores below
+        for sentence_idx, ner_pred in enumerate([] if inference else ner_preds):
             all_ner_golds.append(
                 [
                     (
@@ -137,6 +149,7 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
             all_ner_preds.append(pred_entities)
 
         fidss.append(fids)
+        data_idss.append(eval_data_ids[0].tolist())
         if params['predict']:
             if params['gold_eval'] or params['pipelines']:
                 if params['pipelines'] and params['pipe_flag'] == 0:
@@ -147,6 +160,10 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
                     ent_ann = {'span_indices': nn_span_indices, 'ner_preds': ner_out['golds'], 'words': words,
                                'offsets': offsets, 'sub_to_words': sub_to_words, 'subwords': subwords,
                                'ner_terms': ner_terms}
+            elif params.get('gold_entities', False):
+                ent_ann = {'span_indices': nn_span_indices, 'ner_preds': ner_out['golds'], 'words': words,
+                           'offsets': offsets, 'sub_to_words': sub_to_words, 'subwords': subwords,
+                           'ner_terms': ner_terms}
             else:
                 ent_ann = {'span_indices': nn_span_indices, 'ner_preds': ner_out['preds'], 'words': words,
                            'offsets': offsets, 'sub_to_words': sub_to_words, 'subwords': subwords,
@@ -174,11 +191,12 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
         sub_to_wordss.append(sub_to_words)
 
         if rel_out != None:
-            rel_tp_tr.append(rel_out['true_pos'].tolist())
-            rel_fp_tr.append(rel_out['false_pos'].tolist())
-            rel_fn_tr.append(rel_out['false_neg'].tolist())
-            total_rel_matched_indices += rel_out['no_matched_rel']['no_rel_matched_indices']
-            total_rel_matched_types += rel_out['no_matched_rel']['no_rel_matched_types']
+            if not inference:
+                rel_tp_tr.append(rel_out['true_pos'].tolist())
+                rel_fp_tr.append(rel_out['false_pos'].tolist())
+                rel_fn_tr.append(rel_out['false_neg'].tolist())
+                total_rel_matched_indices += rel_out['no_matched_rel']['no_rel_matched_indices']
+                total_rel_matched_types += rel_out['no_matched_rel']['no_rel_matched_types']
 
             if params['predict']:
                 if params['gold_eval'] or params['pipelines']:
@@ -243,6 +261,9 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
             gen_rel_ann_files(fidss, ent_anns, rel_anns, params)
             return
 
+    # Sentences processed out of order (length-bucketed batches) are written back in document order
+    sentence_order = None if sampler.is_ordered(data_idss) else sampler.restore_order(data_idss)
+
     # Do estimations here
     labels = params["mappings"]["nn_mapping"]["trigger_labels"]
     if params["ner_predict_all"]:
@@ -254,7 +275,8 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
                           fids=fidss,
                           ent_anns=ent_anns,
                           rel_anns=rel_anns,
-                          params=params)
+                          params=params,
+                          sentence_order=sentence_order)
     # if is_eval_rel:
     #     tr_scores = estimate_perf(rel_tp_tr, rel_fp_tr, rel_fn_tr, params)
     # else:
@@ -270,7 +292,8 @@ def eval(model, eval_dir, result_dir, eval_dataloader, eval_data, params, epoch=
                                 all_ev_preds = ev_preds,
                                 params=params,
                                 gold_dir=eval_dir,
-                                result_dir=result_dir)
+                                result_dir=result_dir,
+                                sentence_order=sentence_order)
     else:
         ev_scores = {}
 
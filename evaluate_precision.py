@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the inference precision modes (float32, int8, bfloat16) of a model on a held-out brat set.
+
+For each mode, the model is loaded in a fresh process and run on every *.txt file of the data
+directory, then scored against the *.ann files next to them. The report gives the F1 of each
+annotation kind with its delta against float32, the latency per document and the memory usage.
+
+    # DeepEM (RE or EE): the yaml is the same as for predictor.py
+    python evaluate_precision.py deepem <data_dir> --config <predict yaml>
+
+    # NER (+ entity linking with --linking), the model paths are read from config.ini
+    python evaluate_precision.py semel <data_dir> [--linking]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from glob import glob
+
+import numpy as np
+
+from utils import file_utils
+from utils.annotation import TextAnnotations
+from utils.precision import PRECISIONS
+
+ANNOTATION_KINDS = ("entities", "relations", "events", "normalizations")
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _build_annotator(kind, precision, args):
+    if kind == "deepem":
+        from annotator import DeepEMAnnotator
+
+        return DeepEMAnnotator(args.config, args.gss_dir, args.cache_dir, precision=precision)
+
+    from annotator import SemELAnnotator
+    from wsgi.config import config
+
+    return SemELAnnotator(
+        config["ner_dir"],
+        config["cg_dir"],
+        config["cr_dir"],
+        config["kbe_dir"],
+        args.gss_dir,
+        args.cache_dir,
+        args.linking,
+        ner_precision=precision,
+        cg_precision=precision,
+        cr_precision=precision,
+    )
+
+
+def _keys(doc):
+    """Map the brat annotations to comparable keys, ids are replaced by what they point to."""
+    keys = {kind: set() for kind in ANNOTATION_KINDS}
+
+    textbounds = {}
+
+    for ann in list(doc.get_entities()) + list(doc.get_triggers()):
+        textbounds[ann.id] = (ann.type, tuple(tuple(span) for span in ann.spans))
+
+    for ann in doc.get_entities():
+        keys["entities"].add(textbounds[ann.id])
+
+    for ann in doc.get_relations():
+        keys["relations"].add(
+            (ann.type, ann.arg1l, textbounds.get(ann.arg1), ann.arg2l, textbounds.get(ann.arg2))
+        )
+
+    events = {ann.id: ann for ann in doc.get_events()}
+    event_keys = {}
+
+    def event_key(event_id, visiting=()):
+        if event_id not in event_keys:
+            event = events[event_id]
+            args = []
+            for role, arg_id in event.args:
+                if arg_id in events and arg_id not in visiting:
+                    args.append((role, event_key(arg_id, visiting + (event_id,))))
+                else:
+                    args.append((role, textbounds.get(arg_id)))
+            event_keys[event_id] = (textbounds.get(event.trigger), tuple(sorted(args, key=repr)))
+        return event_keys[event_id]
+
+    for event_id in events:
+        keys["events"].add(event_key(event_id))
+
+    for ann in doc.get_normalizations():
+        keys["normalizations"].add((textbounds.get(ann.target), ann.refdb, ann.refid))
+
+    return keys
+
+
+def _run(kind, precision, args, doc_names, queue):
+    annotator = _build_annotator(kind, precision, args)
+
+    load_rss = _max_rss_mb()
+
+    counts = {kind: [0, 0, 0] for kind in ANNOTATION_KINDS}
+    latencies = []
+
+    for i, doc_name in enumerate(doc_names):
+        text = file_utils.read_text(doc_name + ".txt")
+
+        start = time.perf_counter()
+        prediction, _, _ = annotator(text)
+        elapsed = time.perf_counter() - start
+
+        # The first document includes the lazy initializations
+        if i > 0 or len(doc_names) == 1:
+            latencies.append(elapsed)
+
+        gold = TextAnnotations(document=doc_name, read_only=True)
+
+        predicted_keys = _keys(prediction)
+        gold_keys = _keys(gold)
+
+        for ann_kind in ANNOTATION_KINDS:
+            tp = len(predicted_keys[ann_kind] & gold_keys[ann_kind])
+            counts[ann_kind][0] += tp
+            counts[ann_kind][1] += len(predicted_keys[ann_kind]) - tp
+            counts[ann_kind][2] += len(gold_keys[ann_kind]) - tp
+
+    queue.put(
+        {
+            "counts": counts,
+            "latencies": latencies,
+            "load_rss": load_rss,
+            "peak_rss": _max_rss_mb(),
+        }
+    )
+
+
+def _f1(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=("deepem", "semel"))
+    parser.add_argument("data_dir")
+    parser.add_argument("--config", help="predict yaml of the DeepEM model")
+    parser.add_argument("--linking", action="store_true", help="enable entity linking (semel)")
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--gss_dir", default="tools/geniass")
+    parser.add_argument("--cache_dir", default=".cache")
+    args = parser.parse_args()
+
+    if args.kind == "deepem" and not args.config:
+        parser.error("--config is required for deepem")
+
+    doc_names = sorted(os.path.splitext(path)[0] for path in glob(os.path.join(args.data_dir, "*.txt")))
+
+    if not doc_names:
+        parser.error("No .txt file in {}".format(args.data_dir))
+
+    # float32 is the reference for the deltas
+    precisions = [precision for precision in PRECISIONS if precision in args.precisions]
+    if PRECISIONS[0] not in precisions:
+        precisions.insert(0, PRECISIONS[0])
+
+    # One process per mode so that the memory numbers are not mixed up
+    context = multiprocessing.get_context("spawn")
+
+    results = {}
+
+    for precision in precisions:
+        queue = context.Queue()
+        process = context.Process(target=_run, args=(args.kind, precision, args, doc_names, queue))
+        process.start()
+        results[precision] = queue.get()
+        process.join()
+
+    reference = results[PRECISIONS[0]]
+
+    print("{} documents from {}".format(len(doc_names), args.data_dir))
+
+    for precision in precisions:
+        result = results[precision]
+        latencies = np.array(result["latencies"]) * 1000
+
+        print()
+        print("[{}]".format(precision))
+        print(
+            "  latency/doc: mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms".format(
+                latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95)
+            )
+        )
+        print(
+            "  max RSS: {:.0f} MB after load, {:.0f} MB at the end".format(
+                result["load_rss"], result["peak_rss"]
+            )
+        )
+
+        for ann_kind in ANNOTATION_KINDS:
+            if not any(reference["counts"][ann_kind]):
+                continue
+
+            f1 = _f1(*result["counts"][ann_kind])
+            delta = f1 - _f1(*reference["counts"][ann_kind])
+
+            print("  {:<15} F1 {:.2f} ({:+.2f})".format(ann_kind, f1 * 100, delta * 100))
+
+
+if __name__ == "__main__":
+    main()
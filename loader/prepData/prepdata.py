@@ -36,20 +36,21 @@ def prep_input_data(files_fold, params):
     # prepare for training batch data for each sentence
     input1 = process_input(input0, entities0, relations0, events2, params, files_fold)
 
-    #
-    print("Missing gold entities:")
-    for doc_name, doc in sorted(input0.items(), key=lambda x: x[0]):
-        entities = set()
-        num_entities_per_doc = 0
-        for sentence in doc:
-            eids = sentence["eids"]
-            entities |= set(eids)
-            num_entities_per_doc += len(eids)
-
-        full_entities = set(entities1["pmids"][doc_name]["ids"])
-        diff = full_entities.difference(entities)
-        if diff:
-            print(doc_name, sorted(diff, key=lambda _id: int(_id.replace("T", ""))))
+    # no gold entity on raw text
+    if not params.get('inference', False):
+        print("Missing gold entities:")
+        for doc_name, doc in sorted(input0.items(), key=lambda x: x[0]):
+            entities = set()
+            num_entities_per_doc = 0
+            for sentence in doc:
+                eids = sentence["eids"]
+                entities |= set(eids)
+                num_entities_per_doc += len(eids)
+
+            full_entities = set(entities1["pmids"][doc_name]["ids"])
+            diff = full_entities.difference(entities)
+            if diff:
+                print(doc_name, sorted(diff, key=lambda _id: int(_id.replace("T", ""))))
 
     return {'entities': entities1, 'triggers': triggers1, 'terms': terms0, 'relations': relations0, 'events': events0,
             'sentences': sentences1, 'input': input1, 'structsTR': structsTR}
@@ -0,0 +1,100 @@
+"""Length-bucketed batching of sentences."""
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def get_sentence_lengths(nn_data):
+    """Number of subwords and spans of each sentence, the two dimensions padded in a batch."""
+    return [len(ids) for ids in nn_data['ids']], [len(spans) for spans in nn_data['span_indices']]
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sentences of similar lengths together, so that little compute is spent on padding.
+
+    Sentences are sorted by (subword length, span count), then grouped in buckets of `bucket_width`
+    subwords, and each bucket is cut into batches whose padded size (number of sentences x longest
+    sentence) stays within `token_budget`. Batches never mix buckets and never exceed `max_batch_size`.
+    The order of the batches is deterministic (shortest first); the predictions must be put back
+    in document order afterwards (see `restore_order`).
+    """
+
+    def __init__(self, lengths, span_counts, token_budget, max_batch_size=None, bucket_width=8):
+        self.lengths = lengths
+        self.span_counts = span_counts
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.bucket_width = bucket_width
+
+        self.batches = self._create_batches()
+
+    def _create_batches(self):
+        order = sorted(range(len(self.lengths)), key=lambda i: (self.lengths[i], self.span_counts[i], i))
+
+        batches = []
+        batch = []
+        batch_bucket = None
+        batch_max_length = 0
+
+        for data_id in order:
+            length = self.lengths[data_id]
+            bucket = length // self.bucket_width
+            max_length = max(batch_max_length, length)
+
+            if batch and (
+                    bucket != batch_bucket
+                    or (len(batch) + 1) * max_length > self.token_budget
+                    or (self.max_batch_size and len(batch) >= self.max_batch_size)
+            ):
+                batches.append(batch)
+                batch = []
+                max_length = length
+
+            batch.append(data_id)
+            batch_bucket = bucket
+            batch_max_length = max_length
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def padding_ratio(batches, lengths, span_counts):
+    """Fractions of padded subwords and padded spans over the given batches."""
+    real_tokens = padded_tokens = real_spans = padded_spans = 0
+
+    for batch in batches:
+        batch_lengths = [lengths[data_id] for data_id in batch]
+        batch_span_counts = [span_counts[data_id] for data_id in batch]
+
+        real_tokens += sum(batch_lengths)
+        padded_tokens += len(batch) * max(batch_lengths)
+        real_spans += sum(batch_span_counts)
+        padded_spans += len(batch) * max(batch_span_counts)
+
+    return (1 - real_tokens / max(padded_tokens, 1),
+            1 - real_spans / max(padded_spans, 1))
+
+
+def restore_order(data_idss):
+    """
+    Positions (batch index, index in batch) of the sentences sorted by their data id,
+    i.e. the document order of the sentences processed in bucketed batches.
+    """
+    positions = [(data_id, xi, xb) for xi, data_ids in enumerate(data_idss) for xb, data_id in enumerate(data_ids)]
+
+    return [(xi, xb) for _, xi, xb in sorted(positions)]
+
+
+def is_ordered(data_idss):
+    flat_ids = [data_id for data_ids in data_idss for data_id in data_ids]
+
+    return bool(np.all(np.diff(flat_ids) > 0)) if len(flat_ids) > 1 else True
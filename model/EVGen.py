@@ -1,7 +1,9 @@
 """To generate events given triggers, entities, relations, and event structure."""
 
-import numpy as np
 import collections
+import itertools
+
+import numpy as np
 
 from torch import nn
 
@@ -15,6 +17,12 @@ class EV_Generator(nn.Module):
         # parameters
         self.params = params
 
+        # indexed event structures by (nested, trigger type), see _structs_index
+        self.structs_indices = {}
+
+        # confidence of the predicted relations, to rank the candidates of a trigger (see _limit_candidates)
+        self.rel_scores = None
+
     def show_input(self, etypes, l2r, rpred_types, rpred_ids, ev_idx, ev_truth, ev_lbls):
         """For debug, convert indices to real events."""
 
@@ -162,10 +170,10 @@ class EV_Generator(nn.Module):
         for trid_ in tr_ids:
             trid = (trid_[0].item(), trid_[1].item())
 
-            # process truth and labels
+            # process truth and labels, no truth in inference (ev_idx is None)
             bid = trid[0]
             a1id = trid[1]
-            truth_idx = ev_idx[bid].get(a1id, -1)
+            truth_idx = ev_idx[bid].get(a1id, -1) if ev_idx is not None else -1
             if truth_idx != -1:
                 truth = ev_truth[bid][truth_idx]
                 mod_label = ev_lbls[bid][truth_idx]  # modality: 1-non-modality, 2-speculation, 3-negation
@@ -204,8 +212,8 @@ class EV_Generator(nn.Module):
             bid = trid[0]
             a1id = trid[1]
 
-            # process truth and labels
-            truth_idx = ev_idx[bid].get(a1id, -1)
+            # process truth and labels, no truth in inference (ev_idx is None)
+            truth_idx = ev_idx[bid].get(a1id, -1) if ev_idx is not None else -1
             if truth_idx != -1:
                 truth = ev_truth[bid][truth_idx]
                 mod_label = ev_lbls[bid][truth_idx]  # modality: 1-non-modality, 2-speculation, 3-negation
@@ -261,14 +269,14 @@ class EV_Generator(nn.Module):
         # convert list to Counter to compare with event structure
         cand_struct = collections.Counter(args_list)
 
-        # get the list of event structures with one-argument (id=1)
-        ev_structs = ev_structs[1]
+        # get the event structures with one-argument (id=1)
+        allowed, _ = self._structs_index(ev_structs, rels_group[0][0])
 
         # check there is structure for this trigger type
-        if ev_structs != -1:
+        if len(allowed[1]) > 0:
 
             # compare if this pair (relation type, trigger type) is in the structure, then create candidate
-            if cand_struct in ev_structs:
+            if tuple(args_list) in allowed[1]:
                 # get argument id stored in rels_group[0][3] (0=only one relation, 3=id in the list)[1]=entity id
                 a2id = rels_group[0][3][1]
                 cand_eids = [a2id]  # add to a list for Counter
@@ -290,106 +298,21 @@ class EV_Generator(nn.Module):
         # store candidate in a list
         cands = []
 
-        # get the list of event structures with 1, 2, 3, 4 arguments
-        ev_structs1 = ev_structs[1]
-        ev_structs2 = ev_structs[2]
-        ev_structs3 = ev_structs[3]
-        ev_structs4 = ev_structs[4]
-
-        # init for ignore empty structure
-        isArg1 = ev_structs1 != -1
-        isArg2 = ev_structs2 != -1
-        isArg3 = ev_structs3 != -1
-        isArg4 = ev_structs4 != -1
-
-        # generate all possible combinations among arguments with limited by the maximum number of args
-        max_n_args = self.params['max_ev_args']
-        # TODO: now fix as 4 arguments, can revise to set in parameter later.
-
-        for xx1, arg1_ in enumerate(args_list):
-
-            # check one arg first
-            args1_ = [arg1_]
-            args1 = collections.Counter(args1_)
-
-            # argument id, rid
-            a1id = rels_group[xx1][3][1]
-
-            if isArg1 and args1 in ev_structs1:
-                # get argument ids
-                a2ids = [a1id]
-
-                # generate candidate output
-                # 3rd argument: number of event arguments
-                # 4th argument: [IN indices] # the remain in the argument list will be OUT indices
-                cand_output = self.generate_candidate_output(trid, args1, args1_, [xx1], a2ids, ev_truth[1], mod_labels)
-                cands.append(cand_output)
-
-            # check for 2, 3, 4 combined args
-            if n_args > 1:
-
-                for xx2 in range(xx1 + 1, len(args_list)):
-                    arg2_ = args_list[xx2]
-
-                    # combine two arguments
-                    args12_ = [arg1_, arg2_]
-                    args12 = collections.Counter(args12_)
-
-                    # argument id
-                    a2id = rels_group[xx2][3][1]
-
-                    if isArg2 and args12 in ev_structs2:
-                        # get argument ids
-                        a2ids = [a1id, a2id]
-
-                        # generate candidate output
-                        cand_output = self.generate_candidate_output(trid, args12, args12_, [xx1, xx2], a2ids,
-                                                                     ev_truth[2], mod_labels)
-                        cands.append(cand_output)
-
-                    # check for 3, 4 arguments
-                    if n_args > 2:
-                        for xx3 in range(xx2 + 1, len(args_list)):
-                            arg3_ = args_list[xx3]
-
-                            # combine three arguments
-                            args123_ = [arg1_, arg2_, arg3_]
-                            args123 = collections.Counter(args123_)
-
-                            # argument id
-                            a3id = rels_group[xx3][3][1]
+        # only the combinations of arguments matching an event structure, in the order of the nested loops
+        # over the arguments: 1, 2, 3, 4 arguments
+        for arg_ids in self._arg_combinations(args_list, ev_structs, rels_group[0][0]):
+            cand_args_ = [args_list[xx] for xx in arg_ids]
+            cand_args = collections.Counter(cand_args_)
 
-                            if isArg3 and args123 in ev_structs3:
-                                # get argument ids
-                                a2ids = [a1id, a2id, a3id]
+            # get argument ids
+            a2ids = [rels_group[xx][3][1] for xx in arg_ids]
 
-                                # generate candidate output
-                                cand_output = self.generate_candidate_output(trid, args123, args123_, [xx1, xx2, xx3],
-                                                                             a2ids, ev_truth[3],
-                                                                             mod_labels)
-                                cands.append(cand_output)
-
-                            # check for 4 arguments
-                            if n_args > 3 and max_n_args == 4:
-                                for xx4 in range(xx3 + 1, len(args_list)):
-                                    arg4_ = args_list[xx4]
-
-                                    # combine four arguments
-                                    args1234_ = [arg1_, arg2_, arg3_, arg4_]
-                                    args1234 = collections.Counter(args1234_)
-
-                                    # argument id
-                                    a4id = rels_group[xx4][3][1]
-
-                                    if isArg4 and args1234 in ev_structs4:
-                                        # get argument ids
-                                        a2ids = [a1id, a2id, a3id, a4id]
-
-                                        # generate candidate output
-                                        cand_output = self.generate_candidate_output(trid, args1234, args1234_,
-                                                                                     [xx1, xx2, xx3, xx4],
-                                                                                     a2ids, ev_truth[4], mod_labels)
-                                        cands.append(cand_output)
+            # generate candidate output
+            # 3rd argument: number of event arguments
+            # 4th argument: [IN indices] # the remain in the argument list will be OUT indices
+            cand_output = self.generate_candidate_output(trid, cand_args, cand_args_, list(arg_ids), a2ids,
+                                                         ev_truth[len(arg_ids)], mod_labels)
+            cands.append(cand_output)
 
         return cands
 
@@ -406,14 +329,14 @@ class EV_Generator(nn.Module):
         # convert list to Counter to compare with event structure
         cand_struct = collections.Counter(args_list)
 
-        # get the list of event structures with one-argument (id=1)
-        ev_structs1 = ev_structs[1]
+        # get the event structures with one-argument (id=1)
+        allowed, _ = self._structs_index(ev_structs, rels_group[0][0], nested=True)
 
         # check there is structure for this trigger type
-        if ev_structs1 != -1:
+        if len(allowed[1]) > 0:
 
             # compare if this pair (relation type, trigger type) is in the structure, then create candidate
-            if cand_struct in ev_structs1:
+            if tuple(args_list) in allowed[1]:
 
                 # get argument id stored in rels_group[0][3] (0=only one relation, 3=id in the list)[1]=entity id
 
@@ -447,202 +370,113 @@ class EV_Generator(nn.Module):
         # store candidate in a list
         cands = []
 
-        # get the list of event structures with 1, 2, 3, 4 arguments
-        ev_structs1 = ev_structs[1]
-        ev_structs2 = ev_structs[2]
-        ev_structs3 = ev_structs[3]
-        ev_structs4 = ev_structs[4]
+        # only the combinations of arguments matching an event structure, in the order of the nested loops
+        # over the arguments: 1, 2, 3, 4 arguments
+        for arg_ids in self._arg_combinations(args_list, ev_structs, rels_group[0][0], nested=True):
 
-        # init for ignore empty structure
-        isArg1 = ev_structs1 != -1
-        isArg2 = ev_structs2 != -1
-        isArg3 = ev_structs3 != -1
-        isArg4 = ev_structs4 != -1
+            # at least one argument is trigger
+            if not any(len(rels_group[xx]) > 5 and rels_group[xx][5] == 1 for xx in arg_ids):
+                continue
 
-        # generate all possible combinations among arguments with limited by the maximum number of args
-        max_n_args = self.params['max_ev_args']
-        # TODO: now fix as 4 arguments, can revise to set in parameter later.
+            cand_args_ = [args_list[xx] for xx in arg_ids]
+            cand_args = collections.Counter(cand_args_)
 
-        for xx1, arg1_ in enumerate(args_list):
+            # get pairs of (a2id, (level, positive id)) by level
+            preds_ = [rels_group[xx][4] for xx in arg_ids]
 
-            # check one arg first
-            args1_ = [arg1_]
-            args1 = collections.Counter(args1_)
+            # try for all predicted events with the trigger arguments
+            for levels in itertools.product(*[range(len(pred_)) for pred_ in preds_]):
 
-            # get pairs of (a2id, (level, positive id))
-            preds1_ = rels_group[xx1][4]
+                # make sure there is at least one new level to avoid duplicate (not needed for one argument)
+                if len(arg_ids) > 1 and current_level not in levels:
+                    continue
 
-            # check if this argument is a trigger
-            if len(rels_group[xx1]) > 5 and rels_group[xx1][5] == 1:
-                isNest1 = True
-            else:
-                isNest1 = False
+                # try all combinations between any argument of any level
+                for pairs in itertools.product(*[pred_[level] for pred_, level in zip(preds_, levels)]):
+                    a2ids = [a2id for (a2id, _) in pairs]
+                    pids = [pid for (_, pid) in pairs]
 
-            if isArg1 and args1 in ev_structs1:
+                    # generate candidate output
+                    cand_output = self.generate_nest_candidate_output(trid, cand_args, cand_args_, list(arg_ids),
+                                                                      pids, a2ids, ev_truth[len(arg_ids)],
+                                                                      mod_labels, current_level)
+                    cands.append(cand_output)
 
-                # get argument ids
+        return cands
 
-                # generate candidate output
-                # 3rd argument: number of event arguments
-                # 4th argument: [IN indices] # the remain in the argument list will be OUT indices
+    def _structs_index(self, ev_structs, typeid, nested=False):
+        """
+        Event structures of a trigger type, indexed once for the candidate enumeration (memoized by flat/nested
+        and trigger type, `ev_structs` is the row of the type in the flat or nested structure map):
+            + the argument multisets allowed for each number of arguments
+            + the argument multisets that can still be completed into a larger structure
+        A multiset is the sorted tuple of its (relation type, argument type) pairs.
+        """
 
-                if isNest1:
-                    # try for all predicted events with this trigger
-                    for level1, pred1_ in enumerate(preds1_):
-                        for (a1id, p1id) in pred1_:
-                            a2ids = [a1id]
-                            cand_output = self.generate_nest_candidate_output(trid, args1, args1_, [xx1], [p1id], a2ids,
-                                                                              ev_truth[1], mod_labels, current_level)
-                            cands.append(cand_output)
+        key = (nested, typeid)
 
-            # check for 2, 3, 4 combined args
-            if n_args > 1:
+        if key not in self.structs_indices:
+            allowed = collections.defaultdict(set)
+            partial = set()
 
-                for xx2 in range(xx1 + 1, len(args_list)):
-                    arg2_ = args_list[xx2]
+            for n_args, structs in enumerate(ev_structs):
+                if n_args == 0 or structs == -1:
+                    continue
 
-                    # combine two arguments
-                    args12_ = [arg1_, arg2_]
-                    args12 = collections.Counter(args12_)
+                for struct in structs:
+                    args = sorted(struct.elements())
+                    allowed[n_args].add(tuple(args))
 
-                    # get pairs of (a2id, (level, positive id))
-                    preds2_ = rels_group[xx2][4]
+                    for n_sub_args in range(1, n_args):
+                        partial.update(itertools.combinations(args, n_sub_args))
 
-                    # check if this argument is a trigger
-                    if len(rels_group[xx2]) > 5 and rels_group[xx2][5] == 1:
-                        isNest2 = True
-                    else:
-                        isNest2 = False
+            self.structs_indices[key] = (allowed, partial)
 
-                    if isArg2 and args12 in ev_structs2:
+        return self.structs_indices[key]
 
-                        # at least one argument is trigger
-                        if isNest1 or isNest2:
+    def _arg_combinations(self, args_list, ev_structs, typeid, nested=False):
+        """
+        Argument index combinations (increasing indices) matching an event structure, enumerated depth-first
+        in the order of the original nested loops. A combination is only extended if it is part of a larger
+        structure, the argument lists of trigger-dense sentences are not enumerated exhaustively.
+        """
 
-                            # try for all predicted events with this trigger
-                            for level1, pred1_ in enumerate(preds1_):
-                                for level2, pred2_ in enumerate(preds2_):
+        allowed, partial = self._structs_index(ev_structs, typeid, nested)
 
-                                    # make sure there is at least one new level to avoid duplicate
-                                    if level1 == current_level or level2 == current_level:
+        # up to 4 arguments with max_ev_args 4, 3 otherwise, as the original nested loops
+        max_n_args = 4 if self.params['max_ev_args'] == 4 else 3
 
-                                        # try all combinations between any argument of any level
-                                        for (a1id, p1id) in pred1_:
-                                            for (a2id, p2id) in pred2_:
-                                                a2ids = [a1id, a2id]
+        def extend(start, arg_ids, args):
+            for xx in range(start, len(args_list)):
+                cand_ids = arg_ids + (xx,)
+                cand_args = tuple(sorted(args + (args_list[xx],)))
 
-                                                # generate candidate output
-                                                cand_output = self.generate_nest_candidate_output(trid, args12, args12_,
-                                                                                                  [xx1, xx2],
-                                                                                                  [p1id, p2id], a2ids,
-                                                                                                  ev_truth[2],
-                                                                                                  mod_labels,
-                                                                                                  current_level)
-                                                cands.append(cand_output)
+                if cand_args in allowed[len(cand_ids)]:
+                    yield cand_ids
 
-                    # check for 3, 4 arguments
-                    if n_args > 2:
-                        for xx3 in range(xx2 + 1, len(args_list)):
-                            arg3_ = args_list[xx3]
+                if len(cand_ids) < max_n_args and cand_args in partial:
+                    yield from extend(xx + 1, cand_ids, cand_args)
 
-                            # combine three arguments
-                            args123_ = [arg1_, arg2_, arg3_]
-                            args123 = collections.Counter(args123_)
+        return extend(0, (), ())
 
-                            # get pairs of (a2id, (level, positive id))
-                            preds3_ = rels_group[xx3][4]
+    def _limit_candidates(self, cands, rels_group):
+        """
+        Keep the `max_ev_cands_per_tr` best candidates of a trigger (no limit by default).
+        The score of a candidate is the mean confidence of its argument relations, ties keep the enumeration order.
+        """
 
-                            # check if this argument is a trigger
-                            if len(rels_group[xx3]) > 5 and rels_group[xx3][5] == 1:
-                                isNest3 = True
-                            else:
-                                isNest3 = False
-
-                            if isArg3 and args123 in ev_structs3:
-
-                                # at least one argument is trigger
-                                if isNest1 or isNest2 or isNest3:
-
-                                    # try for all predicted events with this trigger
-                                    for level1, pred1_ in enumerate(preds1_):
-                                        for level2, pred2_ in enumerate(preds2_):
-                                            for level3, pred3_ in enumerate(preds3_):
-
-                                                # make sure there is at least one new level to avoid duplicate
-                                                if level1 == current_level or level2 == current_level or level3 == current_level:
-
-                                                    # try all combinations between any argument of any level
-                                                    for (a1id, p1id) in pred1_:
-                                                        for (a2id, p2id) in pred2_:
-                                                            for (a3id, p3id) in pred3_:
-                                                                a2ids = [a1id, a2id, a3id]
-
-                                                                # generate candidate output
-                                                                cand_output = self.generate_nest_candidate_output(trid,
-                                                                                                                  args123,
-                                                                                                                  args123_,
-                                                                                                                  [xx1,
-                                                                                                                   xx2,
-                                                                                                                   xx3],
-                                                                                                                  [p1id,
-                                                                                                                   p2id,
-                                                                                                                   p3id],
-                                                                                                                  a2ids,
-                                                                                                                  ev_truth[
-                                                                                                                      3],
-                                                                                                                  mod_labels,
-                                                                                                                  current_level)
-                                                                cands.append(cand_output)
-
-                            # check for 4 arguments
-                            if n_args > 3 and max_n_args == 4:
-                                for xx4 in range(xx3 + 1, len(args_list)):
-                                    arg4_ = args_list[xx4]
-
-                                    # combine four arguments
-                                    args1234_ = [arg1_, arg2_, arg3_, arg4_]
-                                    args1234 = collections.Counter(args1234_)
-
-                                    # get pairs of (a2id, (level, positive id))
-                                    preds4_ = rels_group[xx4][4]
-
-                                    # check if this argument is a trigger
-                                    if len(rels_group[xx4]) > 5 and rels_group[xx4][5] == 1:
-                                        isNest4 = True
-                                    else:
-                                        isNest4 = False
-
-                                    if isArg4 and args1234 in ev_structs4:
-
-                                        # at least one argument is trigger
-                                        if isNest1 or isNest2 or isNest3 or isNest4:
-
-                                            # try for all predicted events with this trigger
-                                            for level1, pred1_ in enumerate(preds1_):
-                                                for level2, pred2_ in enumerate(preds2_):
-                                                    for level3, pred3_ in enumerate(preds3_):
-                                                        for level4, pred4_ in enumerate(preds4_):
-
-                                                            # make sure there is at least one new level to avoid duplicate
-                                                            if level1 == current_level or level2 == current_level or level3 == current_level or level4 == current_level:
-
-                                                                # try all combinations between any argument of any level
-                                                                for (a1id, p1id) in pred1_:
-                                                                    for (a2id, p2id) in pred2_:
-                                                                        for (a3id, p3id) in pred3_:
-                                                                            for (a4id, p4id) in pred4_:
-                                                                                a2ids = [a1id, a2id, a3id, a4id]
-
-                                                                                # generate candidate output
-                                                                                cand_output = self.generate_nest_candidate_output(
-                                                                                    trid, args1234, args1234_,
-                                                                                    [xx1, xx2, xx3, xx4],
-                                                                                    [p1id, p2id, p3id, p4id],
-                                                                                    a2ids, ev_truth[4], mod_labels,
-                                                                                    current_level)
-                                                                                cands.append(cand_output)
+        max_cands = self.params.get('max_ev_cands_per_tr')
 
-        return cands
+        if not max_cands or len(cands) <= max_cands:
+            return cands
+
+        if self.rel_scores is None:
+            return cands[:max_cands]
+
+        scores = [np.mean([self.rel_scores[rels_group[xx][1]] for xx in cand[5]]) for cand in cands]
+        kept = sorted(sorted(range(len(cands)), key=lambda xx: -scores[xx])[:max_cands])
+
+        return [cands[xx] for xx in kept]
 
     def create_arg_candidates(self, trid, rels_group, ev_truth, mod_labels, ev_structs):
         """
@@ -698,6 +532,7 @@ class EV_Generator(nn.Module):
             two_arg_cands = self.create_multiple_flat_arg_candidates(trid, rels_group, args_list, n_args, ev_truth,
                                                                      mod_labels,
                                                                      ev_structs)
+            two_arg_cands = self._limit_candidates(two_arg_cands, rels_group)
 
             if len(two_arg_cands) > 0:
                 arg_cands.extend(two_arg_cands)
@@ -802,6 +637,7 @@ class EV_Generator(nn.Module):
             one_arg_cands = self.create_one_nest_arg_candidates(trid, rels_group, args_list,
                                                                 ev_truth[current_nested_level + 1][1], mod_labels,
                                                                 ev_structs, current_nested_level)
+            one_arg_cands = self._limit_candidates(one_arg_cands, rels_group)
 
             if len(one_arg_cands) > 0:
                 arg_cands.extend(one_arg_cands)
@@ -821,6 +657,7 @@ class EV_Generator(nn.Module):
                                                                      ev_truth[current_nested_level + 1],
                                                                      mod_labels,
                                                                      ev_structs, current_nested_level)
+            two_arg_cands = self._limit_candidates(two_arg_cands, rels_group)
 
             if len(two_arg_cands) > 0:
                 arg_cands.extend(two_arg_cands)
@@ -1102,9 +939,12 @@ class EV_Generator(nn.Module):
         return {'ev_cand_ids4nn': ev_flat_cands_ids4nn, 'ev_arg_ids4nn': ev_flat_arg_ids4nn,
                 'ev_nest_cand_triggers': ev_nest_cand_triggers}
 
-    def _generate(self, etypes, tr_ids, l2r, rpred_types, rpred_ids, ev_idx, ev_truth, ev_lbls):
+    def _generate(self, etypes, tr_ids, l2r, rpred_types, rpred_ids, ev_idx, ev_truth, ev_lbls, rel_scores=None):
         """Generate event candidates indices for creating embeddings."""
 
+        # also used for the nested candidates of this batch
+        self.rel_scores = rel_scores
+
         # a map with two output:
         # 1-event candidate indices: a list of event candidate, [trigger id, event label, modality label, in/out ids]
         # 2-event argument indices for each trigger: a map (key: trigger id, values: ids of relations and entity arguments)
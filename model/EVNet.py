@@ -151,195 +151,90 @@ class EVModel(nn.Module):
 
         return rtype_embeds, no_rel_type_embed
 
-    def get_arg_embeds(self, ent_embeds, rel_embeds, rtype_embeds, ev_arg_ids4nn):
-        """Argument embeddings for each trigger.
-            - Each trigger has a two-element tuple of
-                1. trigger embedding
-                2. a list of argument embedding: (relation emb, relation type emb, argument entity emb)
+    def get_arg_embeds(self, ent_embeds, ent_rows, rel_embeds, rtype_embeds, ev_arg_ids4nn, no_rel_type_embed,
+                       ev_table=None, ev_offsets=None):
+        """Argument inputs of all the triggers of a level, stacked in one table.
+            - Each row is a concatenation of (relation emb, relation type emb, argument emb):
+                1. one no-argument row per trigger: no relation, no relation type, the trigger itself
+                2. one row per entity argument
+                3. nested levels: one row per (argument, event) for the event arguments, the event emb is read
+                   from the table of the events predicted at the lower levels, at ev_offsets[level] + positive id
+            - Each trigger has a tuple of
+                1. trigger index, in the trigger embeddings and in the no-argument rows
+                2. entity argument rows
+                3. for each argument, the rows of its event arguments by (level, positive event id)
         """
 
-        arg_embed_triggers = collections.OrderedDict()
-
-        for trid, arg_data in ev_arg_ids4nn.items():
-            tr_embeds = ent_embeds[trid]
-
-            # no-argument
-            if len(arg_data) == 1:
-                arg_embed_triggers[trid] = [tr_embeds]
-
-            # has argument:
-            else:
-                rids = arg_data[0]
-                a2ids = arg_data[1]
-                a2ids_ = np.vstack(a2ids).transpose()
-                r_embeds = rel_embeds[rids]
-                a2_embeds = ent_embeds[(a2ids_[0], a2ids_[1])]
-                rt_embeds = rtype_embeds[rids]
+        trids = list(ev_arg_ids4nn.keys())
+        n_trs = len(trids)
 
+        # trigger embeddings
+        tr_embeds = ent_embeds[ent_rows[[int(trid[0]) for trid in trids], [int(trid[1]) for trid in trids]]]
 
-                args_embeds = torch.cat([r_embeds, rt_embeds, a2_embeds],
-                                        dim=-1)  # [number of arguments, rdim+rtypedim+edim]
+        # 1-no-argument rows
+        no_rel_embeds = torch.zeros((n_trs, self.params['rel_reduced_size']), dtype=no_rel_type_embed.dtype,
+                                    device=self.device)
+        arg_table = [torch.cat([no_rel_embeds, no_rel_type_embed.expand(n_trs, -1), tr_embeds], dim=-1)]
 
-                # store in a map to use later
-                arg_embed_triggers[trid] = [tr_embeds, args_embeds]
-
-        return arg_embed_triggers
-
-    def event_representation(self, arg_embed_triggers, ev_cand_ids4nn, no_rel_type_embed):
-        """Create event representation."""
-
-        # get indices
-        trids_ = ev_cand_ids4nn['trids_']
-        io_ids_ = ev_cand_ids4nn['io_ids_']
-        ev_structs_ = ev_cand_ids4nn['ev_structs_']
-
-        # store event embeds in a list, return an array later
-        ev_embeds_ = []
-
-        # create embedding for each candidate indices
-        for xx, trid in enumerate(trids_):
-
-            # trigger embed
-            tr_embed = arg_embed_triggers[trid][0]
-
-            # store reduced argument embeds in a list
-            args_embeds_list = []
+        # 2-entity argument rows
+        rids = []
+        a2ids = []
+        tr_arg_rows = []
+        for trid, arg_data in ev_arg_ids4nn.items():
 
-            # get ev_struct
-            ev_struct = ev_structs_[xx]
+            # has argument
+            if len(arg_data) > 1:
+                tr_arg_rows.append(list(range(n_trs + len(rids), n_trs + len(rids) + len(arg_data[0]))))
+                rids.extend(arg_data[0])
+                a2ids.extend(arg_data[1])
 
             # no-argument
-            if len(ev_struct[1]) == 0:
-
-                # arg_embed = concat[rel_embed, rel_type_embed, argument_embed]
-                # since there is no argument, rel_embed is set as zeros
-                no_rel_emb = torch.zeros((self.params['rel_reduced_size']), dtype=no_rel_type_embed.dtype,
-                                         device=self.device)
-
-                # argument emb is itself: trigger embed
-                # then concatenate
-                arg_embed = torch.cat([no_rel_emb, no_rel_type_embed, tr_embed])
-
-                # put to IN ARGUMENT layer
-                reduced_arg_embed = self.in_arg_layer(arg_embed)
-                args_embeds_list.append(reduced_arg_embed)
-
-                # check whether this trigger has other arguments, then set as OUT
-                if len(arg_embed_triggers[trid]) > 1:
-
-                    # argument embed
-                    args_embeds = arg_embed_triggers[trid][1]
-
-                    # calculate argument embedding
-                    for xx, arg_embed in enumerate(args_embeds):
-                        # OUT argument via OUT-ARG LAYER
-                        reduced_arg_embed = self.out_arg_layer(arg_embed)
-
-                        # store
-                        args_embeds_list.append(reduced_arg_embed)
-
-            # has argument
             else:
+                tr_arg_rows.append([])
 
-                # argument embed
-                args_embeds = arg_embed_triggers[trid][1]
-
-                # check IN/OUT
-                io_ids = io_ids_[xx]
-
-                # calculate argument embedding
-                for ioid, arg_embed in enumerate(args_embeds):
-
-                    # IN argument via IN-ARG LAYER
-                    if ioid in io_ids:
-                        reduced_arg_embed = self.in_arg_layer(arg_embed)
-
-                    # OUT argument via OUT-ARG LAYER
-                    else:
-                        reduced_arg_embed = self.out_arg_layer(arg_embed)
-
-                    # store
-                    args_embeds_list.append(reduced_arg_embed)
-
-            # calculate argument embed: by sum up all arguments or average, etc
-            # TODO: currently, use SUM
-            args_embed = torch.sum(torch.stack(args_embeds_list, dim=0), dim=0)
-
-            # TODO: average
-            # args_embed = torch.mean(torch.stack(args_embeds_list, dim=0),dim=0)
-
-            # event embed: concatenate trigger embed and argument embed
-            ev_embeds_.append(torch.cat([tr_embed, args_embed], dim=-1))
-
-        # return tensor [number of event, dim]
-        ev_embeds = torch.stack(ev_embeds_, dim=0)
-
-        # dropout
-        if self.training:
-            if self.params['dropout'] > 0:
-                ev_embeds = F.dropout(ev_embeds, p=self.params['dropout'])
-
-        return ev_embeds
-
-    def get_nest_arg_embeds(self, ent_embeds, rel_embeds, rtype_embeds, ev_arg_ids4nn, all_ev_embeds):
-        """Argument embeddings for each trigger.
-            - Each trigger has a two-element tuple of
-                1. trigger embedding
-                2. a list of argument embedding: (relation emb, relation type emb, argument entity emb)
-        """
-
-        # store a list of embeds for each trigger: trigger embeds, relation embeds, relation type embeds
-        arg_embed_triggers = collections.OrderedDict()
-
-        for trid, arg_data in ev_arg_ids4nn.items():
-            tr_embeds = ent_embeds[trid]
-
-            rids = arg_data[0]
-            a2ids = arg_data[1]
+        if len(rids) > 0:
             a2ids_ = np.vstack(a2ids).transpose()
-            r_embeds = rel_embeds[rids]
-            a2_embeds = ent_embeds[(a2ids_[0], a2ids_[1])]
-            rt_embeds = rtype_embeds[rids]
-
-            # replace event embeds for event arguments
-            ev_argids_ = arg_data[2]
-
-            # store event argument embeds by (argument id, event id)
-            ev_arg_embeds_list = [[] for argid in range(len(rids))]
-
-            for argid, ev_argids in enumerate(ev_argids_):
-
-                # event argument
-                if len(ev_argids) > 0:
+            a2_embeds = ent_embeds[ent_rows[(a2ids_[0], a2ids_[1])]]
+            arg_table.append(torch.cat([rel_embeds[rids], rtype_embeds[rids], a2_embeds],
+                                       dim=-1))  # [number of arguments, rdim+rtypedim+edim]
+
+        # 3-event argument rows, only for nested events
+        ev_rids = []
+        ev_ids = []
+        ev_rows = []
+        for trid, arg_data in ev_arg_ids4nn.items():
+            tr_ev_rows = []
 
-                    # store event argument embeds with key is event id
-                    ev_arg_embeds = collections.OrderedDict()
+            if len(arg_data) > 2:
+                for argid, ev_argids in enumerate(arg_data[2]):
+                    arg_ev_rows = collections.OrderedDict()
 
                     for pid in ev_argids:
                         # pid: (level, positive_event_id)
+                        arg_ev_rows[pid] = n_trs + len(rids) + len(ev_ids)
+                        ev_rids.append(arg_data[0][argid])
+                        ev_ids.append(ev_offsets[pid[0]] + pid[1])
+
+                    tr_ev_rows.append(arg_ev_rows)
 
-                        # store event argument embed by argument id and event id
-                        ev_arg_emb = all_ev_embeds[pid[0]][pid[1]]
-                        ev_rel_emb = r_embeds[argid]
-                        ev_rtype_emb = rt_embeds[argid]
+            ev_rows.append(tr_ev_rows)
 
-                        # concatenate with relation and relation type embeds
-                        ev_arg_embeds[pid] = torch.cat([ev_rel_emb, ev_rtype_emb, ev_arg_emb], dim=-1)
+        if len(ev_ids) > 0:
+            arg_table.append(torch.cat([rel_embeds[ev_rids], rtype_embeds[ev_rids], ev_table[ev_ids]], dim=-1))
 
-                    # add to the list
-                    ev_arg_embeds_list[argid] = ev_arg_embeds
+        arg_table = torch.cat(arg_table, dim=0)
 
-            # concatenate for argument embeddings: [rel_embed, rel_type_embed, entity_embed]
-            args_embeds = torch.cat([r_embeds, rt_embeds, a2_embeds],
-                                    dim=-1)  # [number of arguments, rdim+rtypedim+edim]
+        tr_rows = collections.OrderedDict(
+            (trid, (xx, tr_arg_rows[xx], ev_rows[xx])) for xx, trid in enumerate(trids))
 
-            # store in a map to use later
-            arg_embed_triggers[trid] = [tr_embeds, args_embeds, ev_arg_embeds_list]
+        return tr_embeds, arg_table, tr_rows
 
-        return arg_embed_triggers
+    def event_representation(self, tr_embeds, arg_table, tr_rows, ev_cand_ids4nn, nested=False):
+        """Create the representation of all the event candidates of a level at once.
 
-    def event_nest_representation(self, arg_embed_triggers, ev_cand_ids4nn, no_rel_type_embed):
-        """Create event representation."""
+        The argument rows of each candidate go through the IN-ARG layer (argument IN its structure) or the OUT-ARG
+        layer (other arguments of the trigger), then they are summed up and concatenated to the trigger embedding.
+        """
 
         # get indices
         trids_ = ev_cand_ids4nn['trids_']
@@ -347,118 +242,62 @@ class EVModel(nn.Module):
         ev_structs_ = ev_cand_ids4nn['ev_structs_']
         pos_ev_ids_ = ev_cand_ids4nn['pos_ev_ids_']
 
-        # store event embeds in a list, return an array later
-        ev_embeds_ = []
-
-        # create embedding for each candidate indices
-        for xx, trid in enumerate(trids_):
-
-            # trigger embed
-            tr_embed = arg_embed_triggers[trid][0]
-
-            # store reduced argument embeds in a list
-            args_embeds_list = []
-
-            # get ev_struct
-            ev_struct = ev_structs_[xx]
-
-            # no-argument
-            if len(ev_struct[1]) == 0:
+        # rows of the OUT arguments are shifted after the ones of the IN arguments
+        n_rows = arg_table.shape[0]
 
-                # arg_embed = concat[rel_embed, rel_type_embed, argument_embed]
-                # since there is no argument, rel_embed is set as zeros
-                no_rel_emb = torch.zeros((self.params['rel_reduced_size']), dtype=no_rel_type_embed.dtype,
-                                         device=self.device)
+        # trigger of each candidate, and (candidate, argument row) to sum up
+        cand_tr_ids = []
+        arg_cands = []
+        arg_rows = []
 
-                # argument emb is itself: trigger embed
-                # then concatenate
-                arg_embed = torch.cat([no_rel_emb, no_rel_type_embed, tr_embed])
-
-                # put to IN ARGUMENT layer
-                reduced_arg_embed = self.in_arg_layer(arg_embed)
-                args_embeds_list.append(reduced_arg_embed)
-
-                # check whether this trigger has other arguments, then set as OUT
-                if len(arg_embed_triggers[trid]) > 1:
+        for xx, trid in enumerate(trids_):
+            tr_id, ent_rows, ev_rows = tr_rows[trid]
+            cand_tr_ids.append(tr_id)
 
-                    # argument embed
-                    args_embeds = arg_embed_triggers[trid][1]
+            rows = []
 
-                    # calculate argument embedding
-                    for xx, arg_embed in enumerate(args_embeds):
-                        # OUT argument via OUT-ARG LAYER
-                        reduced_arg_embed = self.out_arg_layer(arg_embed)
+            # no-argument: the trigger itself is IN, the other arguments of the trigger are OUT
+            if len(ev_structs_[xx][1]) == 0:
+                rows.append(tr_id)
+                rows.extend(row + n_rows for row in ent_rows)
 
-                        # store
-                        args_embeds_list.append(reduced_arg_embed)
+            # flat event
+            elif not nested:
+                io_ids = io_ids_[xx]
+                rows.extend(row if ioid in io_ids else row + n_rows for ioid, row in enumerate(ent_rows))
 
-            # has argument
+            # nested event: an IN argument is an entity or an event, an OUT argument is its entity or all its events
             else:
-
-                # argument embed
-                args_embeds = arg_embed_triggers[trid][1]
-
-                # event argument embeds
-                ev_args_embeds = arg_embed_triggers[trid][2]
-
-                # check IN/OUT
                 io_ids = io_ids_[xx]
-
-                # positive event ids
                 pos_ids = pos_ev_ids_[xx]
 
-                # calculate argument embedding
-                for ioid, arg_embed in enumerate(args_embeds):
-
-                    # IN argument via IN-ARG LAYER
+                for ioid, row in enumerate(ent_rows):
                     if ioid in io_ids:
-
-                        for xx2, inid in enumerate(io_ids):
+                        for inid, pid in zip(io_ids, pos_ids):
                             if inid == ioid:
-                                pid = pos_ids[xx2]
-                                # pid = pos_ids[io_ids.index(ioid)]
+                                rows.append(row if pid == (-1, -1) else ev_rows[ioid][pid])
 
-                                # entity argument
-                                if pid == (-1, -1):
-                                    reduced_arg_embed = self.in_arg_layer(arg_embed)
-                                    args_embeds_list.append(reduced_arg_embed)
+                    elif len(ev_rows[ioid]) == 0:
+                        rows.append(row + n_rows)
 
-                                # event argument
-                                else:
-                                    ev_arg_embed = ev_args_embeds[ioid][pid]
-                                    reduced_arg_embed = self.in_arg_layer(ev_arg_embed)
-                                    args_embeds_list.append(reduced_arg_embed)
-
-                    # OUT argument via OUT-ARG LAYER
                     else:
+                        rows.extend(ev_row + n_rows for ev_row in ev_rows[ioid].values())
 
-                        # entity argument
-                        if len(ev_args_embeds[ioid]) == 0:
-                            reduced_arg_embed = self.out_arg_layer(arg_embed)
-                            args_embeds_list.append(reduced_arg_embed)
-
-                        # event arguments: run with all event arguments for this trigger
-                        else:
-                            for pid in ev_args_embeds[ioid]:
-                                ev_arg_embed = ev_args_embeds[ioid][pid]
-                                reduced_arg_embed = self.out_arg_layer(ev_arg_embed)
-                                args_embeds_list.append(reduced_arg_embed)
-
-                    # store
-                    # args_embeds_list.append(reduced_arg_embed)
+            arg_cands.extend([xx] * len(rows))
+            arg_rows.extend(rows)
 
-            # calculate argument embed: by sum up all arguments or average, etc
-            # TODO: currently, use SUM
-            args_embed = torch.sum(torch.stack(args_embeds_list, dim=0), dim=0)
+        # IN and OUT argument embeddings of every row
+        reduced_arg_embeds = torch.cat([self.in_arg_layer(arg_table), self.out_arg_layer(arg_table)], dim=0)
 
-            # TODO: average
-            # args_embed = torch.mean(torch.stack(args_embeds_list, dim=0),dim=0)
+        # calculate argument embed: by sum up all arguments
+        args_embeds = torch.zeros((len(trids_), reduced_arg_embeds.shape[-1]), dtype=reduced_arg_embeds.dtype,
+                                  device=self.device)
+        args_embeds = args_embeds.index_add(0, torch.tensor(arg_cands, dtype=torch.long, device=self.device),
+                                            reduced_arg_embeds[torch.tensor(arg_rows, dtype=torch.long,
+                                                                            device=self.device)])
 
-            # event embed: concatenate trigger embed and argument embed
-            ev_embeds_.append(torch.cat([tr_embed, args_embed], dim=-1))
-
-        # return tensor [number of event, dim]
-        ev_embeds = torch.stack(ev_embeds_, dim=0)
+        # event embed: concatenate trigger embed and argument embed, [number of event, dim]
+        ev_embeds = torch.cat([tr_embeds[cand_tr_ids], args_embeds], dim=-1)
 
         # dropout
         if self.training:
@@ -538,6 +377,15 @@ class EVModel(nn.Module):
 
         return mod_preds, mod_loss
 
+    def infer_modality(self, positive_ev_embs):
+        """Predict modality without labels: every positive event gets one (inference)."""
+        if positive_ev_embs.shape[0] == 0:
+            return []
+
+        modality_pred = self.modality_layer(positive_ev_embs).detach().cpu()
+
+        return F.softmax(modality_pred, dim=-1).data.argmax(dim=-1)
+
     def create_output(self, all_ev_preds):
         """Create output for writing events."""
 
@@ -614,11 +462,12 @@ class EVModel(nn.Module):
 
         return all_ev_output
 
-    def calculate(self, ent_embeds, rel_embeds, rpred_types, ev_ids4nn, n_epoch):
+    def calculate(self, ent_embeds, ent_rows, rel_embeds, rpred_types, ev_ids4nn, n_epoch, inference=False):
         """
         Create embeddings, prediction, loss.
 
-        :param ent_embeds: [batch x a1id x embeds]
+        :param ent_embeds: [entities + 1 x embeds], flat entity embeddings
+        :param ent_rows: [batch x a1id], row of each entity in ent_embeds
         :param rel_embeds: [rids x embeds]
         :param rpred_types: [rids] # predicted relation types
         :param ev_ids4nn: generated event canddiate indices
@@ -631,6 +480,8 @@ class EVModel(nn.Module):
                 + list of rids
                 + list of argument ids
 
+        :param inference: no labels: no loss, modality predicted for all positive events
+
         :return: prediction, loss
         """
 
@@ -655,8 +506,9 @@ class EVModel(nn.Module):
         all_positive_ids = -1 * np.ones((self.params['max_ev_level'] + 1), dtype=np.object)
         all_positive_tr_ids = -1 * np.ones((self.params['max_ev_level'] + 1), dtype=np.object)
 
-        # store predicted events embeds
-        all_positive_ev_embs = []
+        # table of the predicted events embeds, the events of a level start at its offset
+        ev_table = None
+        ev_offsets = []
 
         # for flat events
         # 1-candidate input
@@ -666,21 +518,25 @@ class EVModel(nn.Module):
         # 2-relation type embeddings
         rtype_embeds, no_rel_type_embed = self.rtype_embedding_layer(rpred_types)
 
-        # 3-argument embeddings for each trigger
-        arg_embed_triggers = self.get_arg_embeds(ent_embeds, rel_embeds, rtype_embeds, ev_flat_arg_ids4nn)
+        # 3-argument embeddings for all triggers
+        tr_embeds, arg_table, tr_rows = self.get_arg_embeds(ent_embeds, ent_rows, rel_embeds, rtype_embeds,
+                                                            ev_flat_arg_ids4nn, no_rel_type_embed)
 
         # 4-create event representation
-        ev_embeds = self.event_representation(arg_embed_triggers, ev_flat_cand_ids4nn, no_rel_type_embed)
+        ev_embeds = self.event_representation(tr_embeds, arg_table, tr_rows, ev_flat_cand_ids4nn)
 
         # 5-prediction
         # positive_ev_embs: embedding of predicted events: using for the next nested level
         event4class, prediction, positive_idx, positive_ev_embs = self.predict(ev_embeds)
 
         # 6-ev loss
-        flat_ev_loss = self.calculate_ev_loss(prediction, ev_flat_cand_ids4nn['ev_labels_'])
+        if not inference:
+            flat_ev_loss = self.calculate_ev_loss(prediction, ev_flat_cand_ids4nn['ev_labels_'])
 
         # for modality
-        if enable_modality:
+        if inference:
+            mod_preds = self.infer_modality(positive_ev_embs)
+        elif enable_modality:
             mod_preds, mod_losses = self.predict_modality(positive_ev_embs, positive_idx,
                                                           ev_flat_cand_ids4nn['mod_labels_'])
         else:
@@ -713,7 +569,12 @@ class EVModel(nn.Module):
 
             # reduce event embeds to replace entity
             reduced_ev_emb = self.ev2ent_reduce(positive_ev_embs)
-            all_positive_ev_embs.append(reduced_ev_emb)
+            if ev_table is None:
+                ev_offsets.append(0)
+                ev_table = reduced_ev_emb
+            else:
+                ev_offsets.append(ev_table.shape[0])
+                ev_table = torch.cat([ev_table, reduced_ev_emb], dim=0)
 
             # generate nested candidate indices
             # 'ev_nest_cand_ids': ev_nest_cands_ids4nn, 'ev_nest_arg_ids4nn': ev_nest_arg_ids4nn
@@ -732,12 +593,13 @@ class EVModel(nn.Module):
             # check non-empty
             if len(ev_nest_cand_ids4nn['trids_']) > 0:
 
-                # 3-argument embeddings for each trigger
-                arg_embed_triggers = self.get_nest_arg_embeds(ent_embeds, rel_embeds, rtype_embeds, ev_nest_arg_ids4nn,
-                                                              all_positive_ev_embs)
+                # 3-argument embeddings for all triggers, the event arguments are read from the events table
+                tr_embeds, arg_table, tr_rows = self.get_arg_embeds(ent_embeds, ent_rows, rel_embeds, rtype_embeds,
+                                                                    ev_nest_arg_ids4nn, no_rel_type_embed,
+                                                                    ev_table=ev_table, ev_offsets=ev_offsets)
 
                 # event representation
-                ev_embeds = self.event_nest_representation(arg_embed_triggers, ev_nest_cand_ids4nn, no_rel_type_embed)
+                ev_embeds = self.event_representation(tr_embeds, arg_table, tr_rows, ev_nest_cand_ids4nn, nested=True)
 
                 # check non-empty predictions
 
@@ -745,10 +607,13 @@ class EVModel(nn.Module):
                 event4class, prediction, positive_idx, positive_ev_embs = self.predict(ev_embeds)
 
                 # ev loss
-                nest_ev_loss += self.calculate_ev_loss(prediction, ev_nest_cand_ids4nn['ev_labels_'])
+                if not inference:
+                    nest_ev_loss += self.calculate_ev_loss(prediction, ev_nest_cand_ids4nn['ev_labels_'])
 
                 # for modality
-                if enable_modality:
+                if inference:
+                    mod_preds = self.infer_modality(positive_ev_embs)
+                elif enable_modality:
                     mod_preds, mod_loss = self.predict_modality(positive_ev_embs, positive_idx,
                                                                 ev_nest_cand_ids4nn['mod_labels_'])
                     mod_losses += mod_loss
@@ -771,6 +636,9 @@ class EVModel(nn.Module):
         # 7-create output for writing events
         pred_ev_output = self.create_output(all_preds_output)
 
+        if inference:
+            return pred_ev_output, None
+
         # scale loss: if flat is stable, focus more on nested
         if current_nested_level == 0:
             ev_loss = flat_ev_loss
@@ -783,7 +651,7 @@ class EVModel(nn.Module):
 
         return pred_ev_output, ev_loss
 
-    def forward(self, ner_preds, rel_preds, n_epoch):
+    def forward(self, ner_preds, rel_preds, n_epoch, inference=False):
         """Forward.
             Given entities and relations, event structures, return event prediction and loss.
         """
@@ -801,6 +669,7 @@ class EVModel(nn.Module):
 
             # entity and trigger embeddings [bert and type embeddings]
             ent_embeds = rel_preds['enttoks_type_embeds']
+            ent_rows = rel_preds['ent_rows']
 
             # trigger
             tr_ids = (ner_preds['tr_ids'] == 1).nonzero(as_tuple=False).transpose(0, 1)
@@ -817,19 +686,21 @@ class EVModel(nn.Module):
                 rpred_types = np.array([rpred_types])
 
 
-            # event
+            # event, no truth in inference
             ev_idx = ner_preds['ev_idxs']
             ev_truth = ner_preds['truth_evs']
-            ev_lbls = np.array(ner_preds['ev_lbls'], dtype=object)
+            ev_lbls = None if inference else np.array(ner_preds['ev_lbls'], dtype=object)
 
             # 2-generate event candidates
             ev_ids4nn = self.ev_struct_generator._generate(etypes, tr_ids, l2r, rpred_types, rpred_ids, ev_idx,
-                                                           ev_truth, ev_lbls)
+                                                           ev_truth, ev_lbls,
+                                                           rel_scores=rel_preds['scores'].cpu().numpy())
 
             # 3-embeds, prediction, and loss
             # check empty
             if len(ev_ids4nn['ev_cand_ids4nn']['trids_']) > 0:
-                ev_out, ev_loss = self.calculate(ent_embeds, rel_embeds, rpred_types, ev_ids4nn, n_epoch)
+                ev_out, ev_loss = self.calculate(ent_embeds, ent_rows, rel_embeds, rpred_types, ev_ids4nn, n_epoch,
+                                                 inference=inference)
                 return {'output': ev_out, 'loss': ev_loss}
 
             else:
@@ -7,6 +7,7 @@ from torch.nn import functional as F
 from torchnlp.word_to_vector.pretrained_word_vectors import _PretrainedWordVectors
 
 from bert.modeling import BertModel, BertPreTrainedModel, BertLayerNorm
+from utils.encoder_cache import EncoderCache, model_fingerprint
 
 
 class NestedNERModel(BertPreTrainedModel):
@@ -43,6 +44,14 @@ class NestedNERModel(BertPreTrainedModel):
         else:
             self.bert = BertModel(config)
 
+        # bert_cache_mb: LRU cache of the encodings of the sentences, for prediction only
+        self.encoder_cache = None
+        self.encoder_fingerprint = None
+        if not params['use_lstm'] and params.get('bert_cache_mb') and not params.get('train', False):
+            self.encoder_cache = EncoderCache(
+                int(params['bert_cache_mb'] * 2 ** 20), fp16=params.get('bert_cache_fp16', False)
+            )
+
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
         if params['ner_reduce']:
@@ -69,9 +78,50 @@ class NestedNERModel(BertPreTrainedModel):
             ),
         )
 
+        # label ids of the triggers, not saved with the weights
+        trigger_label_mask = torch.zeros(256, dtype=torch.bool)
+        trigger_label_mask[list(params["mappings"]["nn_mapping"]["trTypes_Ids"])] = True
+        self.register_buffer("trigger_label_mask", trigger_label_mask, persistent=False)
+
         self.apply(self.init_bert_weights)
         self.params = params
 
+    @staticmethod
+    def align_preds(preds, golds=None):
+        """
+        Align the top-k predicted label ids of each span (0: no label) with the gold label ids.
+
+        A predicted label found in the golds takes the slot of that gold label, the other predicted labels
+        fill the remaining slots in top-k order (the former Python loop took them in the iteration order of a set),
+        and the rest is 0. Without golds (inference), the predicted labels are moved to the first slots.
+
+        :param preds: (all_valid_spans, ner_label_limit), distinct label ids except 0
+        :param golds: (all_valid_spans, ner_label_limit) or None
+        """
+        k = preds.size(-1)
+        slots = torch.arange(k, device=preds.device).view(1, -1)
+
+        if golds is None:
+            gold_in_preds = torch.zeros_like(preds, dtype=torch.bool)
+            other_preds = preds > 0
+        else:
+            gold_in_preds = (golds.unsqueeze(2) == preds.unsqueeze(1)).any(dim=-1) & (golds > 0)
+            other_preds = (preds > 0) & ~(preds.unsqueeze(2) == golds.unsqueeze(1)).any(dim=-1)
+
+        # the other predicted labels first, in top-k order
+        order = torch.argsort((~other_preds).long() * k + slots, dim=-1)
+        other_preds = torch.gather(preds * other_preds, dim=1, index=order)
+
+        # the n-th free slot takes the n-th other predicted label
+        free_slots = ~gold_in_preds
+        free_ranks = (torch.cumsum(free_slots.long(), dim=-1) - 1).clamp(min=0)
+        aligned_preds = torch.gather(other_preds, dim=1, index=free_ranks)
+
+        if golds is not None:
+            aligned_preds = torch.where(gold_in_preds, golds, aligned_preds)
+
+        return aligned_preds
+
     def forward(
             self,
             all_tokens,
@@ -81,6 +131,7 @@ class NestedNERModel(BertPreTrainedModel):
             all_entity_masks,
             all_trigger_masks,
             all_span_labels=None,
+            inference=False,
     ):
         device = all_ids.device
         max_span_width = self.max_span_width
@@ -98,9 +149,26 @@ class NestedNERModel(BertPreTrainedModel):
 
         # or bert
         else:
-            embeddings, sentence_embedding = self.bert(
-            all_ids, attention_mask=all_attention_masks, output_all_encoded_layers=False
-            )  # (B, S, H) (B, 128, 768)
+            # bert_unpad: the padding tokens are skipped, only the real tokens are read below
+            def encode(input_ids, attention_mask):
+                return self.bert(
+                    input_ids, attention_mask=attention_mask, output_all_encoded_layers=False,
+                    unpad=self.params.get('bert_unpad', False)
+                )
+
+            if self.encoder_cache is not None and not self.training:
+                # the weights are fixed once the model is loaded
+                if self.encoder_fingerprint is None:
+                    self.encoder_fingerprint = model_fingerprint(
+                        self.bert, self.params.get('inference_precision'), self.params.get('bert_unpad', False)
+                    )
+
+                embeddings, sentence_embedding = self.encoder_cache.encode(
+                    self.encoder_fingerprint, all_ids, all_attention_masks, encode,
+                    dtype=self.bert.embeddings.word_embeddings.weight.dtype
+                )  # (B, S, H) (B, 128, 768)
+            else:
+                embeddings, sentence_embedding = encode(all_ids, all_attention_masks)  # (B, S, H) (B, 128, 768)
 
         # ! REDUCE
         # embeddings = self.dropout(embeddings)  # (B, S, H) (B, 128, 768)
@@ -194,42 +262,19 @@ class NestedNERModel(BertPreTrainedModel):
             flattened_embeddings, 0, flattened_span_ends
         )  # (all_valid_spans, H)
 
-        # For computing embedding mean
-        mean_indices = flattened_span_starts.view(-1, 1) + torch.arange(
-            max_span_width, device=device
-        ).view(
-            1, -1
-        )  # (all_valid_spans, max_span_width)
-
-        mean_indices_criteria = torch.gt(
-            mean_indices, flattened_span_ends.view(-1, 1).repeat(1, max_span_width)
-        )  # (all_valid_spans, max_span_width)
+        # Embedding mean from the prefix sums of the token embeddings: sum(start..end) = prefix[end + 1] - prefix[start]
+        # accumulated in float64 so that the differences of large prefix sums stay exact enough
+        prefix_sums = F.pad(
+            torch.cumsum(flattened_embeddings, dim=0, dtype=torch.float64), (0, 0, 1, 0)
+        )  # (all_actual_tokens + 1, H)
 
-        mean_indices = torch.min(
-            mean_indices, flattened_span_ends.view(-1, 1).repeat(1, max_span_width)
-        )  # (all_valid_spans, max_span_width)
+        span_widths = (flattened_span_ends - flattened_span_starts + 1).to(torch.float64)  # (all_valid_spans, )
 
-        span_mean_embeddings = torch.index_select(
-            flattened_embeddings, 0, mean_indices.flatten()
-        ).view(
-            *mean_indices.size(), -1
-        )  # (all_valid_spans, max_span_width, H)
-
-        coeffs = torch.ones(
-            mean_indices.size(), dtype=embeddings.dtype, device=device
-        )  # (all_valid_spans, max_span_width)
-
-        coeffs[mean_indices_criteria] = 0
-
-        span_mean_embeddings = span_mean_embeddings * coeffs.unsqueeze(
-            -1
-        )  # (all_valid_spans, max_span_width, H)
-
-        span_mean_embeddings = torch.sum(span_mean_embeddings, dim=1) / torch.sum(
-            coeffs, dim=-1
-        ).view(
-            -1, 1
-        )  # (all_valid_spans, H)
+        span_mean_embeddings = (
+            (torch.index_select(prefix_sums, 0, flattened_span_ends + 1)
+             - torch.index_select(prefix_sums, 0, flattened_span_starts))
+            / span_widths.view(-1, 1)
+        ).to(flattened_embeddings.dtype)  # (all_valid_spans, H)
 
         combined_embeddings = torch.cat(
             (
@@ -263,16 +308,17 @@ class NestedNERModel(BertPreTrainedModel):
 
         sentence_sections = all_span_masks.sum(dim=-1).cumsum(dim=-1)  # (B, )
 
-        # The number of possible spans is all_valid_spans = K * (2 * N - K + 1) / 2
-        # K: max_span_width
-        # N: number of tokens
-        actual_span_labels = all_span_labels[
-            all_span_masks
-        ]  # (all_valid_spans, num_entities + num_triggers)
+        if not inference:
+            # The number of possible spans is all_valid_spans = K * (2 * N - K + 1) / 2
+            # K: max_span_width
+            # N: number of tokens
+            actual_span_labels = all_span_labels[
+                all_span_masks
+            ]  # (all_valid_spans, num_entities + num_triggers)
 
-        actual_trigger_labels, actual_entity_labels = torch.split(
-            actual_span_labels, [self.num_triggers, self.num_entities], dim=-1
-        )  # (all_valid_spans, num_entities), (all_valid_spans, num_triggers)
+            actual_trigger_labels, actual_entity_labels = torch.split(
+                actual_span_labels, [self.num_triggers, self.num_entities], dim=-1
+            )  # (all_valid_spans, num_entities), (all_valid_spans, num_triggers)
 
         # criterion = nn.CrossEntropyLoss(weight=self.class_weights)
 
@@ -293,72 +339,63 @@ class NestedNERModel(BertPreTrainedModel):
         all_preds[~all_trigger_masks, : self.num_triggers] = 0
         all_preds[~all_entity_masks, self.num_triggers:] = 0
 
-        # Compute entity loss
-        entity_loss = F.binary_cross_entropy_with_logits(
-            entity_preds[all_entity_masks], actual_entity_labels[all_entity_masks]
-        )
+        # no labels, no loss
+        if inference:
+            total_loss = None
+        else:
+            # Compute entity loss
+            entity_loss = F.binary_cross_entropy_with_logits(
+                entity_preds[all_entity_masks], actual_entity_labels[all_entity_masks]
+            )
 
-        # Compute trigger loss
-        trigger_loss = F.binary_cross_entropy_with_logits(
-            trigger_preds[all_trigger_masks], actual_trigger_labels[all_trigger_masks]
-        )
+            # Compute trigger loss
+            trigger_loss = F.binary_cross_entropy_with_logits(
+                trigger_preds[all_trigger_masks], actual_trigger_labels[all_trigger_masks]
+            )
 
-        # Support for random-noise adding trick
-        entity_coeff = all_entity_masks.sum().float()
-        trigger_coeff = all_trigger_masks.sum().float()
-        denominator = entity_coeff + trigger_coeff
+            # Support for random-noise adding trick
+            entity_coeff = all_entity_masks.sum().float()
+            trigger_coeff = all_trigger_masks.sum().float()
+            denominator = entity_coeff + trigger_coeff
 
-        entity_coeff /= denominator
-        trigger_coeff /= denominator
+            entity_coeff /= denominator
+            trigger_coeff /= denominator
 
-        if self.num_triggers > 0:
-            total_loss = entity_coeff * entity_loss + trigger_coeff * trigger_loss
-        else:
-            total_loss = entity_coeff * entity_loss
+            if self.num_triggers > 0:
+                total_loss = entity_coeff * entity_loss + trigger_coeff * trigger_loss
+            else:
+                total_loss = entity_coeff * entity_loss
 
-        # In case the corpus don't have triggers
-        # total_loss = entity_loss
+            # In case the corpus don't have triggers
+            # total_loss = entity_loss
 
         _, all_preds_top_indices = torch.topk(all_preds, k=self.ner_label_limit, dim=-1)
 
         # Convert binary value to label ids
         all_preds = (all_preds > self.thresholds) * self.label_ids
-        all_golds = (actual_span_labels > 0) * self.label_ids
-
-        # Stupid trick
-        all_golds, _ = torch.sort(all_golds, dim=-1, descending=True)
-        all_golds = torch.narrow(all_golds, 1, 0, self.ner_label_limit)
 
         all_preds = torch.gather(all_preds, dim=1, index=all_preds_top_indices)
 
-        all_preds = all_preds.detach().cpu().numpy()
-        all_golds = all_golds.detach().cpu().numpy()
-
-        all_aligned_preds = []
-        trigger_indices = []
-        for idx, (preds, golds) in enumerate(zip(all_preds, all_golds)):
-            # check trigger in preds
-            for pred in preds:
-                if pred in self.params['mappings']['nn_mapping']['trTypes_Ids']:
-                    trigger_indices.append(idx)
-                    break
-            aligned_preds = []
-            pred_set = set(preds) - {0}
-            gold_set = set(golds) - {0}
-            shared = pred_set & gold_set
-            diff = pred_set - shared
-            for gold in golds:
-                if gold in shared:
-                    aligned_preds.append(gold)
-                else:
-                    aligned_preds.append(diff.pop() if diff else 0)
-            all_aligned_preds.append(aligned_preds)
-
-        all_aligned_preds = np.array(all_aligned_preds)
+        # spans with a trigger label
+        trigger_indices = self.trigger_label_mask[all_preds.long()].any(dim=-1).nonzero(as_tuple=False).flatten()
+
+        if inference:
+            all_golds = None
+        else:
+            all_golds = (actual_span_labels > 0) * self.label_ids
+
+            # Stupid trick
+            all_golds, _ = torch.sort(all_golds, dim=-1, descending=True)
+            all_golds = torch.narrow(all_golds, 1, 0, self.ner_label_limit)
+
+        all_aligned_preds = self.align_preds(all_preds, all_golds).detach().cpu().numpy()
+
+        if all_golds is not None:
+            all_golds = all_golds.detach().cpu().numpy()
 
         # For checking, will be commented if passes for all tests
         # assert (
-        #     np.sort(all_aligned_preds, axis=-1) == np.sort(all_preds, axis=-1)
+        #     np.sort(all_aligned_preds, axis=-1) == np.sort(all_preds.cpu().numpy(), axis=-1)
         # ).all()
 
         return (
@@ -369,5 +406,5 @@ class NestedNERModel(BertPreTrainedModel):
             all_span_masks,
             combined_embeddings,
             sentence_embedding,
-            trigger_indices
+            trigger_indices.tolist()
         )
@@ -3,7 +3,7 @@ import torch
 import torch.nn.functional as f
 from torch import nn
 
-from eval.evalRE import calc_stats
+from eval.evalRE import calc_stats, select_preds
 from utils.utils import gelu
 
 
@@ -37,41 +37,45 @@ class RELModel(nn.Module):
         self.params = params
         self.sizes = sizes
 
-    def _create_type_representation(self, bert_embeds, etypes_):
-        """Create entity type embeddings"""
-
-        # get dim
-        self.b, self.w, _ = bert_embeds.shape
-        self.e = etypes_.shape[1]
+    def _create_type_representation(self, etypes_, ent_rows, num_rows):
+        """Create entity type embeddings, one per row of the flat entity embeddings"""
 
         # non-entity
         etypes_[etypes_ == -1] = self.sizes['etype_size']
 
+        # type of each row, the zero row of the non-entities gets the padding type
+        row_types = etypes_.new_full((num_rows,), self.sizes['etype_size'])
+        row_types[ent_rows.flatten()] = etypes_.flatten()
+
         # type embeddings
-        etype_embeds = self.type_embed(etypes_)  # (batch_size, entity_dim, type_dim)
+        etype_embeds = self.type_embed(row_types)  # (entities + 1, type_dim)
 
         return etype_embeds
 
     def _create_pair_representation(self, etok_embeds, etype_embeds):
-        """Create entity pair embeddings: Represent a sentence as a matrix of shape(B, E, E, dim)"""
+        """Create entity embeddings for the pairs: one row per entity, see generate_entity_pairs_4rel"""
 
         # concat: entities token and type embeddings
-        pair_embeds = torch.cat((etok_embeds, etype_embeds), dim=2)
+        pair_embeds = torch.cat((etok_embeds, etype_embeds), dim=-1)
 
         # save for event layer
         type2_embeds = pair_embeds.clone()
 
         return pair_embeds, type2_embeds
 
-    def _generate_l2r_pairs(self, pair_embeds, s_embeds, indices, rgtruth):
+    def _generate_l2r_pairs(self, pair_embeds, ent_rows, s_embeds, indices, rgtruth):
         """Generate left-to-right pair candidates embeddings"""
 
         # pair embeddings
         l2r_embeds = torch.cat(
-            (pair_embeds[(indices[0], indices[1])], pair_embeds[(indices[0], indices[2])], s_embeds[indices[0]]),
+            (pair_embeds[ent_rows[(indices[0], indices[1])]], pair_embeds[ent_rows[(indices[0], indices[2])]],
+             s_embeds[indices[0]]),
             dim=-1)
 
-        # pair labels
+        # pair labels, none in inference
+        if rgtruth is None:
+            return l2r_embeds, None
+
         l2r_truth = []
         for b, l, r in zip(indices[0], indices[1], indices[2]):
             l2r_truth.append(rgtruth[b.item()].get((l.item(), r.item()), -1))
@@ -79,15 +83,19 @@ class RELModel(nn.Module):
 
         return l2r_embeds, l2r_truth
 
-    def _generate_r2l_pairs(self, pair_embeds, s_embeds, indices, rgtruth):
+    def _generate_r2l_pairs(self, pair_embeds, ent_rows, s_embeds, indices, rgtruth):
         """Generate right-to-left pair candidates embeddings"""
 
         # pair embeddings
         r2l_embeds = torch.cat(
-            (pair_embeds[(indices[0], indices[2])], pair_embeds[(indices[0], indices[1])], s_embeds[indices[0]]),
+            (pair_embeds[ent_rows[(indices[0], indices[2])]], pair_embeds[ent_rows[(indices[0], indices[1])]],
+             s_embeds[indices[0]]),
             dim=-1)
 
-        # pair labels
+        # pair labels, none in inference
+        if rgtruth is None:
+            return r2l_embeds, None
+
         r2l_truth = []
         for b, r, l in zip(indices[0], indices[2], indices[1]):
             r2l_truth.append(rgtruth[b.item()].get((r.item(), l.item()), -1))
@@ -109,7 +117,7 @@ class RELModel(nn.Module):
         g_indices = np.asarray([gids_b, gids_l, gids_r])
         return g_indices
 
-    def predict(self, pair_embeds, g_indices_, p_indices, rgtruth_, sent_embeds):
+    def predict(self, pair_embeds, ent_rows, g_indices_, p_indices, rgtruth_, sent_embeds, inference=False):
         """Classify relations."""
 
         # 1-dropout
@@ -118,7 +126,10 @@ class RELModel(nn.Module):
                 pair_embeds = f.dropout(pair_embeds, p=self.params['dropout'])
 
         # 2-transpose gold pairs indices
-        g_indices = self._transpose_gold_indices(g_indices_)
+        if inference:
+            g_indices = None
+        else:
+            g_indices = self._transpose_gold_indices(g_indices_)
 
         # 3-create left-to-right pairs
         # 3.1-training mode
@@ -158,9 +169,9 @@ class RELModel(nn.Module):
 
         # 3.3-get pair candidates embeddings and labels: from gold or predicted indices
         if use_gold:
-            l2r_embeds, l2r_truth = self._generate_l2r_pairs(pair_embeds, sent_embeds, g_indices, rgtruth_)
+            l2r_embeds, l2r_truth = self._generate_l2r_pairs(pair_embeds, ent_rows, sent_embeds, g_indices, rgtruth_)
         else:
-            l2r_embeds, l2r_truth = self._generate_l2r_pairs(pair_embeds, sent_embeds, p_indices, rgtruth_)
+            l2r_embeds, l2r_truth = self._generate_l2r_pairs(pair_embeds, ent_rows, sent_embeds, p_indices, rgtruth_)
 
         # 4-for non-relation label
         if not self.params['predict']:
@@ -219,9 +230,9 @@ class RELModel(nn.Module):
 
             # pair candidates embeddings and labels
             if use_gold:
-                r2l_embeds, r2l_truth = self._generate_r2l_pairs(pair_embeds, sent_embeds, g_indices, rgtruth_)
+                r2l_embeds, r2l_truth = self._generate_r2l_pairs(pair_embeds, ent_rows, sent_embeds, g_indices, rgtruth_)
             else:
-                r2l_embeds, r2l_truth = self._generate_r2l_pairs(pair_embeds, sent_embeds, p_indices, rgtruth_)
+                r2l_embeds, r2l_truth = self._generate_r2l_pairs(pair_embeds, ent_rows, sent_embeds, p_indices, rgtruth_)
 
             # non-relation type
             if not self.params['predict']:
@@ -249,18 +260,19 @@ class RELModel(nn.Module):
         else:
             return rel_l2r_embeds, l2r_preds, l2r_truth, pair_embeds, g_indices
 
-    def forward(self, batch_input):
+    def forward(self, batch_input, inference=False):
 
         # 1-entity type embeddings
-        type_embeds = self._create_type_representation(batch_input['embeddings'], batch_input['ent_types'])
+        ent_rows = batch_input['ent_rows']
+        type_embeds = self._create_type_representation(batch_input['ent_types'], ent_rows,
+                                                       batch_input['ent_embeds'].shape[0])
 
         # 2-create pair embeddings
         pair_embeds, type2_embeds = self._create_pair_representation(batch_input['ent_embeds'], type_embeds)
-        pair_embeds = pair_embeds.view(self.b, self.e, pair_embeds.shape[2])
 
         # 3-predictions and labels
-        predictions = self.predict(pair_embeds, batch_input['l2rs'], batch_input['pairs_idx'], batch_input['gtruths'],
-                                   batch_input['sentence_embeds'])
+        predictions = self.predict(pair_embeds, ent_rows, batch_input['l2rs'], batch_input['pairs_idx'],
+                                   batch_input['gtruths'], batch_input['sentence_embeds'], inference=inference)
 
         acc_loss = 0 # Fix in prediction
 
@@ -284,6 +296,9 @@ class RELModel(nn.Module):
             r_preds = (f.softmax(l2r_preds, dim=1).data, f.softmax(r2l_preds, dim=1).data)
             r_gtruth = (l2r_truth, r2l_truth)
 
+            # confidence of each pair, in the more confident direction
+            r_scores = torch.max(r_preds[0].max(dim=1)[0], r_preds[1].max(dim=1)[0])
+
         # use only left-to-right direction
         else:
 
@@ -298,13 +313,20 @@ class RELModel(nn.Module):
             # prediction and label
             r_preds = f.softmax(l2r_preds, dim=1).data
             r_gtruth = l2r_truth.data
+            r_scores = r_preds.max(dim=1)[0]
+
+        # get predicted type only
+        if inference:
+            return {'valid': True, 'preds': select_preds(r_preds, self.params), 'scores': r_scores,
+                    'enttoks_type_embeds': type2_embeds, 'ent_rows': ent_rows, 'truth': None, 'l2r': None, 'pairs_idx': batch_input['pairs_idx'], 'rel_embeds': rel_l2r_embeds,
+                    'pair4class': pair_embeds, 'loss': None}
 
         # get predicted type and scores
         new_rpreds, new_rgtruth, no_matched_rels, true_pos, false_pos, false_neg = calc_stats(r_preds, r_gtruth,
                                                                                               self.params)
 
         return {'valid': True, 'true_pos': true_pos, 'false_pos': false_pos, 'false_neg': false_neg,
-                'preds': new_rpreds, 'enttoks_type_embeds': type2_embeds,
+                'preds': new_rpreds, 'scores': r_scores, 'enttoks_type_embeds': type2_embeds, 'ent_rows': ent_rows,
                 'truth': new_rgtruth, 'no_matched_rel': no_matched_rels,
                 'l2r': g_indices, 'pairs_idx': batch_input['pairs_idx'], 'rel_embeds': rel_l2r_embeds,
                 'pair4class': pair_embeds, 'loss': acc_loss}
@@ -20,13 +20,17 @@ class DeepEM(nn.Module):
     Network architecture
     """
 
-    def __init__(self, params):
+    def __init__(self, params, pretrained=True):
         super(DeepEM, self).__init__()
 
         sizes = params['voc_sizes']
         device = params['device']
 
-        self.NER_layer = NestedNERModel.from_pretrained(params['bert_model'], params=params)
+        # the pretrained BERT weights are useless when a full checkpoint is restored afterwards
+        if pretrained:
+            self.NER_layer = NestedNERModel.from_pretrained(params['bert_model'], params=params)
+        else:
+            self.NER_layer = NestedNERModel.from_config(params['bert_model'], params=params)
         self.REL_layer = RELNet.RELModel(params, sizes)
         self.EV_layer = EVNet.EVModel(params, sizes)
 
@@ -41,14 +45,14 @@ class DeepEM(nn.Module):
         self.params = params
 
     def process_ner_output(self, nn_tokens, nn_ids, nn_token_mask, nn_attention_mask, nn_entity_masks, nn_trigger_masks,
-                           nn_span_labels, span_terms, max_span_labels, nn_span_indices):
+                           nn_span_labels, span_terms, max_span_labels, nn_span_indices, inference=False):
         """Process NER output to prepare for training relation and event layers"""
 
         # entity output
         ner_preds = {}
 
         # predict entity
-        ner_loss, e_preds, e_golds, sentence_sections, span_masks, embeddings, sentence_emb, trigger_indices = self.NER_layer(
+        ner_loss, e_preds, e_golds, sentence_sections, span_masks, span_embeddings, sentence_emb, trigger_indices = self.NER_layer(
             all_tokens=nn_tokens,
             all_ids=nn_ids,
             all_token_masks=nn_token_mask,
@@ -56,33 +60,35 @@ class DeepEM(nn.Module):
             all_entity_masks=nn_entity_masks,
             all_trigger_masks=nn_trigger_masks,
             all_span_labels=nn_span_labels,
+            inference=inference,
         )
 
         # ! Note that these below lines run on CPU
         sentence_sections = sentence_sections.detach().cpu().numpy()[:-1]
         all_span_masks = span_masks.detach() > 0
 
-        # Embedding of each span
-        embeddings = torch.split(embeddings, torch.sum(all_span_masks, dim=-1).tolist())
-
         # Pred of each span
         e_preds = np.split(e_preds.astype(int), sentence_sections)
         e_preds = [pred.flatten() for pred in e_preds]
         ner_preds['preds'] = e_preds
 
-        e_golds = np.split(e_golds.astype(int), sentence_sections)
-        e_golds = [gold.flatten() for gold in e_golds]
-        ner_preds['golds'] = e_golds
-        ner_preds['gold_terms'] = copy.deepcopy(span_terms)
+        # no gold entities in inference
+        if not inference:
+            e_golds = np.split(e_golds.astype(int), sentence_sections)
+            e_golds = [gold.flatten() for gold in e_golds]
+            ner_preds['golds'] = e_golds
+            ner_preds['gold_terms'] = copy.deepcopy(span_terms)
 
         replace_term = True
         if self.params['predict']:
-            if self.params['gold_eval'] or (self.params['pipelines'] and self.params['pipe_flag'] != 0):
+            if self.params['gold_eval'] or (self.params['pipelines'] and self.params['pipe_flag'] != 0) \
+                    or self.params.get('gold_entities', False):
                 replace_term = False
 
         if self.params["ner_predict_all"]:
             if self.params['predict']:
-                if self.params['gold_eval'] or (self.params['pipelines'] and self.params['pipe_flag'] != 0):
+                if self.params['gold_eval'] or (self.params['pipelines'] and self.params['pipe_flag'] != 0) \
+                        or self.params.get('gold_entities', False):
                     e_preds = e_golds
                     span_terms = ner_preds['gold_terms']
             else:
@@ -102,17 +108,16 @@ class DeepEM(nn.Module):
 
                 trigger_idx = self.trigger_id + 1
                 for sentence_idx, span_preds in enumerate(e_preds):
-                    for pred_idx, label_id in enumerate(span_preds):
-                        if label_id > 0:
-                            term = "T" + str(trigger_idx)
+                    for pred_idx in np.flatnonzero(span_preds > 0).tolist():
+                        term = "T" + str(trigger_idx)
 
-                            # check trigger
-                            if label_id in self.params['mappings']['nn_mapping']['trTypes_Ids']:
-                                term = "TR" + str(trigger_idx)
+                        # check trigger
+                        if span_preds[pred_idx] in self.params['mappings']['nn_mapping']['trTypes_Ids']:
+                            term = "TR" + str(trigger_idx)
 
-                            span_terms[sentence_idx].id2term[pred_idx] = term
-                            span_terms[sentence_idx].term2id[term] = pred_idx
-                            trigger_idx += 1
+                        span_terms[sentence_idx].id2term[pred_idx] = term
+                        span_terms[sentence_idx].term2id[term] = pred_idx
+                        trigger_idx += 1
 
                 self.trigger_id = trigger_idx
         else:
@@ -128,7 +133,8 @@ class DeepEM(nn.Module):
                     # store gold entity index (a1)
                     a1ent_set = set()
 
-                    for span_idx, span_term in span_terms[sentence_idx].id2term.items():
+                    # no a1 entity in inference
+                    for span_idx, span_term in ([] if inference else span_terms[sentence_idx].id2term.items()):
 
                         if span_term != "O" and not span_term.startswith("TR") and span_preds[span_idx] != 255:
 
@@ -142,44 +148,44 @@ class DeepEM(nn.Module):
                                 # save this index to ignore prediction
                                 a1ent_set.add(span_idx)
 
-                    for pred_idx, label_id in enumerate(span_preds):
-                        span_term = span_terms[sentence_idx].id2term.get(pred_idx, "O")
+                    # null prediction: remove the terms of the spans without label
+                    for pred_idx, span_term in list(span_terms[sentence_idx].id2term.items()):
+                        if pred_idx not in a1ent_set and span_preds[pred_idx] <= 0 and span_term.startswith("T"):
+                            del span_terms[sentence_idx].id2term[pred_idx]
+                            del span_terms[sentence_idx].term2id[span_term]
+
+                    # add prediction for trigger or entity a2, only the spans with a label
+                    for pred_idx in np.flatnonzero(span_preds > 0).tolist():
+                        label_id = span_preds[pred_idx]
 
                         # if this entity in a1: skip this span
                         if pred_idx in a1ent_set:
                             continue
 
-                        remove_span = False
+                        term = ''
 
-                        # add prediction for trigger or entity a2
-                        if label_id > 0:
-                            term = ''
+                        # check trigger
+                        if label_id in self.params['mappings']['nn_mapping']['trTypes_Ids']:
+                            term = "TR" + str(trigger_idx)
 
-                            # check trigger
-                            if label_id in self.params['mappings']['nn_mapping']['trTypes_Ids']:
-                                term = "TR" + str(trigger_idx)
+                        # is entity
+                        else:
+                            etype_label = self.params['mappings']['nn_mapping']['id_tag_mapping'][label_id]
 
-                            # is entity
-                            else:
-                                etype_label = self.params['mappings']['nn_mapping']['id_tag_mapping'][label_id]
+                            # check this entity type in a2 or not
+                            if etype_label in self.params['a2_entities']:
+                                term = "T" + str(trigger_idx)
 
-                                # check this entity type in a2 or not
-                                if etype_label in self.params['a2_entities']:
-                                    term = "T" + str(trigger_idx)
-                                else:
-                                    remove_span = True
-
-                            if len(term) > 0:
-                                span_terms[sentence_idx].id2term[pred_idx] = term
-                                span_terms[sentence_idx].term2id[term] = pred_idx
-                                trigger_idx += 1
+                        if len(term) > 0:
+                            span_terms[sentence_idx].id2term[pred_idx] = term
+                            span_terms[sentence_idx].term2id[term] = pred_idx
+                            trigger_idx += 1
 
-                        # null prediction
-                        if label_id == 0 or remove_span:
-                            # do not write anything
+                        # not an a2 entity: do not write anything and remove this span
+                        else:
+                            span_term = span_terms[sentence_idx].id2term.get(pred_idx, "O")
                             span_preds[pred_idx] = 0
 
-                            # remove this span
                             if span_term.startswith("T"):
                                 del span_terms[sentence_idx].id2term[pred_idx]
                                 del span_terms[sentence_idx].term2id[span_term]
@@ -189,20 +195,15 @@ class DeepEM(nn.Module):
 
         num_padding = max_span_labels * self.params["ner_label_limit"]
 
-        e_preds = [np.pad(pred, (0, num_padding - pred.shape[0]),
-                          'constant', constant_values=-1) for pred in e_preds]
-        e_golds = [np.pad(gold, (0, num_padding - gold.shape[0]),
-                          'constant', constant_values=-1) for gold in e_golds]
+        e_preds = torch.tensor(utils.pad_rows(e_preds, num_padding, -1), device=self.device)
 
-        e_preds = torch.tensor(e_preds, device=self.device)
-        nn_span_labels = torch.tensor(e_golds, device=self.device)
+        if not inference:
+            nn_span_labels = torch.tensor(utils.pad_rows(e_golds, num_padding, -1), device=self.device)
 
-        embeddings = [f.pad(embedding, (0, 0, 0, max_span_labels - embedding.shape[0]),
-                            'constant', value=0) for embedding in embeddings]
-
-        embeddings = torch.stack(embeddings)
-        embeddings = embeddings.unsqueeze(dim=2).expand(-1, -1, self.params["ner_label_limit"], -1)
-        embeddings = embeddings.reshape(embeddings.size(0), -1, embeddings.size(-1))
+        # the span embeddings stay flat: the entity (batch id, entity id) is the span row
+        # span_offsets[batch id] + entity id // ner_label_limit, see generate_entity_pairs_4rel
+        span_counts = all_span_masks.sum(dim=-1)
+        span_offsets = torch.cumsum(span_counts, dim=0) - span_counts
 
         # output for ner
         ner_preds['loss'] = ner_loss
@@ -212,17 +213,22 @@ class DeepEM(nn.Module):
         # For pre-train event layer
         use_gold = False
         if (not self.params['predict'] and self.params['skip_ner'] and self.params['skip_rel'] and self.params[
-            'use_gold_ner'] and self.params['use_gold_rel']) or (self.params['gold_eval'] or self.params['pipelines']):
+            'use_gold_ner'] and self.params['use_gold_rel']) or (self.params['gold_eval'] or self.params['pipelines']) \
+                or (self.params['predict'] and self.params.get('gold_entities', False)):
             use_gold = True
         if use_gold:
             ner_preds['nner_preds'] = e_golds
         else:
             ner_preds['nner_preds'] = e_preds.detach().cpu().numpy()
 
-        return embeddings, e_preds, e_golds, nn_span_labels, sentence_emb, ner_preds
+        return span_embeddings, span_offsets, e_preds, e_golds, nn_span_labels, sentence_emb, ner_preds
+
+    def generate_entity_pairs_4rel(self, span_embeddings, span_offsets, p_span_indices, g_span_indices):
+        """Prepare entity pairs for relation candidates.
 
-    def generate_entity_pairs_4rel(self, bert_embeds, p_span_indices, g_span_indices):
-        """Prepare entity pairs for relation candidates"""
+        The entity embeddings are returned flat, one row per positive entity and a last zero row, with the
+        row of each (batch id, entity id): the zero row for the other entities.
+        """
 
         # use gold or predicted span indices
         # training mode
@@ -240,9 +246,9 @@ class DeepEM(nn.Module):
             else:
                 use_gold = False
 
-        # predict mode
+        # predict mode, gold_entities: the entities are given, the relations and events are predicted
         else:
-            if self.params['gold_eval'] or self.params['pipelines']:
+            if self.params['gold_eval'] or self.params['pipelines'] or self.params.get('gold_entities', False):
                 use_gold = True
             else:
                 use_gold = False
@@ -259,8 +265,7 @@ class DeepEM(nn.Module):
         e_types = torch.full((span_indices.shape[0], span_indices.shape[1]), -1, dtype=torch.int64,
                              device=self.device)
 
-        # entity and trigger indices
-        e_indices = torch.zeros((span_indices.shape[0], span_indices.shape[1]), dtype=torch.long)
+        # trigger indices
         tr_indices = torch.zeros((span_indices.shape), dtype=torch.int64, device=self.device)
 
         # store entity indices in batch and list of triggers
@@ -279,9 +284,6 @@ class DeepEM(nn.Module):
             type_a1 = self.params['mappings']['nn_mapping']['tag2type_map'][span_indices[a1id][a2id].item()]
             e_types[a1id][a2id] = torch.tensor(type_a1, device=self.device)
 
-            # masked
-            e_indices[a1id][a2id] = 1
-
             # trigger
             if type_a1 in self.params['trTypes_Ids']:
                 tr_indices[a1id][a2id] = 1
@@ -293,11 +295,13 @@ class DeepEM(nn.Module):
 
             batch_eids_list[a1id.item()].append(a2id)
 
-        # prepare for entity and trigger embeddings
-        e_embeds = bert_embeds.clone()
-        tr_embeds = bert_embeds.clone()
-        e_embeds[e_indices == 0] = torch.zeros((bert_embeds.shape[2]), dtype=bert_embeds.dtype, device=self.device)
-        tr_embeds[tr_indices == 0] = torch.zeros((bert_embeds.shape[2]), dtype=bert_embeds.dtype, device=self.device)
+        # prepare for entity embeddings: the span embeddings of the positive entities only
+        num_entities = pos_indices.shape[1]
+        ent_rows = torch.full(span_indices.shape, num_entities, dtype=torch.long, device=self.device)
+        ent_rows[pos_indices[0], pos_indices[1]] = torch.arange(num_entities, device=self.device)
+
+        e_embeds = span_embeddings[span_offsets[pos_indices[0]] + pos_indices[1] // self.params['ner_label_limit']]
+        e_embeds = torch.cat((e_embeds, e_embeds.new_zeros((1, e_embeds.shape[1]))), dim=0)
 
         # indices of pairs (trigger-entity OR trigger-trigger) for relation candidates
         pair_indices = []
@@ -332,7 +336,7 @@ class DeepEM(nn.Module):
             if len(pair_indices) > 0:
                 pair_indices = torch.cat(pair_indices, dim=-1)
 
-        return e_embeds, tr_embeds, e_types, tr_indices, pair_indices
+        return e_embeds, ent_rows, e_types, tr_indices, pair_indices
 
     def _init_joint(self, n_epoch):
         """Flags to enable using the predicted from the previous output or not"""
@@ -420,16 +424,20 @@ class DeepEM(nn.Module):
 
         return acc_loss
 
-    def forward(self, batch_input, n_epoch=0):
+    def forward(self, batch_input, n_epoch=0, inference=False):
 
-        """Joint model interface."""
+        """Joint model interface.
+
+        With inference=True (raw text, see utils.is_inference), the gold entries of batch_input are None:
+        no gold label is aligned, no truth structure is built and no loss is computed.
+        """
 
         # 1 - get input
         nn_tokens, nn_ids, nn_token_mask, nn_attention_mask, nn_span_indices, nn_span_labels, nn_span_labels_match_rel, nn_entity_masks, nn_trigger_masks, nn_gtruth, nn_l2r, span_terms, \
         nn_truth_ev, nn_ev_idxs, ev_lbls, etypes, max_span_labels = batch_input
 
         # 2 - predict entity and process output
-        embeddings, e_preds, e_golds, nn_span_labels, sentence_emb, ner_preds = self.process_ner_output(
+        span_embeddings, span_offsets, e_preds, e_golds, nn_span_labels, sentence_emb, ner_preds = self.process_ner_output(
             nn_tokens, nn_ids,
             nn_token_mask,
             nn_attention_mask,
@@ -438,7 +446,8 @@ class DeepEM(nn.Module):
             nn_span_labels,
             span_terms,
             max_span_labels,
-            nn_span_indices
+            nn_span_indices,
+            inference=inference
         )
 
         # 3 - initialize joint training
@@ -448,16 +457,19 @@ class DeepEM(nn.Module):
         if enable_rel or enable_ev:
 
             # 4.1 - prepare input for joint model
-            e_embeds, tr_embeds, e_types, tr_ids, pair_indices = self.generate_entity_pairs_4rel(bert_embeds=embeddings,
-                                                                                                 p_span_indices=e_preds,
-                                                                                                 g_span_indices=nn_span_labels)
+            e_embeds, ent_rows, e_types, tr_ids, pair_indices = self.generate_entity_pairs_4rel(
+                span_embeddings=span_embeddings,
+                span_offsets=span_offsets,
+                p_span_indices=e_preds,
+                g_span_indices=nn_span_labels)
 
             # check non-empty
             if len(pair_indices) > 0:
 
-                joint_input = {'preds': e_preds, 'golds': e_golds, 'embeddings': embeddings,
-                               'ent_embeds': e_embeds, 'tr_embeds': tr_embeds, 'tr_ids': tr_ids,
-                               'ent_types': e_types, 'pairs_idx': pair_indices, 'e_types': etypes.long(),
+                joint_input = {'preds': e_preds, 'golds': e_golds,
+                               'ent_embeds': e_embeds, 'ent_rows': ent_rows, 'tr_ids': tr_ids,
+                               'ent_types': e_types, 'pairs_idx': pair_indices,
+                               'e_types': None if inference else etypes.long(),
                                'l2rs': nn_l2r,
                                'gtruths': nn_gtruth, 'truth_evs': nn_truth_ev, 'ev_idxs': nn_ev_idxs,
                                'ev_lbls': ev_lbls,
@@ -465,20 +477,24 @@ class DeepEM(nn.Module):
 
                 # 4.2 - training relation layer
                 if enable_rel:
-                    rel_preds = self.REL_layer(joint_input)
+                    rel_preds = self.REL_layer(joint_input, inference=inference)
 
                 # 4.4 - training event layer
                 if enable_ev:
 
-                    # get relation output
-                    rel_preds = self.REL_layer(joint_input)
+                    # get relation output, the relation layer is deterministic in inference
+                    if not (inference and rel_preds is not None):
+                        rel_preds = self.REL_layer(joint_input, inference=inference)
 
                     # check non-empty relation
                     if rel_preds['valid']:
                         # call event layer
-                        ev_preds = self.EV_layer(joint_input, rel_preds, n_epoch)
+                        ev_preds = self.EV_layer(joint_input, rel_preds, n_epoch, inference=inference)
 
         # joint model loss
-        acc_loss = self._accumulate_loss(ner_preds, rel_preds, ev_preds, n_epoch)
+        if inference:
+            acc_loss = None
+        else:
+            acc_loss = self._accumulate_loss(ner_preds, rel_preds, ev_preds, n_epoch)
 
         return ner_preds, rel_preds, ev_preds, acc_loss
@@ -9,9 +9,9 @@ from torch.utils.data import DataLoader, SequentialSampler, TensorDataset
 
 from eval.evaluation import eval
 from loader.prepData import prepdata
-from loader.prepNN import prep4nn
+from loader.prepNN import prep4nn, sampler
 from model import deepEM
-from utils import utils
+from utils import flat_tensors, precision, utils
 
 
 def main():
@@ -55,20 +55,50 @@ def load_parameters(config_path):
 
 
 def load_model(parameters):
-    deepee_model = deepEM.DeepEM(parameters)
+    # The precision modes quantize or autocast the linear layers of BERT, an LSTM encoder has none
+    inference_precision = parameters.get("inference_precision") or precision.FLOAT32
+
+    if parameters["use_lstm"] and inference_precision != precision.FLOAT32:
+        raise ValueError(
+            "inference_precision {} is only supported by the BERT encoder, not with use_lstm".format(
+                inference_precision
+            )
+        )
+
+    # Serving format written by convert_checkpoints.py, memory-mapped instead of unpickled
+    flat_model_file = parameters.get("joint_model_flat")
+
+    if flat_model_file and not os.path.isfile(flat_model_file):
+        raise FileNotFoundError("No flat model file {}".format(flat_model_file))
+
+    # Build the architecture from the BERT config only, all weights come from the checkpoint
+    deepee_model = deepEM.DeepEM(parameters, pretrained=False)
 
     model_path = parameters["joint_model_dir"]
     device = parameters["device"]
 
-    utils.handle_checkpoints(
-        model=deepee_model,
-        checkpoint_dir=model_path,
-        params={"device": device},
-        resume=True,
-    )
+    if flat_model_file:
+        state_dict, _ = flat_tensors.load_flat_tensors(flat_model_file)
+        flat_tensors.assign_flat_tensors(deepee_model, state_dict, device=device)
+    else:
+        restored_params = utils.handle_checkpoints(
+            model=deepee_model,
+            checkpoint_dir=model_path,
+            params={"device": device},
+            resume=True,
+        )
+
+        if restored_params is None:
+            raise FileNotFoundError("No checkpoint found in {}".format(model_path))
 
     deepee_model.to(device)
 
+    # Optional int8/bfloat16 mode for the BERT encoder, the REL/EV layers stay in float32
+    if not parameters["use_lstm"]:
+        precision.apply_precision(
+            deepee_model.NER_layer.bert, inference_precision, device=device
+        )
+
     return deepee_model
 
 
@@ -117,10 +147,22 @@ def read_test_data(test_data, params):
     te_data_size = len(test_data["nn_data"]["ids"])
 
     test_data_ids = TensorDataset(torch.arange(te_data_size))
-    test_sampler = SequentialSampler(test_data_ids)
-    test_dataloader = DataLoader(
-        test_data_ids, sampler=test_sampler, batch_size=params["batchsize"]
-    )
+
+    # Group sentences of similar lengths under a padded token budget, eval restores the order
+    if params.get("batch_token_budget"):
+        lengths, span_counts = sampler.get_sentence_lengths(test_data["nn_data"])
+        test_batch_sampler = sampler.BucketBatchSampler(
+            lengths,
+            span_counts,
+            token_budget=params["batch_token_budget"],
+            max_batch_size=params.get("max_batchsize"),
+        )
+        test_dataloader = DataLoader(test_data_ids, batch_sampler=test_batch_sampler)
+    else:
+        test_sampler = SequentialSampler(test_data_ids)
+        test_dataloader = DataLoader(
+            test_data_ids, sampler=test_sampler, batch_size=params["batchsize"]
+        )
     return test_data, test_dataloader
 
 
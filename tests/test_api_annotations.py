@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Annotations of the API responses built from the compact columnar annotations of the model server."""
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import api_for_openplatform
+from utils.api_annotations import Event, EventArgument, LinkedEntity, Modality, Relation, Span, build_annotations
+
+TEXT = "IL-2 activates NF-kB."
+
+COMPACT_ANNOTATIONS = {
+    "entities": {"ids": ["T1", "T2", "TR1"], "types": ["Protein", "Protein", "Positive_regulation"],
+                 "starts": [0, 15, 5], "ends": [4, 20, 14]},
+    "normalizations": {"targets": ["T2"], "refids": ["C0079904"], "names": ["NF-kappa B"]},
+    "relations": {"ids": ["R1"], "types": ["Binding"], "left_arg_ids": ["T1"], "right_arg_ids": ["T2"]},
+    "events": {"ids": ["E1"], "trigger_ids": ["TR1"], "arg_offsets": [0, 2], "arg_roles": ["Theme", "Cause"],
+               "arg_ids": ["T2", "T1"]},
+    "attributes": {"ids": ["A1"], "types": ["Speculation"], "targets": ["E1"]},
+    "tokens": {"starts": [0, 5, 15, 20], "ends": [4, 14, 20, 21]},
+    "sentences": {"starts": [0], "ends": [21]},
+}
+
+
+def test_build_annotations():
+    assert build_annotations(TEXT, COMPACT_ANNOTATIONS) == {
+        "text": TEXT,
+        "entities": [
+            LinkedEntity("T1", "Protein", Span(0, 4), "IL-2"),
+            LinkedEntity("T2", "Protein", Span(15, 20), "NF-kB", "C0079904", "NF-kappa B"),
+            LinkedEntity("TR1", "Positive_regulation", Span(5, 14), "activates"),
+        ],
+        "relations": [Relation("R1", "Binding", "T1", "T2")],
+        "events": [Event("E1", "TR1", [EventArgument("Theme", "T2"), EventArgument("Cause", "T1")],
+                         [Modality("A1", "Speculation")])],
+        "token_boundaries": [Span(0, 4), Span(5, 14), Span(15, 20), Span(20, 21)],
+        "sentence_boundaries": [Span(0, 21)],
+    }
+
+
+class StubUpstream:
+    async def get(self, path):
+        return {"version": None}
+
+    async def post(self, path, **request):
+        assert request["data"]["text"] == TEXT
+        return COMPACT_ANNOTATIONS
+
+
+def test_open_platform_entities(monkeypatch):
+    monkeypatch.setattr(api_for_openplatform, "upstream", StubUpstream())
+
+    client = TestClient(api_for_openplatform.app)
+    prefix = api_for_openplatform.URL_PREFIX
+
+    response = client.post(f"{prefix}/entity_linking", params={"email": "user@example.com"}, json={"text": TEXT})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "text": TEXT,
+        "token_boundaries": [{"start": 0, "end": 4}, {"start": 5, "end": 14}, {"start": 15, "end": 20},
+                             {"start": 20, "end": 21}],
+        "sentence_boundaries": [{"start": 0, "end": 21}],
+        "entities": [
+            {"id": "T1", "type": "Protein", "span": {"start": 0, "end": 4}, "text": "IL-2",
+             "concept_id": None, "concept_name": None},
+            {"id": "T2", "type": "Protein", "span": {"start": 15, "end": 20}, "text": "NF-kB",
+             "concept_id": "C0079904", "concept_name": "NF-kappa B"},
+            {"id": "TR1", "type": "Positive_regulation", "span": {"start": 5, "end": 14}, "text": "activates",
+             "concept_id": None, "concept_name": None},
+        ],
+    }
+
+
+def columnar_to_objects(result):
+    """The object response of a columnar one."""
+    def spans(columns):
+        return [{"start": start, "end": end} for start, end in zip(columns["starts"], columns["ends"])]
+
+    objects = {
+        "text": result["text"],
+        "token_boundaries": spans(result["token_boundaries"]),
+        "sentence_boundaries": spans(result["sentence_boundaries"]),
+    }
+
+    entities = result["entities"]
+    objects["entities"] = [
+        dict(zip(("id", "type", "span", "text"), entity))
+        for entity in zip(entities["ids"], entities["types"], spans(entities), entities["texts"])
+    ]
+
+    if "concept_ids" in entities:
+        for entity, concept_id, concept_name in zip(
+            objects["entities"], entities["concept_ids"], entities["concept_names"]
+        ):
+            entity.update(concept_id=concept_id, concept_name=concept_name)
+
+    if "relations" in result:
+        relations = result["relations"]
+        objects["relations"] = [
+            dict(zip(("id", "type", "left_arg_id", "right_arg_id"), relation))
+            for relation in zip(
+                relations["ids"], relations["types"], relations["left_arg_ids"], relations["right_arg_ids"]
+            )
+        ]
+
+    if "events" in result:
+        events = result["events"]
+        arg_offsets = events["arg_offsets"]
+        modality_offsets = events["modality_offsets"]
+
+        objects["events"] = [
+            {
+                "id": event_id,
+                "trigger_id": trigger_id,
+                "args": [
+                    {"arg_role": arg_role, "arg_id": arg_id}
+                    for arg_role, arg_id in zip(
+                        events["arg_roles"][arg_offsets[xx]:arg_offsets[xx + 1]],
+                        events["arg_ids"][arg_offsets[xx]:arg_offsets[xx + 1]],
+                    )
+                ],
+                "modalities": [
+                    {"id": modality_id, "type": modality_type}
+                    for modality_id, modality_type in zip(
+                        events["modality_ids"][modality_offsets[xx]:modality_offsets[xx + 1]],
+                        events["modality_types"][modality_offsets[xx]:modality_offsets[xx + 1]],
+                    )
+                ],
+            }
+            for xx, (event_id, trigger_id) in enumerate(zip(events["ids"], events["trigger_ids"]))
+        ]
+
+    return objects
+
+
+@pytest.mark.parametrize("task", ["named_entity_recognition", "relation_extraction", "event_extraction",
+                                  "entity_linking"])
+def test_columnar_responses_hold_the_object_annotations(monkeypatch, task):
+    monkeypatch.setattr(api, "upstream", StubUpstream())
+
+    client = TestClient(api.app)
+
+    responses = {}
+    for response_format in ("objects", "columnar"):
+        response = client.post(f"{api.URL_PREFIX}/{task}",
+                               params={"email": "user@example.com", "format": response_format},
+                               headers={"Cache-Control": "no-store"}, json={"text": TEXT})
+
+        assert response.status_code == 200
+        responses[response_format] = response.json()
+
+    assert columnar_to_objects(responses["columnar"]) == responses["objects"]
+    assert len(responses["objects"]["entities"]) == 3
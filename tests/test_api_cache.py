@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Response cache of the API gateway around the model server calls."""
+import asyncio
+
+import httpx
+
+import api
+from utils.response_cache import ResponseCache
+
+
+class StubUpstream:
+    def __init__(self, version):
+        self.version = version
+        self.posts = 0
+
+    async def get(self, path):
+        if self.version is None:
+            raise httpx.ConnectError("down")
+        return {"version": self.version}
+
+    async def post(self, path, **request):
+        self.posts += 1
+        return {"text": request["data"]["text"]}
+
+
+def annotate_twice(monkeypatch, version):
+    upstream = StubUpstream(version)
+    cache = ResponseCache(ttl=60, max_entries=10)
+
+    monkeypatch.setattr(api, "upstream", upstream)
+    monkeypatch.setattr(api, "response_cache", cache)
+    monkeypatch.setattr(api, "model_versions", {})
+
+    async def scenario():
+        for _ in range(2):
+            assert await api.fetch_annotations("named_entity_recognition", "text") == {"text": "text"}
+
+    asyncio.new_event_loop().run_until_complete(scenario())
+
+    return upstream, cache
+
+
+def test_responses_cached_by_model_version(monkeypatch):
+    upstream, cache = annotate_twice(monkeypatch, "v1")
+
+    assert upstream.posts == 1
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_cache_skipped_when_the_model_version_is_unknown(monkeypatch):
+    upstream, cache = annotate_twice(monkeypatch, None)
+
+    assert upstream.posts == 2
+    assert cache.memory == {}
+    assert cache.stats()["bypassed"] == 2
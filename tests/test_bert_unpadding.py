@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Unpadded execution of the BERT encoder (BertModel(..., unpad=True)) against the padded one."""
+import torch
+
+from bert.modeling import BertConfig, BertModel, UnpaddedBatch
+
+LENGTHS = [5, 2, 5, 3, 1]
+
+
+def padded_batch(sequence_length=7):
+    input_ids = torch.zeros((len(LENGTHS), sequence_length), dtype=torch.long)
+    attention_mask = torch.zeros((len(LENGTHS), sequence_length), dtype=torch.long)
+
+    for xx, length in enumerate(LENGTHS):
+        input_ids[xx, :length] = torch.randint(1, 30, (length,))
+        attention_mask[xx, :length] = 1
+
+    return input_ids, attention_mask
+
+
+def test_unpad_and_pad_back():
+    _, attention_mask = padded_batch()
+    unpadded_batch = UnpaddedBatch(attention_mask)
+
+    x = torch.randn(*attention_mask.shape, 4) * attention_mask.unsqueeze(-1)
+    flat = unpadded_batch.unpad(x)
+
+    assert flat.shape == (sum(LENGTHS), 4)
+    assert torch.equal(unpadded_batch.pad(flat), x)
+
+    # one group of sequences per length, the positions of their tokens in the flat layout
+    assert sorted(group.size(1) for group in unpadded_batch.groups) == [1, 2, 3, 5]
+    assert sorted(torch.cat([group.flatten() for group in unpadded_batch.groups]).tolist()) == list(range(sum(LENGTHS)))
+
+
+def test_same_hidden_states_on_the_real_tokens():
+    torch.manual_seed(0)
+    config = BertConfig(30, hidden_size=16, num_hidden_layers=2, num_attention_heads=4, intermediate_size=32)
+    model = BertModel(config).eval()
+
+    input_ids, attention_mask = padded_batch()
+    real_tokens = attention_mask.bool()
+
+    with torch.no_grad():
+        padded_layers, padded_pooled = model(input_ids, attention_mask=attention_mask, unpad=False)
+        unpadded_layers, unpadded_pooled = model(input_ids, attention_mask=attention_mask, unpad=True)
+
+    assert len(unpadded_layers) == len(padded_layers) == 2
+
+    for padded, unpadded in zip(padded_layers, unpadded_layers):
+        assert torch.allclose(unpadded[real_tokens], padded[real_tokens], atol=1e-5)
+        assert not unpadded[~real_tokens].any()
+
+    assert torch.allclose(unpadded_pooled, padded_pooled, atol=1e-5)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Cache of the BERT encodings (EncoderCache): accounting under concurrency, same encodings as the encoder."""
+import threading
+
+import torch
+
+from bert.modeling import BertConfig, BertModel
+from utils.encoder_cache import EncoderCache, model_fingerprint
+
+
+def test_concurrent_puts_and_gets_keep_the_accounting():
+    entry_bytes = 4 * 8 * 4 + 8 * 4
+    cache = EncoderCache(max_bytes=16 * entry_bytes)
+
+    def worker(seed):
+        for step in range(500):
+            key = ("fingerprint", (seed * 7 + step) % 40)
+
+            if cache.get(key) is None:
+                cache.put(key, torch.zeros(4, 8), torch.zeros(8))
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+
+    assert stats["hits"] + stats["misses"] == 8 * 500
+    assert stats["bytes"] == sum(cache._size(entry) for entry in cache.entries.values())
+    assert stats["bytes"] <= cache.max_bytes
+    assert len(cache) == 16
+
+
+def padded_batch(sentences, sequence_length=8):
+    input_ids = torch.zeros((len(sentences), sequence_length), dtype=torch.long)
+    attention_mask = torch.zeros((len(sentences), sequence_length), dtype=torch.long)
+
+    for xx, ids in enumerate(sentences):
+        input_ids[xx, :len(ids)] = torch.tensor(ids)
+        attention_mask[xx, :len(ids)] = 1
+
+    return input_ids, attention_mask
+
+
+def test_cached_encodings_are_the_encoder_outputs():
+    torch.manual_seed(0)
+    model = BertModel(BertConfig(30, hidden_size=16, num_hidden_layers=2, num_attention_heads=4,
+                                 intermediate_size=32)).eval()
+
+    encoded_batches = []
+
+    def encode(input_ids, attention_mask):
+        encoded_batches.append(input_ids.tolist())
+        return model(input_ids, attention_mask=attention_mask, output_all_encoded_layers=False)
+
+    cache = EncoderCache(max_bytes=2 ** 20)
+    fingerprint = model_fingerprint(model)
+
+    batches = [
+        [[1, 2, 3], [4, 5, 6, 7, 8], [9, 10]],
+        # the same sentences in other batches, with new ones
+        [[4, 5, 6, 7, 8], [11, 12, 13, 14, 15, 16], [1, 2, 3]],
+        [[9, 10], [1, 2, 3]],
+    ]
+
+    for sentences in batches:
+        input_ids, attention_mask = padded_batch(sentences)
+
+        with torch.no_grad():
+            hidden_states, pooled_outputs = cache.encode(fingerprint, input_ids, attention_mask, encode,
+                                                         dtype=torch.float32)
+            expected_states, expected_pooled = model(input_ids, attention_mask=attention_mask,
+                                                     output_all_encoded_layers=False)
+
+        real_tokens = attention_mask.bool()
+        assert torch.allclose(hidden_states[real_tokens], expected_states[real_tokens], atol=1e-5)
+        assert not hidden_states[~real_tokens].any()
+        assert torch.allclose(pooled_outputs, expected_pooled, atol=1e-5)
+
+    # the encoder only ran on the misses, cut to their longest sentence
+    assert encoded_batches == [
+        [[1, 2, 3, 0, 0], [4, 5, 6, 7, 8], [9, 10, 0, 0, 0]],
+        [[11, 12, 13, 14, 15, 16]],
+    ]
+    assert cache.stats()["hits"] == 4
+    assert cache.stats()["misses"] == 4
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Pruned event candidates of EV_Generator against the exhaustive enumeration of the original nested loops."""
+import collections
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from model.EVGen import EV_Generator
+
+# (relation type, argument type) pairs, few of them so that the argument lists repeat pairs
+PAIRS = [(rtype, etype) for rtype in range(2) for etype in range(1, 3)]
+
+TRID = (0, 0)
+MOD_LABELS = [-1]
+CURRENT_LEVEL = 1
+
+
+def random_structs(rng):
+    """Structure lists of a trigger type: -1 or a list of argument Counters for 1 .. 4 arguments."""
+    ev_structs = [-1] * 5
+
+    for n_args in range(1, 5):
+        if rng.random() < 0.2:
+            continue
+
+        structs = {tuple(sorted(rng.choice(PAIRS) for _ in range(n_args))) for _ in range(rng.randint(1, 4))}
+        ev_structs[n_args] = [collections.Counter(struct) for struct in sorted(structs)]
+
+    return ev_structs
+
+
+def random_nest_rels_group(rng, typeid, args_list):
+    """Arguments of a nested trigger: events predicted for the trigger arguments by level, or an entity."""
+    rels_group = []
+
+    for xx, pair in enumerate(args_list):
+        if rng.random() < 0.5:
+            preds = [[(xx + 1, (level, rng.randint(0, 9))) for _ in range(rng.randint(0, 2))]
+                     for level in range(CURRENT_LEVEL + 1)]
+            rels_group.append([typeid, xx, pair, (0, xx + 1), preds, int(len(preds[CURRENT_LEVEL]) > 0)])
+        else:
+            rels_group.append([typeid, xx, pair, (0, xx + 1), [[[xx + 1, (-1, -1)]]]])
+
+    return rels_group
+
+
+def exhaustive_arg_ids(args_list, ev_structs, max_ev_args):
+    """Every combination of up to 3 (4) arguments matching a structure, depth-first as the nested loops."""
+    max_n_args = 4 if max_ev_args == 4 else 3
+
+    arg_ids_list = [arg_ids for n_args in range(1, max_n_args + 1)
+                    for arg_ids in itertools.combinations(range(len(args_list)), n_args)]
+
+    for arg_ids in sorted(arg_ids_list):
+        structs = ev_structs[len(arg_ids)]
+
+        if structs != -1 and collections.Counter(args_list[xx] for xx in arg_ids) in structs:
+            yield arg_ids
+
+
+def exhaustive_flat_candidates(generator, rels_group, args_list, ev_truth, ev_structs):
+    cands = []
+
+    for arg_ids in exhaustive_arg_ids(args_list, ev_structs, generator.params['max_ev_args']):
+        cand_args_ = [args_list[xx] for xx in arg_ids]
+        a2ids = [rels_group[xx][3][1] for xx in arg_ids]
+
+        cands.append(generator.generate_candidate_output(TRID, collections.Counter(cand_args_), cand_args_,
+                                                         list(arg_ids), a2ids, ev_truth[len(arg_ids)], MOD_LABELS))
+
+    return cands
+
+
+def exhaustive_nest_candidates(generator, rels_group, args_list, ev_truth, ev_structs):
+    cands = []
+
+    for arg_ids in exhaustive_arg_ids(args_list, ev_structs, generator.params['max_ev_args']):
+        # at least one argument is a trigger with events
+        if not any(len(rels_group[xx]) > 5 and rels_group[xx][5] == 1 for xx in arg_ids):
+            continue
+
+        cand_args_ = [args_list[xx] for xx in arg_ids]
+        preds_ = [rels_group[xx][4] for xx in arg_ids]
+
+        for levels in itertools.product(*[range(len(pred_)) for pred_ in preds_]):
+            # a new level for more than one argument
+            if len(arg_ids) > 1 and CURRENT_LEVEL not in levels:
+                continue
+
+            for pairs in itertools.product(*[pred_[level] for pred_, level in zip(preds_, levels)]):
+                cands.append(generator.generate_nest_candidate_output(
+                    TRID, collections.Counter(cand_args_), cand_args_, list(arg_ids), [pid for _, pid in pairs],
+                    [a2id for a2id, _ in pairs], ev_truth[len(arg_ids)], MOD_LABELS, CURRENT_LEVEL))
+
+    return cands
+
+
+def exhaustive_one_nest_candidates(generator, rels_group, args_list, ev_truth, ev_structs):
+    cands = []
+
+    if ev_structs[1] != -1 and collections.Counter(args_list) in ev_structs[1]:
+        if len(rels_group[0]) > 5 and rels_group[0][5] == 1:
+            for a1id, p1id in rels_group[0][4][CURRENT_LEVEL]:
+                cands.append(generator.generate_nest_candidate_output(
+                    TRID, collections.Counter(args_list), args_list, [0], [p1id], [a1id], ev_truth, MOD_LABELS,
+                    CURRENT_LEVEL))
+
+    return cands
+
+
+@pytest.fixture(params=[3, 4])
+def generator(request):
+    generator = EV_Generator({"max_ev_args": request.param, "max_ev_cands_per_tr": None})
+    generator.eval()
+    return generator
+
+
+def random_cases(seed, max_args=9):
+    """Trigger types (each with its own structures) and their argument lists."""
+    rng = random.Random(seed)
+
+    for typeid in range(200):
+        yield rng, typeid, random_structs(rng), [rng.choice(PAIRS) for _ in range(rng.randint(1, max_args))]
+
+
+def test_flat_candidates(generator):
+    ev_truth = -1 * np.ones(generator.params['max_ev_args'] + 1, dtype=object)
+
+    for _, typeid, ev_structs, args_list in random_cases(0):
+        rels_group = [[typeid, xx, pair, (0, xx + 1)] for xx, pair in enumerate(args_list)]
+
+        cands = generator.create_multiple_flat_arg_candidates(TRID, rels_group, args_list, len(args_list), ev_truth,
+                                                              MOD_LABELS, ev_structs)
+
+        assert cands == exhaustive_flat_candidates(generator, rels_group, args_list, ev_truth, ev_structs)
+        assert generator._limit_candidates(cands, rels_group) == cands
+
+
+def test_nested_candidates(generator):
+    ev_truth = -1 * np.ones(generator.params['max_ev_args'] + 1, dtype=object)
+    n_cands = 0
+
+    for rng, typeid, ev_structs, args_list in random_cases(1, max_args=7):
+        rels_group = random_nest_rels_group(rng, typeid, args_list)
+
+        cands = generator.create_multiple_nest_arg_candidates(TRID, rels_group, args_list, len(args_list), ev_truth,
+                                                              MOD_LABELS, ev_structs, CURRENT_LEVEL)
+
+        assert cands == exhaustive_nest_candidates(generator, rels_group, args_list, ev_truth, ev_structs)
+        n_cands += len(cands)
+
+    assert n_cands > 0
+
+
+def test_one_argument_nested_candidates(generator):
+    n_cands = 0
+
+    for rng, typeid, ev_structs, args_list in random_cases(2, max_args=1):
+        rels_group = random_nest_rels_group(rng, typeid, args_list)
+
+        cands = generator.create_one_nest_arg_candidates(TRID, rels_group, args_list, -1, MOD_LABELS, ev_structs,
+                                                         CURRENT_LEVEL)
+
+        assert cands == exhaustive_one_nest_candidates(generator, rels_group, args_list, -1, ev_structs)
+        n_cands += len(cands)
+
+    assert n_cands > 0
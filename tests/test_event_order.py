@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Order and ids of the predicted events when the sentences were processed in length-bucketed batches."""
+import collections
+
+from eval.evalEV import generate_events, generate_ev_output, write_ev_2file
+from loader.prepNN import sampler
+
+THEME, TRIGGER_TYPE, PROTEIN = 0, 1, 2
+
+PARAMS = {
+    "batchsize": 2,
+    "a2_entities": [],
+    "ner_predict_all": False,
+    "mappings": {
+        "rev_rtype_map": {THEME: "Theme"},
+        "rev_type_map": {TRIGGER_TYPE: "Regulation", PROTEIN: "Protein"},
+        "rev_modality_map": {2: "Speculation"},
+    },
+}
+
+# events of each sentence (data id) in the order the event generator outputs them: (kind, trigger number),
+# an "arg" event has the protein 100 + trigger as argument, a "nested" event the last "arg" event of the sentence
+SENTENCE_EVENTS = {
+    0: [("no_arg", 0), ("arg", 1), ("nested", 2)],
+    1: [("arg", 10), ("no_arg", 11)],
+    2: [("no_arg", 20), ("no_arg", 21)],
+    3: [("arg", 30), ("nested", 31), ("arg", 32)],
+}
+
+
+def batch_predictions(data_idss):
+    """Per-batch fids, entities and event predictions by level, as the EV layer outputs them."""
+    fids = []
+    all_ev_preds = []
+    entities = collections.OrderedDict()
+
+    for xi, data_ids in enumerate(data_idss):
+        fids.append(["doc"] * len(data_ids))
+
+        # level 0: the events with arguments of every sentence, then the ones without argument
+        args_level, no_args_level, nested_level = [], [], []
+        for xb, data_id in enumerate(data_ids):
+            for kind, trigger in SENTENCE_EVENTS[data_id]:
+                entities[(xi, (xb, trigger))] = ["TR{}".format(trigger), TRIGGER_TYPE, (trigger, trigger + 1), "t"]
+
+                if kind == "arg":
+                    entities[(xi, (xb, 100 + trigger))] = ["T{}".format(100 + trigger), PROTEIN,
+                                                           (100 + trigger, 101 + trigger), "p"]
+                    args_level.append([(xb, trigger), ([], [(THEME, PROTEIN)]), [(xb, 100 + trigger)], 0])
+                elif kind == "no_arg":
+                    no_args_level.append([(xb, trigger), ([], []), [], 1])
+                else:
+                    argument = (-1, -1, (0, len(args_level) - 1))
+                    nested_level.append([(xb, trigger), ([], [(THEME, TRIGGER_TYPE)]), [argument], 0])
+
+        all_ev_preds.append([args_level + no_args_level, nested_level])
+
+    return fids, all_ev_preds, {"doc": entities}
+
+
+def write_events(data_idss, result_dir, test_data, sentence_order=None):
+    fids, all_ev_preds, pred_ents = batch_predictions(data_idss)
+    pred_evs = generate_events(fids, all_ev_preds, PARAMS, sentence_order=sentence_order)
+
+    write_ev_2file(generate_ev_output(pred_ents, pred_evs, PARAMS), result_dir, dict(PARAMS, test_data=test_data))
+
+    with open(result_dir + "ev-last/ev-ann/doc.ann") as ann_file:
+        return ann_file.read()
+
+
+def test_bucketed_events_have_the_ids_of_the_sequential_batches(tmp_path):
+    test_data = str(tmp_path / "text") + "/"
+    (tmp_path / "text").mkdir()
+    (tmp_path / "text" / "doc.txt").write_text("doc")
+
+    sequential = write_events([[0, 1], [2, 3]], str(tmp_path / "sequential") + "/", test_data)
+
+    bucketed_idss = [[3, 0], [2], [1]]
+    bucketed = write_events(bucketed_idss, str(tmp_path / "bucketed") + "/", test_data,
+                            sentence_order=sampler.restore_order(bucketed_idss))
+
+    assert [line.split("\t")[:2] for line in sequential.splitlines() if line.startswith(("E", "M"))] == [
+        ["E1", "Regulation:T1 Theme:T101"],
+        ["E2", "Regulation:T10 Theme:T110"],
+        ["E3", "Regulation:T0"],
+        ["E4", "Regulation:T11"],
+        ["E5", "Regulation:T2 Theme:E1"],
+        ["E6", "Regulation:T30 Theme:T130"],
+        ["E7", "Regulation:T32 Theme:T132"],
+        ["E8", "Regulation:T20"],
+        ["E9", "Regulation:T21"],
+        ["E10", "Regulation:T31 Theme:E6"],
+        ["M1", "Speculation E3"],
+        ["M2", "Speculation E4"],
+        ["M3", "Speculation E8"],
+        ["M4", "Speculation E9"],
+    ]
+    assert bucketed == sequential
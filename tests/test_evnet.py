@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Forward of the event layer on a toy batch."""
+import collections
+
+import torch
+
+from model.EVNet import EVModel
+
+PARAMS = {
+    "ner_reduce": True,
+    "ner_reduced_size": 8,
+    "bert_dim": 8,
+    "etype_dim": 4,
+    "rel_reduced_size": 6,
+    "rtype_dim": 3,
+    "role_dim": 5,
+    "hidden_dim": 7,
+    "ev_reduced_size": 6,
+    "ev_threshold": 0.5,
+    "dropout": 0,
+    "device": torch.device("cpu"),
+}
+
+SIZES = {"rel_size": 4, "ev_size": 3}
+
+
+def toy_input():
+    # Two sentences, 3 entities in the first one and 2 in the second one, plus the zero row
+    ent_dim = PARAMS["ner_reduced_size"] + PARAMS["etype_dim"]
+    ent_embeds = torch.cat([torch.randn(5, ent_dim), torch.zeros(1, ent_dim)])
+    ent_rows = torch.tensor([[0, 1, 2, 5], [3, 4, 5, 5]])
+
+    # Relations 0 and 1 are arguments of the trigger (0, 0), relation 2 of the trigger (1, 0)
+    rel_embeds = torch.randn(3, PARAMS["rel_reduced_size"])
+    rtypes = torch.randn(3, PARAMS["rtype_dim"])
+
+    ev_arg_ids4nn = collections.OrderedDict(
+        [
+            ((0, 0), ([0, 1], [(0, 1), (0, 2)])),
+            ((1, 0), ([2], [(1, 1)])),
+            ((0, 3), ()),
+        ]
+    )
+
+    # No-argument, one and two IN arguments for the first trigger, one for the second, none for the last
+    ev_cand_ids4nn = {
+        "trids_": [(0, 0), (0, 0), (0, 0), (1, 0), (0, 3)],
+        "io_ids_": [[], [0], [0, 1], [0], []],
+        "ev_structs_": [[0, []], [0, [1]], [0, [1, 1]], [1, [2]], [2, []]],
+        "pos_ev_ids_": [[], [], [], [], []],
+    }
+
+    return ent_embeds, ent_rows, rel_embeds, rtypes, ev_arg_ids4nn, ev_cand_ids4nn
+
+
+def test_flat_events_with_arguments():
+    torch.manual_seed(0)
+
+    model = EVModel(dict(PARAMS), SIZES)
+    model.eval()
+
+    ent_embeds, ent_rows, rel_embeds, rtypes, ev_arg_ids4nn, ev_cand_ids4nn = toy_input()
+    no_rel_type_embed = torch.zeros(PARAMS["rtype_dim"])
+
+    tr_embeds, arg_table, tr_rows = model.get_arg_embeds(
+        ent_embeds, ent_rows, rel_embeds, rtypes, ev_arg_ids4nn, no_rel_type_embed
+    )
+
+    # One no-argument row per trigger, then one row per entity argument
+    assert arg_table.shape[0] == 3 + 3
+    assert torch.equal(tr_embeds, ent_embeds[[0, 3, 5]])
+    assert torch.equal(arg_table[3:, -ent_embeds.shape[1]:], ent_embeds[[1, 2, 4]])
+    assert [rows for _, rows, _ in tr_rows.values()] == [[3, 4], [5], []]
+
+    ev_embeds = model.event_representation(tr_embeds, arg_table, tr_rows, ev_cand_ids4nn)
+
+    assert ev_embeds.shape == (5, ent_embeds.shape[1] + PARAMS["role_dim"])
+
+    # The candidate with both arguments IN sums their IN rows, the one with none sums their OUT rows
+    reduced = torch.cat([model.in_arg_layer(arg_table), model.out_arg_layer(arg_table)])
+    n_rows = arg_table.shape[0]
+
+    assert torch.allclose(ev_embeds[2, -PARAMS["role_dim"]:], reduced[3] + reduced[4])
+    assert torch.allclose(
+        ev_embeds[0, -PARAMS["role_dim"]:], reduced[0] + reduced[3 + n_rows] + reduced[4 + n_rows]
+    )
+
+    model.predict(ev_embeds)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Prediction from the entities of the client (gold_entities): gold spans, predicted relations and events."""
+import numpy as np
+import torch
+from torch import nn
+
+from model.deepEM import DeepEM
+from model.EVNet import EVModel
+from test_evnet import PARAMS, SIZES
+
+MODE = {"predict": True, "gold_eval": False, "pipelines": False, "gold_entities": True}
+
+
+def test_relation_pairs_from_given_entities():
+    # Only the layers' parameters are needed to build the pairs, no encoder
+    model = DeepEM.__new__(DeepEM)
+    nn.Module.__init__(model)
+    model.device = torch.device("cpu")
+    model.params = dict(
+        MODE,
+        ner_label_limit=1,
+        enable_triggers_pair=False,
+        trTypes_Ids=[1],
+        mappings={"nn_mapping": {"tag2type_map": {0: -1, 1: 1, 2: 2}}},
+    )
+
+    # NER predicted nothing, the client gave a trigger (1) and an entity (2)
+    p_span_indices = torch.zeros((1, 3), dtype=torch.long)
+    g_span_indices = torch.tensor([[1, 0, 2]])
+    span_embeddings = torch.randn(3, 4)
+
+    _, ent_rows, _, tr_indices, pair_indices = model.generate_entity_pairs_4rel(
+        span_embeddings, torch.tensor([0]), p_span_indices, g_span_indices
+    )
+
+    assert tr_indices.tolist() == [[1, 0, 0]]
+    assert pair_indices.tolist() == [[0], [0], [2]]
+
+
+def test_events_from_predicted_relations():
+    params = dict(
+        PARAMS,
+        **MODE,
+        voc_sizes={"rel_size": 3},
+        mappings={"rel2rtype_map": np.array([0, 1, -1])},
+    )
+    model = EVModel(params, SIZES)
+
+    # No gold relation exists for the entities of the client, the predicted ones are used
+    rel_preds = {
+        "pairs_idx": torch.tensor([[0, 0], [0, 0], [1, 2]]),
+        "preds": torch.tensor([1, 2]),
+        "l2r": torch.zeros((3, 0), dtype=torch.long),
+        "truth": torch.zeros(0, dtype=torch.long),
+    }
+
+    span_indices, r_types, rpos_indices = model.get_rel_input(rel_preds)
+
+    assert torch.equal(span_indices, rel_preds["pairs_idx"])
+    assert r_types.tolist() == [1, -1]
+    assert rpos_indices.tolist() == [0]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Background jobs of the API gateway: queue bound, cancellation and retention of the finished jobs."""
+import asyncio
+
+import pytest
+
+from utils import jobs
+from utils.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobQueue, JobQueueFull
+
+
+def run_scenario(scenario):
+    asyncio.new_event_loop().run_until_complete(scenario())
+
+
+def test_queue_bound():
+    async def scenario():
+        queue = JobQueue(concurrency=1, ttl=60, max_jobs=2, max_finished=10)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return "result"
+
+        first = queue.submit("ner", "owner", blocked)
+        second = queue.submit("ner", "owner", blocked)
+        await asyncio.sleep(0)
+
+        assert (first.status, second.status) == (RUNNING, QUEUED)
+
+        with pytest.raises(JobQueueFull):
+            queue.submit("ner", "owner", blocked)
+
+        release.set()
+        await asyncio.gather(first.future, second.future)
+
+        # the finished jobs do not count
+        assert (first.status, first.result) == (DONE, "result")
+        assert queue.submit("ner", "owner", blocked).status == QUEUED
+
+        queue.close()
+
+    run_scenario(scenario)
+
+
+def test_cancellation():
+    async def scenario():
+        queue = JobQueue(concurrency=1, ttl=60, max_jobs=10, max_finished=10)
+        never = asyncio.Event()
+
+        async def blocked():
+            await never.wait()
+
+        async def failing():
+            raise ValueError("failed")
+
+        running = queue.submit("ner", "owner", blocked)
+        queued = queue.submit("ner", "owner", blocked)
+        failed = queue.submit("ner", "owner", failing)
+        await asyncio.sleep(0)
+
+        assert queue.cancel(queued.id).status == CANCELLED
+        assert queue.cancel(running.id).status == CANCELLED
+        assert queue.cancel("unknown") is None
+
+        await asyncio.gather(running.future, queued.future, failed.future)
+
+        # the cancelled coroutines stopped at their await and the jobs stayed cancelled
+        assert (running.status, queued.status) == (CANCELLED, CANCELLED)
+        assert (failed.status, str(failed.error)) == (FAILED, "failed")
+        assert queue.stats() == {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 1, CANCELLED: 2}
+
+        # a finished job is not cancelled
+        assert queue.cancel(failed.id).status == FAILED
+
+    run_scenario(scenario)
+
+
+def test_finished_jobs_forgotten_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+
+    async def scenario():
+        queue = JobQueue(concurrency=2, ttl=60, max_jobs=10, max_finished=10)
+
+        async def result():
+            return "result"
+
+        job = queue.submit("ner", "owner", result)
+        await job.future
+
+        now[0] += 59
+        assert queue.get(job.id) is job
+
+        now[0] += 1
+        assert queue.get(job.id) is None
+        assert queue.jobs == {}
+
+    run_scenario(scenario)
+
+
+def test_finished_jobs_capped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+
+    async def scenario():
+        queue = JobQueue(concurrency=1, ttl=60, max_jobs=10, max_finished=3)
+        never = asyncio.Event()
+
+        async def blocked():
+            await never.wait()
+
+        async def result():
+            return "result"
+
+        running = queue.submit("ner", "owner", blocked)
+        finished = []
+
+        for _ in range(5):
+            now[0] += 1
+            job = queue.submit("ner", "owner", result)
+            finished.append(job)
+
+            # the jobs wait for the running one, they are cancelled in submission order
+            queue.cancel(job.id)
+
+        # the 3 last finished jobs are kept, the unfinished one too
+        assert list(queue.jobs) == [running.id] + [job.id for job in finished[2:]]
+
+        queue.close()
+        await asyncio.gather(*(job.future for job in [running] + finished), return_exceptions=True)
+
+    run_scenario(scenario)
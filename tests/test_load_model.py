@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Loading of the DeepEM weights."""
+import pytest
+
+from predictor import load_model
+
+
+def parameters(tmp_path, **kwargs):
+    return dict(
+        {
+            "joint_model_flat": str(tmp_path / "missing.flat"),
+            "joint_model_dir": str(tmp_path),
+            "device": "cpu",
+            "use_lstm": False,
+        },
+        **kwargs
+    )
+
+
+def test_missing_flat_model_file_is_an_error(tmp_path):
+    with pytest.raises(FileNotFoundError, match="missing.flat"):
+        load_model(parameters(tmp_path))
+
+
+def test_precision_modes_need_the_bert_encoder(tmp_path):
+    with pytest.raises(ValueError, match="use_lstm"):
+        load_model(parameters(tmp_path, use_lstm=True, inference_precision="int8"))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Tensor alignment of the NER predictions (NestedNERModel.align_preds) against the former Python loop."""
+import numpy as np
+import pytest
+import torch
+
+from model.NERNet import NestedNERModel
+
+
+def loop_align_preds(all_preds, all_golds):
+    """The former alignment: one Python loop over the spans."""
+    all_aligned_preds = []
+    for preds, golds in zip(all_preds, all_golds):
+        aligned_preds = []
+        pred_set = set(preds) - {0}
+        gold_set = set(golds) - {0}
+        shared = pred_set & gold_set
+        diff = pred_set - shared
+        for gold in golds:
+            if gold in shared:
+                aligned_preds.append(gold)
+            else:
+                aligned_preds.append(diff.pop() if diff else 0)
+        all_aligned_preds.append(aligned_preds)
+
+    return np.array(all_aligned_preds, dtype=all_preds.dtype)
+
+
+def sentence_spans(rng, length=12, max_span_width=4, num_labels=20, ner_label_limit=3):
+    """Top-k label ids of the predictions and the golds of all the (nested and overlapping) spans of a sentence."""
+    num_spans = sum(min(max_span_width, length - start) for start in range(length))
+
+    label_ids = torch.arange(1, num_labels + 1, dtype=torch.uint8)
+
+    # a few labels per span over the threshold, several of them for some spans
+    scores = torch.tensor(rng.beta(0.3, 3.0, size=(num_spans, num_labels)), dtype=torch.float32)
+    golds = torch.tensor(rng.random((num_spans, num_labels)) < 0.1)
+
+    _, top_indices = torch.topk(scores, k=ner_label_limit, dim=-1)
+    preds = torch.gather((scores > 0.5) * label_ids, dim=1, index=top_indices)
+
+    golds, _ = torch.sort(golds * label_ids, dim=-1, descending=True)
+    golds = torch.narrow(golds, 1, 0, ner_label_limit)
+
+    return preds, golds
+
+
+@pytest.mark.parametrize("inference", [False, True])
+def test_same_labels_as_the_loop(inference):
+    rng = np.random.default_rng(0)
+
+    n_multi_labels = 0
+    for _ in range(20):
+        preds, golds = sentence_spans(rng)
+        if inference:
+            golds = torch.zeros_like(golds)
+
+        aligned = NestedNERModel.align_preds(preds, None if inference else golds).numpy()
+        reference = loop_align_preds(preds.numpy(), golds.numpy())
+        np_golds = golds.numpy()
+
+        # the same gold slots, and the same labels in the other slots
+        assert np.array_equal((np_golds > 0) & (aligned == np_golds), (np_golds > 0) & (reference == np_golds))
+        assert np.array_equal(np.sort(aligned, axis=-1), np.sort(reference, axis=-1))
+
+        n_multi_labels += int(((preds > 0).sum(-1) > 1).sum())
+
+    assert n_multi_labels > 0
+
+
+def test_other_labels_in_top_k_order():
+    # the former loop filled the free slots in the iteration order of a Python set (an implementation detail of
+    # the hash table), the other predicted labels now keep their top-k order
+    preds = torch.tensor([[2, 9, 5], [7, 3, 0], [4, 12, 3], [0, 0, 0]], dtype=torch.uint8)
+    golds = torch.tensor([[0, 0, 0], [3, 0, 0], [12, 6, 0], [5, 0, 0]], dtype=torch.uint8)
+
+    assert NestedNERModel.align_preds(preds, golds).tolist() == [[2, 9, 5], [3, 7, 0], [12, 4, 3], [0, 0, 0]]
+    assert NestedNERModel.align_preds(preds).tolist() == [[2, 9, 5], [7, 3, 0], [4, 12, 3], [0, 0, 0]]
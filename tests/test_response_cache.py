@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Single-flight of the response cache of the API gateway."""
+import asyncio
+
+from utils.response_cache import ResponseCache
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_cancelled_request_leaves_the_call_to_the_others():
+    async def scenario():
+        cache = ResponseCache(ttl=60, max_entries=10)
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return {"text": "x"}
+
+        first = asyncio.ensure_future(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+
+        assert await second == {"text": "x"}
+        assert first.cancelled()
+        assert len(calls) == 1
+        # Stored for the next requests
+        assert await cache.get_or_fetch("key", fetch) == {"text": "x"}
+        assert cache.stats()["memory_hits"] == 1
+
+    run(scenario())
+
+
+def test_last_cancelled_request_cancels_the_call():
+    async def scenario():
+        cache = ResponseCache(ttl=60, max_entries=10)
+        cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        request = asyncio.ensure_future(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+        request.cancel()
+
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        assert cache.inflight == {}
+
+    run(scenario())
+
+
+def test_upstream_error_raised_to_every_request():
+    async def scenario():
+        cache = ResponseCache(ttl=60, max_entries=10)
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream")
+
+        results = await asyncio.gather(
+            cache.get_or_fetch("key", fetch),
+            cache.get_or_fetch("key", fetch),
+            return_exceptions=True,
+        )
+
+        assert [type(result) for result in results] == [ValueError, ValueError]
+        assert cache.memory == {}
+
+    run(scenario())
+
+
+def test_single_flight_with_the_disk_tier(tmp_path):
+    async def scenario():
+        cache = ResponseCache(ttl=60, max_entries=1, disk_path=str(tmp_path / "responses.sqlite"))
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return {"text": "x"}
+
+        results = await asyncio.gather(*[cache.get_or_fetch("key", fetch) for _ in range(5)])
+
+        assert results == [{"text": "x"}] * 5
+        assert len(calls) == 1
+        assert (cache.stats()["coalesced"], cache.stats()["misses"]) == (4, 1)
+
+        # Evicted to disk, then read back once by concurrent requests
+        await cache.get_or_fetch("other", fetch)
+        results = await asyncio.gather(*[cache.get_or_fetch("key", fetch) for _ in range(3)])
+
+        assert results == [{"text": "x"}] * 3
+        assert len(calls) == 2
+        assert (cache.stats()["disk_hits"], cache.stats()["coalesced"]) == (1, 6)
+
+        cache.close()
+
+    run(scenario())
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Length-bucketed batching of the DeepEM sentences."""
+import random
+
+from loader.prepNN import sampler
+
+
+def random_lengths(seed, count=300):
+    rng = random.Random(seed)
+    lengths = [max(1, int(rng.lognormvariate(3.3, 0.6))) for _ in range(count)]
+    span_counts = [length * 3 for length in lengths]
+    return lengths, span_counts
+
+
+def test_every_sentence_in_one_batch_within_the_budget():
+    lengths, span_counts = random_lengths(0)
+    batch_sampler = sampler.BucketBatchSampler(lengths, span_counts, token_budget=512, max_batch_size=16)
+
+    batches = list(batch_sampler)
+
+    assert sorted(data_id for batch in batches for data_id in batch) == list(range(len(lengths)))
+
+    for batch in batches:
+        batch_lengths = [lengths[data_id] for data_id in batch]
+
+        assert len(batch) <= 16
+        assert len(batch) == 1 or len(batch) * max(batch_lengths) <= 512
+        # one bucket per batch
+        assert len({length // batch_sampler.bucket_width for length in batch_lengths}) == 1
+
+
+def test_bucketing_reduces_the_padding():
+    lengths, span_counts = random_lengths(1)
+    sequential = [list(range(start, min(start + 16, len(lengths)))) for start in range(0, len(lengths), 16)]
+    bucketed = sampler.BucketBatchSampler(lengths, span_counts, token_budget=16 * 64, max_batch_size=16).batches
+
+    bucketed_padding = sampler.padding_ratio(bucketed, lengths, span_counts)
+    sequential_padding = sampler.padding_ratio(sequential, lengths, span_counts)
+
+    assert all(bucketed_ratio < sequential_ratio
+               for bucketed_ratio, sequential_ratio in zip(bucketed_padding, sequential_padding))
+
+
+def test_restore_order():
+    data_idss = [[3, 0], [2], [1, 4]]
+
+    assert not sampler.is_ordered(data_idss)
+    assert [data_idss[xi][xb] for xi, xb in sampler.restore_order(data_idss)] == [0, 1, 2, 3, 4]
+    assert sampler.is_ordered([[0, 1], [2, 3]])
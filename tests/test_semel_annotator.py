@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""SemELAnnotator with in-memory NER, candidate generation and re-ranking predictors."""
+from annotator import SemELAnnotator, SentenceCache, Standoffizer
+
+DOCS = [
+    "IL-2 activates NF-kB in T cells .  TRAF2 binds TRADD .",
+    "TRAF2 binds TRADD .  No protein here .  STAT3 is phosphorylated by JAK2 .",
+    "IL-2 activates NF-kB in T cells .",
+]
+
+
+class NERPredictor:
+    """Mentions of the tokens with an upper case letter and a digit or a hyphen, one call per batch."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, tokenized_sentences):
+        self.batches.append(len(tokenized_sentences))
+
+        sentences = []
+        num_mentions = 0
+
+        for tokens in tokenized_sentences:
+            mentions = []
+
+            for index, token in enumerate(tokens):
+                if token[0].isupper() and any(char.isdigit() or char == "-" for char in token):
+                    num_mentions += 1
+                    mentions.append({"id": f"T{num_mentions}", "start": index, "end": index, "label": "Protein",
+                                     "references": {}})
+
+            sentences.append({"tokens": tokens, "mentions": mentions})
+
+        return {"sample.ann": {"sentences": sentences}}
+
+
+def cg_predictor(docs):
+    """Two candidate concepts per mention, from its text."""
+    for doc in docs.values():
+        for sentence in doc["sentences"]:
+            for mention in sentence["mentions"]:
+                text = " ".join(sentence["tokens"][mention["start"]:mention["end"] + 1])
+
+                mention["references"][("PRED", f"C{text}/0")] = 0.75
+                mention["references"][("PRED", f"C{len(text)}/1")] = 0.25
+
+    return docs
+
+
+def cr_predictor(docs):
+    """Re-ranked confidences, and a gold reference that is not output."""
+    for doc in docs.values():
+        for sentence in doc["sentences"]:
+            for mention in sentence["mentions"]:
+                for key in mention["references"]:
+                    mention["references"][key] *= 2
+                mention["references"][("GOLD", "C0")] = 1.0
+
+    return docs
+
+
+def semel_annotator(sentence_cache_size=0, enable_linking=True):
+    annotator = SemELAnnotator.__new__(SemELAnnotator)
+
+    annotator.ner_predictor = NERPredictor()
+    annotator.cg_predictor = cg_predictor
+    annotator.cr_predictor = cr_predictor
+    annotator.enable_linking = enable_linking
+    annotator.model_version = "version"
+    annotator.sentence_cache = SentenceCache(sentence_cache_size)
+
+    return annotator
+
+
+def split(doc):
+    """split_document with the sentences separated by two spaces and the tokens by one."""
+    sentences = doc.split("  ")
+    sentence_standoffs = list(Standoffizer(doc, sentences))
+    tokenized_sentences = [sentence.split() for sentence in sentences]
+    offset_maps = [
+        list(Standoffizer(sentence, tokens, sentence_start))
+        for sentence, tokens, (sentence_start, _) in zip(sentences, tokenized_sentences, sentence_standoffs)
+    ]
+
+    return sentences, tokenized_sentences, sentence_standoffs, offset_maps
+
+
+def same_results(left, right):
+    return [(str(annotations), standoffs) for annotations, *standoffs in left] == \
+           [(str(annotations), standoffs) for annotations, *standoffs in right]
+
+
+def test_annotate_many_gives_the_annotations_of_each_document():
+    splits = [split(doc) for doc in DOCS]
+
+    for enable_linking in (False, True):
+        annotator = semel_annotator(enable_linking=enable_linking)
+
+        one_by_one = [annotator.annotate_many([doc], [doc_split])[0] for doc, doc_split in zip(DOCS, splits)]
+        annotator.ner_predictor.batches.clear()
+
+        pooled = annotator.annotate_many(DOCS, splits)
+
+        # one NER call, on the 4 distinct sentences of the 6
+        assert same_results(pooled, one_by_one)
+        assert annotator.ner_predictor.batches == [4]
+
+    assert str(one_by_one[1][0]).splitlines()[:3] == [
+        "T1\tProtein 0 5\tTRAF2",
+        "N1\tReference T1 UMLS:CTRAF2/0\tConf: 1.5",
+        "N2\tReference T1 UMLS:C5/1\tConf: 0.5",
+    ]
+
+    # with the sentence cache, the documents annotated again are not predicted again
+    annotator = semel_annotator(sentence_cache_size=10)
+
+    assert same_results(annotator.annotate_many(DOCS, splits), one_by_one)
+    assert same_results(annotator.annotate_many(DOCS[1:], splits[1:]), one_by_one[1:])
+    assert annotator.ner_predictor.batches == [4]
+
+
+def test_linking_the_predicted_mentions_gives_the_annotations_of_annotate_many():
+    splits = [split(doc) for doc in DOCS]
+    annotator = semel_annotator()
+
+    annotated = annotator.annotate_many(DOCS, splits)
+    annotator.ner_predictor.batches.clear()
+
+    mentions = [
+        [(ann.spans[0][0], ann.spans[0][1], ann.type) for ann in annotations.get_textbounds()]
+        for annotations, _, _ in annotated
+    ]
+    linked = [annotator.link(doc, doc_mentions, doc_split)
+              for doc, doc_mentions, doc_split in zip(DOCS, mentions, splits)]
+
+    # without NER
+    assert [len(doc_mentions) for doc_mentions in mentions] == [3, 3, 2]
+    assert same_results(linked, annotated)
+    assert annotator.ner_predictor.batches == []
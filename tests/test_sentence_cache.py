@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Annotation of a document from cached sentence predictions against the prediction of the whole document."""
+import itertools
+import os
+
+from annotator import DeepEMAnnotator, SentenceCache
+from utils.annotation import TextAnnotations
+
+split_annotations = DeepEMAnnotator._DeepEMAnnotator__split_annotations
+add_annotations = DeepEMAnnotator._DeepEMAnnotator__add_annotations
+
+# tokenized sentences and their predictions, with ids local to the sentence:
+# (T/TR, id, type, start, end), (E, id, type, trigger, args), (R, id, type, arg1, arg2), (A, id, type, event)
+SENTENCES = {
+    "IL-2 activates NF-kB .": [
+        ("T", "il2", "Protein", 0, 4),
+        ("TR", "act", "Positive_regulation", 5, 14),
+        ("T", "nfkb", "Protein", 15, 20),
+        # the same entity predicted twice, the event uses the duplicate
+        ("T", "nfkb2", "Protein", 15, 20),
+        ("E", "ev", "Positive_regulation", "act", [("Theme", "nfkb2"), ("Cause", "il2")]),
+    ],
+    "p65 expression is not induced .": [
+        ("T", "p65", "Protein", 0, 3),
+        ("TR", "expr", "Gene_expression", 4, 14),
+        ("TR", "ind", "Positive_regulation", 22, 29),
+        # a nested event before its argument, an identical event and attributes of both
+        ("E", "reg", "Positive_regulation", "ind", [("Theme", "gene")]),
+        ("E", "gene", "Gene_expression", "expr", [("Theme", "p65")]),
+        ("E", "gene2", "Gene_expression", "expr", [("Theme", "p65")]),
+        ("A", "neg", "Negation", "reg"),
+        ("A", "spec", "Speculation", "gene2"),
+    ],
+    "TRAF2 binds TRADD .": [
+        ("T", "traf2", "Protein", 0, 5),
+        ("T", "tradd", "Protein", 12, 17),
+        ("R", "bind", "Binding", "traf2", "tradd"),
+    ],
+}
+
+
+def predict(sentences, path):
+    """Predictions of the sentences split from the .ann of their tokenized document, ids numbered in the document."""
+    tokenized_doc = "\n".join(sentences)
+    sentence_starts = list(itertools.accumulate([0] + [len(sentence) + 1 for sentence in sentences]))
+
+    # offsets in the tokenized document -> (sentence index, offset in the sentence)
+    offset_map = {
+        sentence_start + offset: (sentence_index, offset)
+        for sentence_index, (sentence, sentence_start) in enumerate(zip(sentences, sentence_starts))
+        for offset in range(len(sentence) + 1)
+    }
+
+    id_counts = {}
+    ids = {}
+
+    def new_id(sentence_index, prefix, local_id):
+        id_counts[prefix] = id_counts.get(prefix, 0) + 1
+        ids[sentence_index, local_id] = prefix + str(id_counts[prefix])
+
+    for sentence_index, sentence in enumerate(sentences):
+        for annotation in SENTENCES[sentence]:
+            new_id(sentence_index, annotation[0], annotation[1])
+
+    lines = []
+    for sentence_index, (sentence, sentence_start) in enumerate(zip(sentences, sentence_starts)):
+        def ann_id(local_id):
+            return ids[sentence_index, local_id]
+
+        for kind, local_id, ann_type, *rest in SENTENCES[sentence]:
+            if kind in ("T", "TR"):
+                start, end = rest
+                lines.append("{}\t{} {} {}\t{}".format(ann_id(local_id), ann_type, sentence_start + start,
+                                                       sentence_start + end, sentence[start:end]))
+            elif kind == "E":
+                trigger, args = rest
+                lines.append("{}\t{}:{}{}".format(ann_id(local_id), ann_type, ann_id(trigger), "".join(
+                    " {}:{}".format(role, ann_id(arg)) for role, arg in args)))
+            elif kind == "R":
+                arg1, arg2 = rest
+                lines.append("{}\t{} Arg1:{} Arg2:{}".format(ann_id(local_id), ann_type, ann_id(arg1), ann_id(arg2)))
+            else:
+                target, = rest
+                lines.append("{}\t{} {}".format(ann_id(local_id), ann_type, ann_id(target)))
+
+    os.makedirs(path)
+    document = os.path.join(path, "sample")
+
+    with open(document + ".txt", "w") as txt_file:
+        txt_file.write(tokenized_doc)
+    with open(document + ".ann", "w") as ann_file:
+        ann_file.write("\n".join(lines) + "\n")
+
+    with TextAnnotations(document=document) as prediction:
+        return split_annotations(prediction, offset_map, len(sentences))
+
+
+def annotate(doc, sentences, predictions):
+    sentence_standoffs = []
+    start = 0
+    for sentence in sentences:
+        start = doc.index(sentence, start)
+        sentence_standoffs.append((start, start + len(sentence)))
+        start += len(sentence)
+
+    with TextAnnotations(text=doc) as annotator:
+        add_annotations(annotator, predictions, sentence_standoffs)
+
+        return str(annotator)
+
+
+def test_cached_sentences_give_the_annotations_of_the_whole_document(tmp_path):
+    sentences = list(SENTENCES)
+    doc = "  ".join(sentences)
+
+    full = annotate(doc, sentences, predict(sentences, str(tmp_path / "full")))
+
+    # the last and first sentences were predicted before, in another document
+    cache = SentenceCache()
+    for sentence, prediction in zip([sentences[2], sentences[0]],
+                                    predict([sentences[2], sentences[0]], str(tmp_path / "previous"))):
+        cache.put(("version", sentence), prediction)
+
+    predictions = [cache.get(("version", sentence)) for sentence in sentences]
+    assert [prediction is None for prediction in predictions] == [False, True, False]
+
+    predictions[1], = predict([sentences[1]], str(tmp_path / "missing"))
+
+    assert annotate(doc, sentences, predictions) == full
+
+    # the duplicates are dropped and the nested event and the attributes point to the kept annotations
+    assert full.splitlines() == [
+        "T1\tProtein 0 4\tIL-2",
+        "TR1\tPositive_regulation 5 14\tactivates",
+        "T2\tProtein 15 20\tNF-kB",
+        "T3\tProtein 24 27\tp65",
+        "TR2\tGene_expression 28 38\texpression",
+        "TR3\tPositive_regulation 46 53\tinduced",
+        "T4\tProtein 57 62\tTRAF2",
+        "T5\tProtein 69 74\tTRADD",
+        "R1\tBinding Arg1:T4 Arg2:T5",
+        "E1\tPositive_regulation:TR1 Theme:T2 Cause:T1",
+        "E2\tGene_expression:TR2 Theme:T3",
+        "E3\tPositive_regulation:TR3 Theme:E2",
+        "A1\tNegation E3",
+        "A2\tSpeculation E2",
+    ]
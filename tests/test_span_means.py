@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Span mean embeddings of NestedNERModel (prefix sums) against the former gathered means."""
+import types
+
+import numpy as np
+import torch
+
+from bert.modeling import BertConfig
+from model.NERNet import NestedNERModel
+
+MAX_SPAN_WIDTH = 3
+HIDDEN = 8
+
+
+def ner_model():
+    config = BertConfig(30, hidden_size=HIDDEN, num_hidden_layers=1, num_attention_heads=2, intermediate_size=16)
+    params = {
+        "ner_label_limit": 2,
+        "ner_threshold": 0.5,
+        "max_span_width": MAX_SPAN_WIDTH,
+        "use_lstm": False,
+        "ner_reduce": False,
+        "mappings": {"nn_mapping": {"num_entities": 2, "num_triggers": 1, "trTypes_Ids": [1],
+                                    "mlb": types.SimpleNamespace(classes_=np.array([1, 2, 3]))}},
+    }
+
+    return NestedNERModel(config, params).eval()
+
+
+def gathered_means(embeddings, span_starts, span_ends):
+    """The former means: a (spans, max_span_width, H) gather of the token embeddings."""
+    mean_indices = span_starts.view(-1, 1) + torch.arange(MAX_SPAN_WIDTH).view(1, -1)
+    mean_indices_criteria = torch.gt(mean_indices, span_ends.view(-1, 1).repeat(1, MAX_SPAN_WIDTH))
+    mean_indices = torch.min(mean_indices, span_ends.view(-1, 1).repeat(1, MAX_SPAN_WIDTH))
+
+    span_mean_embeddings = torch.index_select(embeddings, 0, mean_indices.flatten()).view(*mean_indices.size(), -1)
+
+    coeffs = torch.ones(mean_indices.size(), dtype=embeddings.dtype)
+    coeffs[mean_indices_criteria] = 0
+
+    span_mean_embeddings = span_mean_embeddings * coeffs.unsqueeze(-1)
+
+    return torch.sum(span_mean_embeddings, dim=1) / torch.sum(coeffs, dim=-1).view(-1, 1)
+
+
+def test_prefix_sum_means_are_the_gathered_means():
+    torch.manual_seed(0)
+    model = ner_model()
+
+    # two sentences of 5 and 2 tokens, padded to 6
+    lengths = [5, 2]
+    token_masks = torch.tensor([[1] * length + [0] * (6 - length) for length in lengths])
+
+    # the spans of each sentence up to MAX_SPAN_WIDTH, by start and width as the model enumerates them
+    spans = [[(start, start + width) for start in range(length) for width in range(MAX_SPAN_WIDTH)
+              if start + width < length] for length in lengths]
+    max_spans = max(len(sentence_spans) for sentence_spans in spans)
+    span_masks = torch.tensor([[1] * len(sentence_spans) + [-1] * (max_spans - len(sentence_spans))
+                               for sentence_spans in spans])
+
+    outputs = {}
+    model.bert.register_forward_hook(lambda module, inputs, output: outputs.update(embeddings=output[0]))
+    model.entity_classifier.register_forward_hook(
+        lambda module, inputs, output: outputs.update(combined=inputs[0]))
+
+    with torch.no_grad():
+        model(all_tokens=None, all_ids=torch.randint(1, 30, (2, 6)), all_token_masks=token_masks,
+              all_attention_masks=token_masks, all_entity_masks=span_masks, all_trigger_masks=span_masks,
+              inference=True)
+
+    # spans over the flattened tokens of the batch
+    offsets = np.cumsum([0] + lengths)
+    span_starts = torch.tensor([offsets[xb] + start for xb, sentence_spans in enumerate(spans)
+                                for start, _ in sentence_spans])
+    span_ends = torch.tensor([offsets[xb] + end for xb, sentence_spans in enumerate(spans)
+                              for _, end in sentence_spans])
+    flattened_embeddings = outputs["embeddings"][token_masks.bool()]
+
+    start_embeddings, mean_embeddings, end_embeddings = torch.split(outputs["combined"], HIDDEN, dim=-1)
+
+    assert torch.equal(start_embeddings, flattened_embeddings[span_starts])
+    assert torch.equal(end_embeddings, flattened_embeddings[span_ends])
+    assert torch.allclose(mean_embeddings, gathered_means(flattened_embeddings, span_starts, span_ends),
+                          rtol=1e-5, atol=1e-6)
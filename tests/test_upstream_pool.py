@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Load balancing of the API gateways (utils.upstream.UpstreamPool) over replicas answered by httpx.MockTransport."""
+import asyncio
+import collections
+
+import httpx
+import pytest
+
+from utils.upstream import HEDGE_MIN_SAMPLES, UpstreamPool
+
+PATH = "/task/annotate_compact"
+
+
+class StubReplica:
+    """Answers the requests of a replica, records the POSTs in flight and the cancelled ones."""
+
+    def __init__(self, name, status_code=200, latency=0.0):
+        self.name = name
+        self.status_code = status_code
+        self.health_status_code = 200
+        self.latency = latency
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.posts = 0
+        self.cancelled = 0
+
+    async def __call__(self, request):
+        if request.method == "GET":
+            return httpx.Response(self.health_status_code, json={"status": "ok"})
+
+        self.posts += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        return httpx.Response(self.status_code, json={"replica": self.name})
+
+
+async def start_pool(stubs, **kwargs):
+    kwargs.setdefault("health_interval", 0)
+    kwargs.setdefault("backoff", 0)
+
+    pool = UpstreamPool([f"http://{stub.name}" for stub in stubs], **kwargs)
+    await pool.start()
+
+    for replica, stub in zip(pool.replicas, stubs):
+        await replica.client.client.aclose()
+        replica.client.client = httpx.AsyncClient(
+            base_url=replica.client.base_url, transport=httpx.MockTransport(stub)
+        )
+
+    return pool
+
+
+def run_scenario(scenario):
+    asyncio.new_event_loop().run_until_complete(scenario())
+
+
+@pytest.mark.parametrize("balancing", ["p2c", "least"])
+def test_least_loaded_replica_chosen(balancing):
+    pool = UpstreamPool(["http://r0", "http://r1", "http://r2"], balancing=balancing)
+
+    for replica, outstanding in zip(pool.replicas, [1, 0, 2]):
+        replica.outstanding = outstanding
+
+    chosen = collections.Counter(pool.choose().client.base_url for _ in range(300))
+
+    if balancing == "least":
+        assert chosen == {"http://r1": 300}
+    else:
+        # the least loaded of two random replicas: never the most loaded, the least loaded 2 times in 3
+        assert set(chosen) == {"http://r0", "http://r1"}
+        assert 150 < chosen["http://r1"] < 250
+
+    # an ejected or excluded replica is not chosen
+    pool.replicas[1].healthy = False
+    assert pool.choose(exclude=pool.replicas[0]).client.base_url == "http://r2"
+
+
+def test_replica_concurrency():
+    async def scenario():
+        stub = StubReplica("r0", latency=0.01)
+        pool = await start_pool([stub], replica_concurrency=2)
+
+        try:
+            results = await asyncio.gather(*(pool.post(PATH, data={"text": "x"}) for _ in range(6)))
+        finally:
+            await pool.close()
+
+        assert results == [{"replica": "r0"}] * 6
+        assert (stub.posts, stub.max_in_flight) == (6, 2)
+
+    run_scenario(scenario)
+
+
+def test_ejection_and_health_check():
+    async def scenario():
+        failing, stub = StubReplica("r0", status_code=503), StubReplica("r1")
+        pool = await start_pool([failing, stub], eject_failures=3, retries=0, health_interval=0.01)
+        replica = pool.replicas[0]
+
+        try:
+            failing.health_status_code = 503
+
+            for failures in range(1, 4):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await pool.send(replica, "POST", PATH, {})
+
+                assert (replica.failures, replica.healthy) == (failures, failures < 3)
+
+            # the other replica gets the requests
+            assert [await pool.post(PATH) for _ in range(3)] == [{"replica": "r1"}] * 3
+            assert failing.posts == 3
+
+            # back in once a health check succeeds
+            await asyncio.sleep(0.05)
+            assert not replica.healthy
+
+            failing.health_status_code = 200
+            await asyncio.sleep(0.05)
+            assert (replica.healthy, replica.failures, replica.ejections) == (True, 0, 1)
+        finally:
+            await pool.close()
+
+    run_scenario(scenario)
+
+
+def test_retry_on_another_replica():
+    async def scenario():
+        failing, stub = StubReplica("r0", status_code=503), StubReplica("r1")
+        pool = await start_pool([failing, stub], balancing="least", retries=1)
+
+        try:
+            # both are idle, the first replica is chosen first
+            assert await pool.post(PATH) == {"replica": "r1"}
+        finally:
+            await pool.close()
+
+        assert (failing.posts, stub.posts) == (1, 1)
+        assert [replica.errors for replica in pool.replicas] == [1, 0]
+
+        # a request that is not retryable is not retried
+        failing.status_code = 400
+        pool = await start_pool([failing, stub], balancing="least", retries=1)
+
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await pool.post(PATH)
+        finally:
+            await pool.close()
+
+        assert (failing.posts, stub.posts) == (2, 1)
+
+    run_scenario(scenario)
+
+
+def test_hedged_request():
+    async def scenario():
+        slow, fast = StubReplica("r0", latency=10), StubReplica("r1")
+        pool = await start_pool([slow, fast], balancing="least", hedge_percentile=90)
+
+        # the 90th percentile of the latencies of the path is 20 ms
+        pool.latencies[PATH].extend([0.001] * HEDGE_MIN_SAMPLES + [0.02] * 3)
+        assert pool.hedge_delay("POST", PATH) == 0.02
+        assert pool.hedge_delay("GET", PATH) is None
+
+        try:
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+
+            assert await pool.post(PATH) == {"replica": "r1"}
+            assert loop.time() - start < 1
+
+            # the losing request is cancelled
+            await asyncio.sleep(0)
+        finally:
+            await pool.close()
+
+        assert (pool.hedges, pool.hedge_wins) == (1, 1)
+        assert (slow.posts, slow.cancelled, fast.posts) == (1, 1, 1)
+        assert [replica.outstanding for replica in pool.replicas] == [0, 0]
+
+    run_scenario(scenario)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Annotations of the responses of the API gateways (api.py, api_for_openplatform.py), built from the
+compact columnar annotations of the model server (see wsgi.frontend.get_compact_doc_data).
+"""
+from typing import List, Optional
+
+from pydantic import Field
+from pydantic.dataclasses import dataclass
+
+
+@dataclass
+class Span:
+    start: int = Field(
+        ..., title="The index of the first character of the span in the document"
+    )
+    end: int = Field(
+        ..., title="The index of the first character after the span in the document"
+    )
+
+
+@dataclass
+class Entity:
+    id: str = Field(..., title="The ID of the predicted entity")
+    type: str = Field(..., title="The entity type of the predicted entity")
+    span: Span = Field(
+        ..., title="The position of the predicted entity in the document"
+    )
+    text: str = Field(..., title="The mention text of the predicted entity")
+
+
+@dataclass
+class LinkedEntity(Entity):
+    concept_id: Optional[str] = Field(
+        None, title="The UMLS concept ID linked to the predicted entity mention"
+    )
+    concept_name: Optional[str] = Field(
+        None, title="The UMLS canonical name corresponding to the UMLS concept ID"
+    )
+
+
+@dataclass
+class Relation:
+    id: str = Field(..., title="The ID of the predicted relation")
+    type: str = Field(..., title="The relation type of the predicted relation")
+    left_arg_id: str = Field(
+        ...,
+        title="The entity ID serving as the left argument of the predicted relation",
+    )
+    right_arg_id: str = Field(
+        ...,
+        title="The entity ID serving as the right argument of the predicted relation",
+    )
+
+
+@dataclass
+class EventArgument:
+    arg_role: str = Field(..., title="The role of the argument")
+    arg_id: str = Field(..., title="The entity or event ID serving as the argument")
+
+
+@dataclass
+class Modality:
+    id: str = Field(..., title="The ID of the predicted modality")
+    type: str = Field(..., title="The modality type of the predicted modality")
+
+
+@dataclass
+class Event:
+    id: str = Field(..., title="The ID of the predicted event")
+    trigger_id: str = Field(..., title="The trigger ID of the predicted event")
+    args: List[EventArgument] = Field(
+        ..., title="The list of arguments of the predicted event"
+    )
+    modalities: List[Modality] = Field(
+        [], title="The list of modalities of the predicted event"
+    )
+
+
+def build_annotations(doc, annotations):
+    entity_columns = annotations["entities"]
+
+    entities = [
+        LinkedEntity(entity_id, entity_type, Span(start, end), doc[start:end])
+        for entity_id, entity_type, start, end in zip(
+            entity_columns["ids"],
+            entity_columns["types"],
+            entity_columns["starts"],
+            entity_columns["ends"],
+        )
+    ]
+
+    id_entities = {entity.id: entity for entity in entities}
+
+    normalization_columns = annotations["normalizations"]
+
+    for entity_id, concept_id, concept_name in zip(
+        normalization_columns["targets"],
+        normalization_columns["refids"],
+        normalization_columns["names"],
+    ):
+        entity = id_entities[entity_id]
+
+        entity.concept_id = concept_id
+        entity.concept_name = concept_name
+
+    relation_columns = annotations["relations"]
+
+    relations = [
+        Relation(*relation)
+        for relation in zip(
+            relation_columns["ids"],
+            relation_columns["types"],
+            relation_columns["left_arg_ids"],
+            relation_columns["right_arg_ids"],
+        )
+    ]
+
+    event_columns = annotations["events"]
+    arg_offsets = event_columns["arg_offsets"]
+
+    events = [
+        Event(
+            event_id,
+            trigger_id,
+            [
+                EventArgument(arg_role, arg_id)
+                for arg_role, arg_id in zip(
+                    event_columns["arg_roles"][arg_start:arg_end],
+                    event_columns["arg_ids"][arg_start:arg_end],
+                )
+            ],
+            [],
+        )
+        for event_id, trigger_id, arg_start, arg_end in zip(
+            event_columns["ids"],
+            event_columns["trigger_ids"],
+            arg_offsets,
+            arg_offsets[1:],
+        )
+    ]
+
+    id_events = {event.id: event for event in events}
+
+    attribute_columns = annotations["attributes"]
+
+    for attribute_id, attribute_type, attribute_target in zip(
+        attribute_columns["ids"],
+        attribute_columns["types"],
+        attribute_columns["targets"],
+    ):
+        id_events[attribute_target].modalities.append(
+            Modality(attribute_id, attribute_type)
+        )
+
+    return {
+        "text": doc,
+        "entities": entities,
+        "relations": relations,
+        "events": events,
+        "token_boundaries": [
+            Span(start, end)
+            for start, end in zip(
+                annotations["tokens"]["starts"], annotations["tokens"]["ends"]
+            )
+        ],
+        "sentence_boundaries": [
+            Span(start, end)
+            for start, end in zip(
+                annotations["sentences"]["starts"], annotations["sentences"]["ends"]
+            )
+        ],
+    }
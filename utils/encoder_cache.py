@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+LRU cache of the BERT encodings of sentences, for prediction.
+
+Abstracts repeat sentences (templates, section headings, copyright lines) and edited documents are
+re-annotated, the encodings of the sentences already seen are reused. An entry is keyed by the
+fingerprint of the encoder and the subword ids of the sentence, and holds the hidden states of its
+real tokens and its pooled output, optionally stored as float16. The cache is bounded in bytes, the
+least recently used entries are evicted first.
+
+The hidden states of a sentence do not depend on the other sentences of its batch (the padding is
+masked), so a batch is assembled from the cached sentences and the encodings of the others.
+"""
+import collections
+import hashlib
+import itertools
+import threading
+
+import torch
+
+
+def model_fingerprint(module, *extra, samples=1024):
+    """Hash of the names, shapes, dtypes and of a strided sample of the values of the weights of a module."""
+    digest = hashlib.sha1()
+
+    for value in extra:
+        digest.update(repr(value).encode())
+
+    for name, tensor in itertools.chain(module.named_parameters(), module.named_buffers()):
+        flat = tensor.detach().flatten()
+        step = max(1, flat.numel() // samples)
+
+        digest.update(name.encode())
+        digest.update(repr((tuple(tensor.shape), tensor.dtype)).encode())
+        digest.update(flat[::step].float().cpu().numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+class EncoderCache(object):
+    """
+    Byte-capped LRU cache of (token hidden states, pooled output) by (fingerprint, subword ids).
+
+    The entries stay on the device of the encoder. With `fp16`, they are stored as float16 and cast
+    back to the dtype of the encoder when read. The cache is shared by the threads of the model server,
+    its reads and writes are serialized by a lock.
+    """
+
+    def __init__(self, max_bytes, fp16=False):
+        self.max_bytes = max_bytes
+        self.fp16 = fp16
+
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry
+
+    def put(self, key, token_states, pooled_output):
+        if self.fp16:
+            token_states = token_states.half()
+            pooled_output = pooled_output.half()
+
+        # a copy, so that the entry does not keep the whole batch alive
+        entry = (token_states.clone(), pooled_output.clone())
+        size = self._size(entry)
+
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self._size(self.entries.pop(key))
+
+            while self.entries and self.bytes + size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                evicted_size = self._size(evicted)
+
+                self.bytes -= evicted_size
+                self.evictions += 1
+                self.evicted_bytes += evicted_size
+
+            self.entries[key] = entry
+            self.bytes += size
+
+    @staticmethod
+    def _size(entry):
+        return sum(tensor.numel() * tensor.element_size() for tensor in entry)
+
+    def encode(self, fingerprint, input_ids, attention_mask, encode, dtype):
+        """
+        Hidden states (B, S, H) and pooled outputs (B, H) of a batch, the padding tokens are zeros.
+
+        :param encode: function (input_ids, attention_mask) -> (hidden states, pooled outputs), called once
+            on the sentences missing from the cache
+        :param dtype: dtype of the outputs
+        """
+        masks = attention_mask.bool()
+        lengths = masks.sum(dim=1).tolist()
+
+        keys = [(fingerprint, tuple(ids[mask].tolist())) for ids, mask in zip(input_ids, masks)]
+        entries = [self.get(key) for key in keys]
+
+        # encode the misses in one batch, cut to their longest sentence
+        misses = [xx for xx, entry in enumerate(entries) if entry is None]
+
+        if misses:
+            miss_length = max(lengths[xx] for xx in misses)
+            miss_ids = torch.tensor(misses, dtype=torch.long, device=input_ids.device)
+
+            miss_states, miss_pooled = encode(input_ids[miss_ids, :miss_length],
+                                              attention_mask[miss_ids, :miss_length])
+
+            for xx, token_states, pooled_output in zip(misses, miss_states, miss_pooled):
+                entries[xx] = (token_states[masks[xx, :miss_length]], pooled_output)
+                self.put(keys[xx], *entries[xx])
+
+        hidden_size = entries[0][0].shape[-1]
+        hidden_states = torch.zeros(masks.shape + (hidden_size,), dtype=dtype, device=input_ids.device)
+        pooled_outputs = torch.zeros((masks.shape[0], hidden_size), dtype=dtype, device=input_ids.device)
+
+        for xx, (token_states, pooled_output) in enumerate(entries):
+            hidden_states[xx][masks[xx]] = token_states.to(dtype)
+            pooled_outputs[xx] = pooled_output.to(dtype)
+
+        return hidden_states, pooled_outputs
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Flat tensor files for serving.
+
+Layout:
+    - 8 bytes: little-endian unsigned length of the JSON header
+    - JSON header, padded with spaces up to ALIGNMENT
+    - raw tensor blobs, each one starting at an ALIGNMENT boundary
+
+The header maps every tensor name to its dtype, shape and offset (relative to the
+beginning of the blobs), plus an optional "__metadata__" entry.
+
+Loading memory-maps the file and creates the tensors directly on top of the mapping,
+so nothing is copied and the processes on the same host share the weights through
+the page cache.
+"""
+import functools
+import json
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+ALIGNMENT = 64
+
+METADATA_KEY = "__metadata__"
+
+HEADER_SIZE_FORMAT = "<Q"
+HEADER_SIZE_LENGTH = struct.calcsize(HEADER_SIZE_FORMAT)
+
+_TORCH_TO_NUMPY_DTYPES = {
+    torch.float64: np.float64,
+    torch.float32: np.float32,
+    torch.float16: np.float16,
+    torch.int64: np.int64,
+    torch.int32: np.int32,
+    torch.int16: np.int16,
+    torch.int8: np.int8,
+    torch.uint8: np.uint8,
+    torch.bool: np.bool_,
+}
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_flat_tensors(state_dict, filename, metadata=None):
+    """Write a state dict (name -> tensor) to a flat tensor file."""
+    arrays = OrderedDict()
+    header = OrderedDict()
+
+    if metadata is not None:
+        header[METADATA_KEY] = metadata
+
+    offset = 0
+
+    for name, tensor in state_dict.items():
+        if tensor.dtype not in _TORCH_TO_NUMPY_DTYPES:
+            raise ValueError("Unsupported dtype {} for tensor {}".format(tensor.dtype, name))
+
+        array = tensor.detach().cpu().contiguous().numpy()
+
+        offset = _align(offset)
+
+        header[name] = {
+            "dtype": array.dtype.name,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+
+        arrays[name] = array
+
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (_align(HEADER_SIZE_LENGTH + len(header_bytes)) - HEADER_SIZE_LENGTH - len(header_bytes))
+
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    # Write to a temporary file first so that running servers never map a partial file
+    tmp_filename = filename + ".tmp"
+
+    with open(tmp_filename, "wb") as f:
+        f.write(struct.pack(HEADER_SIZE_FORMAT, len(header_bytes)))
+        f.write(header_bytes)
+
+        data_start = f.tell()
+
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]["offset"])
+            f.write(array.tobytes())
+
+    os.replace(tmp_filename, filename)
+
+
+def read_flat_header(filename):
+    """Read the header of a flat tensor file, returns (header, data_start)."""
+    with open(filename, "rb") as f:
+        header_size, = struct.unpack(HEADER_SIZE_FORMAT, f.read(HEADER_SIZE_LENGTH))
+        header = json.loads(f.read(header_size).decode("utf-8"), object_pairs_hook=OrderedDict)
+
+    return header, HEADER_SIZE_LENGTH + header_size
+
+
+def load_flat_tensors(filename):
+    """
+    Memory-map a flat tensor file and return (state_dict, metadata).
+    The tensors are views of the mapping (copy-on-write), no data is read until used.
+    """
+    header, data_start = read_flat_header(filename)
+
+    metadata = header.pop(METADATA_KEY, None)
+
+    state_dict = OrderedDict()
+
+    if os.path.getsize(filename) == data_start:
+        buffer = np.zeros(0, dtype=np.uint8)
+    else:
+        buffer = np.memmap(filename, dtype=np.uint8, mode="c", offset=data_start)
+
+    for name, info in header.items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        start = info["offset"]
+        end = start + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+        array = buffer[start:end].view(dtype).reshape(shape)
+
+        state_dict[name] = torch.from_numpy(array)
+
+    return state_dict, metadata
+
+
+def assign_flat_tensors(model, state_dict, device=None):
+    """
+    Make the parameters and buffers of the model point to the given tensors.
+    Unlike load_state_dict, the memory-mapped storage is reused on CPU instead of copied.
+    """
+    device = torch.device(device) if device is not None else torch.device("cpu")
+
+    if device.type != "cpu":
+        model.load_state_dict(state_dict)
+        return model
+
+    own_state = model.state_dict(keep_vars=True)
+
+    missing_keys = [key for key in own_state if key not in state_dict]
+    unexpected_keys = [key for key in state_dict if key not in own_state]
+
+    if missing_keys or unexpected_keys:
+        raise RuntimeError(
+            "Error(s) in assigning flat tensors to {}:\n\tMissing keys: {}\n\tUnexpected keys: {}".format(
+                model.__class__.__name__, missing_keys, unexpected_keys))
+
+    with torch.no_grad():
+        for key, tensor in state_dict.items():
+            module_name, _, attr = key.rpartition(".")
+            module = functools.reduce(getattr, module_name.split("."), model) if module_name else model
+            current = own_state[key]
+
+            if current.shape != tensor.shape:
+                raise RuntimeError("Size mismatch for {}: {} in the file, {} in the model".format(
+                    key, tuple(tensor.shape), tuple(current.shape)))
+
+            tensor = tensor.to(current.dtype)
+
+            if attr in module._parameters:
+                module._parameters[attr].data = tensor
+            else:
+                module._buffers[attr] = tensor
+
+    return model
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Background jobs of the API gateway (api.py), for the documents too long to be annotated while the
+client waits.
+
+A job is submitted, then its status and its result are polled by id. At most `concurrency` jobs
+run at the same time, the others wait in submission order, and at most `max_jobs` jobs can be
+waiting or running. A job can be cancelled at any time. The finished jobs (done, failed or
+cancelled) are kept `ttl` seconds, then forgotten, and at most `max_finished` of them are kept:
+the ones that finished first are forgotten first, so that the results held in memory stay bounded.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, task, owner):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.owner = owner
+
+        self.status = QUEUED
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+        self.result = None
+        self.error = None
+
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+
+
+class JobQueue:
+    def __init__(self, concurrency, ttl, max_jobs, max_finished):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_finished = max_finished
+
+        # Created in the event loop of the app
+        self.semaphore = None
+
+        # job id -> job, in submission order
+        self.jobs = OrderedDict()
+
+    def stats(self):
+        statuses = [job.status for job in self.jobs.values()]
+
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING) + FINISHED}
+
+    def submit(self, task, owner, run):
+        """
+        Submits a job, `await run()` gives its result. Raises JobQueueFull if `max_jobs` jobs are
+        already waiting or running.
+        """
+        self.purge()
+
+        if sum(not job.finished for job in self.jobs.values()) >= self.max_jobs:
+            raise JobQueueFull()
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        job = Job(task, owner)
+        job.future = asyncio.ensure_future(self.run(job, run))
+
+        self.jobs[job.id] = job
+
+        return job
+
+    async def run(self, job, run):
+        try:
+            async with self.semaphore:
+                job.status = RUNNING
+                result = await run()
+        except asyncio.CancelledError:
+            job.finish(CANCELLED)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.finish(FAILED, error=e)
+        else:
+            job.finish(DONE, result=result)
+
+        self.purge()
+
+    def get(self, job_id):
+        self.purge()
+
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancels a job that is waiting or running, returns the job (None if unknown)."""
+        job = self.get(job_id)
+
+        if job is not None and not job.finished:
+            job.future.cancel()
+            # Set now, the job is only cancelled at its next await
+            job.finish(CANCELLED)
+
+            self.purge()
+
+        return job
+
+    def purge(self):
+        now = time.time()
+
+        finished_jobs = []
+
+        for job_id, job in list(self.jobs.items()):
+            if job.finished:
+                if job.finished_at + self.ttl <= now:
+                    del self.jobs[job_id]
+                else:
+                    finished_jobs.append(job)
+
+        # The jobs that finished first are forgotten first
+        finished_jobs.sort(key=lambda job: job.finished_at)
+
+        for job in finished_jobs[:max(0, len(finished_jobs) - self.max_finished)]:
+            del self.jobs[job.id]
+
+    def close(self):
+        for job in self.jobs.values():
+            if not job.finished:
+                job.future.cancel()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Inference precision modes for CPU serving.
+
+    - float32: unchanged model
+    - int8: dynamic int8 quantization of the nn.Linear layers (weights quantized once,
+      activations quantized on the fly)
+    - bfloat16: forward pass under CPU autocast, outputs cast back to float32
+
+The mode is applied once, after the weights have been loaded.
+"""
+import functools
+import logging
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+FLOAT32 = "float32"
+INT8 = "int8"
+BFLOAT16 = "bfloat16"
+
+PRECISIONS = (FLOAT32, INT8, BFLOAT16)
+
+
+def bfloat16_supported():
+    """Whether CPU autocast to bfloat16 is available in PyTorch and supported by the CPU."""
+    if not hasattr(torch, "cpu") or not hasattr(torch.cpu, "amp"):
+        return False
+
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _to_float32(output):
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.dtype == torch.bfloat16 else output
+    if isinstance(output, dict):
+        return output.__class__((key, _to_float32(value)) for key, value in output.items())
+    if isinstance(output, (list, tuple)) and not hasattr(output, "_fields"):
+        return output.__class__(_to_float32(value) for value in output)
+    return output
+
+
+def _autocast_forward(forward):
+    @functools.wraps(forward)
+    def wrapper(*args, **kwargs):
+        with torch.cpu.amp.autocast(dtype=torch.bfloat16):
+            output = forward(*args, **kwargs)
+
+        # Downstream code converts outputs to numpy, which has no bfloat16
+        return _to_float32(output)
+
+    return wrapper
+
+
+def apply_precision(model, precision=FLOAT32, device=None):
+    """
+    Apply an inference precision mode to a loaded model (in place when possible) and return it.
+    Only CPU models are converted, the other ones are returned unchanged.
+    """
+    precision = precision or FLOAT32
+
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision {}, expected one of {}".format(precision, PRECISIONS))
+
+    if precision == FLOAT32:
+        return model
+
+    device = torch.device(device) if device is not None else next(model.parameters()).device
+
+    if device.type != "cpu":
+        logger.warning("Precision %s is only applied on CPU, keeping float32 on %s", precision, device)
+        return model
+
+    model.eval()
+
+    if precision == INT8:
+        return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    if not bfloat16_supported():
+        logger.warning("bfloat16 autocast is not supported on this CPU/PyTorch, keeping float32")
+        return model
+
+    model.forward = _autocast_forward(model.forward)
+
+    return model
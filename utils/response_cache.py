@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache of the API gateway (api.py), in front of the model server.
+
+The entries are the annotations returned by the model server, by task, model version and SHA-256
+of the text. The text is hashed as it is: the annotations hold character offsets and the text
+itself, so any normalization (whitespace, Unicode) would change the response.
+
+    - memory tier: the most recently used entries, up to a number of entries
+    - disk tier (optional): the entries evicted from memory, in a SqliteDict
+
+Both tiers drop the entries older than the TTL. Concurrent requests for an entry missing from memory
+share a single disk lookup and upstream call (single-flight). The lookup and the call run in their
+own task: a request that is cancelled (client gone, batch dropped, job deleted) leaves them to the
+other requests, they are only cancelled with the last of them.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from sqlitedict import SqliteDict
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """An upstream call in flight and the number of requests waiting for it."""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResponseCache:
+    def __init__(self, ttl, max_entries, disk_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # key -> (expiry time, annotations)
+        self.memory = OrderedDict()
+        self.disk = (
+            SqliteDict(filename=disk_path, tablename="responses", autocommit=True)
+            if disk_path
+            else None
+        )
+
+        # key -> upstream call in flight
+        self.inflight = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(task, text, version):
+        return "{}:{}:{}".format(
+            task, version, hashlib.sha256(text.encode("UTF-8")).hexdigest()
+        )
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits + self.coalesced
+        lookups = hits + self.misses
+
+        return {
+            "memory_entries": len(self.memory),
+            "max_memory_entries": self.max_entries,
+            "disk": self.disk is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    async def get_or_fetch(self, key, fetch, read=True, write=True):
+        """
+        The cached annotations of the key, or the ones of `await fetch()`.
+
+        :param read: whether the cache can answer, else the upstream is always called
+        :param write: whether the annotations of the upstream are stored
+        """
+        if read:
+            value = self._get_memory(key)
+
+            if value is not None:
+                self.memory_hits += 1
+                return value
+
+            if key in self.inflight:
+                self.coalesced += 1
+                return await self._wait(self.inflight[key])
+        else:
+            self.bypassed += 1
+
+        # Registered before any await (the disk lookup included), the identical requests arriving
+        # meanwhile wait for this flight
+        flight = Flight(asyncio.ensure_future(self._load(key, fetch, read, write)))
+
+        if read:
+            self.inflight[key] = flight
+
+        flight.task.add_done_callback(lambda task: self._land(key, flight))
+
+        return await self._wait(flight)
+
+    async def _load(self, key, fetch, read, write):
+        """The annotations of the disk tier, else of the upstream, stored before the waiting requests resume."""
+        if read and self.disk is not None:
+            entry = await run_in_threadpool(self._get_disk, key)
+
+            if entry is not None:
+                self.disk_hits += 1
+                self._put_memory(key, *entry)
+                return entry[1]
+
+        if read:
+            self.misses += 1
+
+        value = await fetch()
+
+        if write:
+            self._put_memory(key, time.time() + self.ttl, value)
+
+        return value
+
+    @staticmethod
+    async def _wait(flight):
+        flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # The call goes on for the other requests, nobody needs it after the last one
+            if flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _land(self, key, flight):
+        if self.inflight.get(key) is flight:
+            del self.inflight[key]
+
+        # Retrieved here, the requests waiting for the call (if any) raise the exception
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _get_memory(self, key):
+        entry = self.memory.get(key)
+
+        if entry is None:
+            return None
+
+        expiry, value = entry
+
+        if expiry <= time.time():
+            del self.memory[key]
+            return None
+
+        self.memory.move_to_end(key)
+
+        return value
+
+    def _get_disk(self, key):
+        entry = self.disk.get(key)
+
+        if entry is None:
+            return None
+
+        if entry[0] <= time.time():
+            del self.disk[key]
+            return None
+
+        return entry
+
+    def _put_memory(self, key, expiry, value):
+        self.memory[key] = (expiry, value)
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.max_entries:
+            evicted_key, evicted_entry = self.memory.popitem(last=False)
+            self.evictions += 1
+
+            # The writes of SqliteDict are queued to its own thread
+            if self.disk is not None:
+                self.disk[evicted_key] = evicted_entry
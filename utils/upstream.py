@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+Async HTTP client of the API gateways (api.py, api_for_openplatform.py) to the model server.
+
+One client is kept per upstream for the lifetime of the app: the connections are pooled and kept
+alive, their number is bounded, and the requests that fail before the model server could answer
+(connection errors, dropped keep-alive connections, 502/503/504) are retried a bounded number of
+times with an exponential backoff. The annotation requests have no side effects, so a retry never
+annotates a document twice in a way that matters.
+
+UpstreamPool spreads the requests over several replicas of the model server, one client each:
+
+    - each request goes to the least loaded of two random replicas (power of two choices), or to
+      the least loaded of all of them, by number of requests in flight
+    - a replica runs at most UPSTREAM_REPLICA_CONCURRENCY requests at a time, the others wait
+    - a replica is ejected after UPSTREAM_EJECT_FAILURES failures in a row or a failed health
+      check (GET /health every UPSTREAM_HEALTH_INTERVAL seconds), and back in once a health check
+      succeeds; if all of them are ejected, all of them are used
+    - a failed request is retried on another replica
+    - with UPSTREAM_HEDGE_PERCENTILE, a POST still unanswered after that percentile of the latency
+      of its path is sent to a second replica as well, the first answer wins
+
+The settings are read from the environment:
+
+    UPSTREAM_MAX_CONNECTIONS        connections to a model server (default 100)
+    UPSTREAM_MAX_KEEPALIVE          idle connections kept alive (default 20)
+    UPSTREAM_TIMEOUT                seconds to wait for an annotation (default 300)
+    UPSTREAM_CONNECT_TIMEOUT        seconds to wait for a connection (default 10)
+    UPSTREAM_RETRIES                retries of a failed request (default 2)
+    UPSTREAM_BALANCING              p2c or least (default p2c)
+    UPSTREAM_REPLICA_CONCURRENCY    requests in flight per replica (default 64)
+    UPSTREAM_EJECT_FAILURES         failures in a row that eject a replica (default 3)
+    UPSTREAM_HEALTH_INTERVAL        seconds between health checks, 0 for none (default 10)
+    UPSTREAM_HEDGE_PERCENTILE       latency percentile of the hedged requests, 0 for none (default 0)
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import defaultdict, deque
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", 20))
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 300))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 10))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 2))
+UPSTREAM_BALANCING = os.environ.get("UPSTREAM_BALANCING", "p2c")
+UPSTREAM_REPLICA_CONCURRENCY = int(os.environ.get("UPSTREAM_REPLICA_CONCURRENCY", 64))
+UPSTREAM_EJECT_FAILURES = int(os.environ.get("UPSTREAM_EJECT_FAILURES", 3))
+UPSTREAM_HEALTH_INTERVAL = float(os.environ.get("UPSTREAM_HEALTH_INTERVAL", 10))
+UPSTREAM_HEDGE_PERCENTILE = float(os.environ.get("UPSTREAM_HEDGE_PERCENTILE", 0))
+
+# The latencies kept per path, and the number needed before hedging its requests
+HEDGE_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+RETRY_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class UpstreamClient:
+    def __init__(
+        self,
+        base_url,
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive=UPSTREAM_MAX_KEEPALIVE,
+        timeout=UPSTREAM_TIMEOUT,
+        connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+        retries=UPSTREAM_RETRIES,
+        backoff=0.5,
+    ):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.client = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url, limits=self.limits, timeout=self.timeout
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def request(self, method, path, **kwargs):
+        """Send a request to the upstream and return the decoded JSON, raises httpx.HTTPError on failure."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+
+                logger.warning(
+                    "%s%s answered %d, retrying (%d/%d)",
+                    self.base_url, path, response.status_code, attempt + 1, self.retries,
+                )
+            except RETRY_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+
+                logger.warning(
+                    "%s%s failed: %r, retrying (%d/%d)",
+                    self.base_url, path, e, attempt + 1, self.retries,
+                )
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+
+def is_retryable(error):
+    return isinstance(error, RETRY_ERRORS) or (
+        isinstance(error, httpx.HTTPStatusError)
+        and error.response.status_code in RETRY_STATUS_CODES
+    )
+
+
+class Replica:
+    def __init__(self, client, max_concurrency):
+        self.client = client
+        self.max_concurrency = max_concurrency
+
+        # Created in the event loop of the app
+        self.semaphore = None
+
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def stats(self):
+        return {
+            "base_url": self.client.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+        }
+
+
+class UpstreamPool:
+    """Same interface as UpstreamClient, over several replicas of the model server."""
+
+    def __init__(
+        self,
+        base_urls,
+        balancing=UPSTREAM_BALANCING,
+        replica_concurrency=UPSTREAM_REPLICA_CONCURRENCY,
+        retries=UPSTREAM_RETRIES,
+        backoff=0.5,
+        eject_failures=UPSTREAM_EJECT_FAILURES,
+        health_interval=UPSTREAM_HEALTH_INTERVAL,
+        health_path="/health",
+        hedge_percentile=UPSTREAM_HEDGE_PERCENTILE,
+        **client_kwargs
+    ):
+        if balancing not in ("p2c", "least"):
+            raise ValueError(f"Unknown balancing: {balancing}")
+
+        # The pool retries, on another replica
+        self.replicas = [
+            Replica(UpstreamClient(base_url, retries=0, **client_kwargs), replica_concurrency)
+            for base_url in base_urls
+        ]
+        self.balancing = balancing
+        self.retries = retries
+        self.backoff = backoff
+        self.eject_failures = eject_failures
+        self.health_interval = health_interval
+        self.health_path = health_path
+        self.hedge_percentile = hedge_percentile
+
+        # path -> latencies of its last successful requests
+        self.latencies = defaultdict(lambda: deque(maxlen=HEDGE_WINDOW))
+
+        self.hedges = 0
+        self.hedge_wins = 0
+
+        self.health_task = None
+
+    def stats(self):
+        return {
+            "balancing": self.balancing,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+    async def start(self):
+        for replica in self.replicas:
+            replica.semaphore = asyncio.Semaphore(replica.max_concurrency)
+            await replica.client.start()
+
+        if self.health_interval > 0:
+            self.health_task = asyncio.ensure_future(self.check_health())
+
+    async def close(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+        for replica in self.replicas:
+            await replica.client.close()
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def request(self, method, path, **kwargs):
+        """Send a request to a replica and return the decoded JSON, raises httpx.HTTPError on failure."""
+        failed = None
+
+        for attempt in range(self.retries + 1):
+            replica = self.choose(exclude=failed)
+
+            try:
+                return await self.hedge(replica, method, path, kwargs)
+            except httpx.HTTPError as e:
+                if not is_retryable(e) or attempt == self.retries:
+                    raise
+
+                logger.warning(
+                    "%s%s failed: %r, retrying (%d/%d)",
+                    replica.client.base_url, path, e, attempt + 1, self.retries,
+                )
+                failed = replica
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def choose(self, exclude=None):
+        candidates = [
+            replica
+            for replica in self.replicas
+            if replica.healthy and replica is not exclude
+        ]
+
+        # Fail open: an excluded or ejected replica is better than none
+        if not candidates:
+            candidates = [replica for replica in self.replicas if replica is not exclude]
+
+        if not candidates:
+            candidates = self.replicas
+
+        if self.balancing == "p2c" and len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+
+        return min(candidates, key=lambda replica: replica.outstanding)
+
+    def hedge_delay(self, method, path):
+        latencies = self.latencies[path]
+
+        if (
+            method != "POST"
+            or self.hedge_percentile <= 0
+            or len(self.replicas) < 2
+            or len(latencies) < HEDGE_MIN_SAMPLES
+        ):
+            return None
+
+        latencies = sorted(latencies)
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    async def hedge(self, replica, method, path, kwargs):
+        delay = self.hedge_delay(method, path)
+
+        if delay is None:
+            return await self.send(replica, method, path, kwargs)
+
+        first = asyncio.ensure_future(self.send(replica, method, path, kwargs))
+        pending = {first}
+
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+
+            if done:
+                return first.result()
+
+            second_replica = self.choose(exclude=replica)
+
+            if second_replica is replica:
+                return await first
+
+            self.hedges += 1
+            pending.add(
+                asyncio.ensure_future(self.send(second_replica, method, path, kwargs))
+            )
+
+            error = None
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    if future.exception() is None:
+                        if future is not first:
+                            self.hedge_wins += 1
+
+                        return future.result()
+
+                    error = error or future.exception()
+
+            raise error
+        finally:
+            # The slower request, or both if the caller went away
+            for future in pending:
+                future.cancel()
+
+    async def send(self, replica, method, path, kwargs):
+        replica.outstanding += 1
+
+        try:
+            async with replica.semaphore:
+                start = time.perf_counter()
+                result = await replica.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            replica.requests += 1
+            replica.errors += 1
+
+            if is_retryable(e):
+                self.report_failure(replica)
+
+            raise
+        finally:
+            replica.outstanding -= 1
+
+        replica.requests += 1
+        replica.failures = 0
+        self.latencies[path].append(time.perf_counter() - start)
+
+        return result
+
+    def report_failure(self, replica):
+        replica.failures += 1
+
+        if replica.healthy and replica.failures >= self.eject_failures:
+            logger.warning(
+                "%s failed %d times in a row, ejected", replica.client.base_url, replica.failures
+            )
+            replica.healthy = False
+            replica.ejections += 1
+
+    async def check_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+
+            for replica in self.replicas:
+                try:
+                    response = await replica.client.client.get(
+                        self.health_path, timeout=replica.client.timeout.connect
+                    )
+                    response.raise_for_status()
+                    healthy = True
+                except httpx.HTTPError:
+                    healthy = False
+
+                if healthy and not replica.healthy:
+                    logger.warning("%s is healthy, back in", replica.client.base_url)
+                    replica.failures = 0
+                elif replica.healthy and not healthy:
+                    logger.warning("%s failed its health check, ejected", replica.client.base_url)
+                    replica.ejections += 1
+
+                replica.healthy = healthy
@@ -382,6 +382,55 @@ def padding_samples(ids_, token_mask_, attention_mask_, span_indices_, span_labe
     return max_span_labels
 
 
+def pad_rows(rows, length, value):
+    """Stack 1-d arrays of different lengths in a (number of rows, length) array, padded with value."""
+    padded = np.full((len(rows), length), value, dtype=np.int64)
+    for idx, row in enumerate(rows):
+        padded[idx, :len(row)] = row
+
+    return padded
+
+
+def padding_inputs(tokens_, ids_, token_mask_, attention_mask_, span_indices_, entity_masks_, trigger_masks_,
+                   params):
+    """Padding of the model inputs only, without the gold labels (see get_inference_tensors)."""
+    # count max lengths:
+    max_seq = 0
+    for ids in ids_:
+        max_seq = max(max_seq, len(ids))
+
+    # one entity mask per span, as many as the span labels
+    max_span_labels = 0
+    for entity_masks in entity_masks_:
+        max_span_labels = max(max_span_labels, len(entity_masks))
+
+    for idx, (ids, token_mask, attention_mask, span_indices, entity_masks, trigger_masks) in enumerate(
+            zip(ids_, token_mask_, attention_mask_, span_indices_, entity_masks_, trigger_masks_)):
+        padding_size = max_seq - len(ids)
+
+        # for lstm
+        if tokens_:
+            tokens_[idx] += ["<pad>"] * padding_size
+
+        # Zero-pad up to the sequence length
+        ids += [0] * padding_size
+        token_mask += [0] * padding_size
+        attention_mask += [0] * padding_size
+
+        # Padding for span indices and masks
+        num_padding_spans = max_span_labels - len(entity_masks)
+
+        span_indices += [(-1, -1)] * (num_padding_spans * params["ner_label_limit"])
+        entity_masks += [-1] * num_padding_spans
+        trigger_masks += [-1] * num_padding_spans
+
+        assert len(ids) == max_seq
+        assert len(span_indices) == max_span_labels * params["ner_label_limit"]
+        assert len(trigger_masks) == max_span_labels
+
+    return max_span_labels
+
+
 def partialize_optimizer_models_parameters(model):
     """
     Partialize entity, relation and event models parameters from optimizer's parameters
@@ -447,7 +496,10 @@ def prepare_optimizer_parameters(optimizer, rel_params, ev_params, conf_params,
         pass
 
 
-def get_tensors(data_ids, data, params):
+def get_tensors(data_ids, data, params, inference=False):
+    if inference:
+        return get_inference_tensors(data_ids, data, params)
+
     # for lstm
     if params['use_lstm']:
         tokens = [
@@ -621,6 +673,85 @@ def get_tensors(data_ids, data, params):
     )
 
 
+def is_inference(params):
+    """Prediction on raw text: no gold annotation exists, so none has to be loaded, aligned or scored."""
+    return params.get('inference', False) and params['predict'] and not params['gold_eval'] \
+           and not params['pipelines'] and not params.get('gold_entities', False)
+
+
+def get_inference_tensors(data_ids, data, params):
+    """
+    Same as get_tensors for the inference path: only the model inputs are gathered and padded,
+    the gold labels and truth structures are left out (None).
+    """
+    data_ids = data_ids[0].tolist()
+
+    # for lstm
+    if params['use_lstm']:
+        tokens = [copy.copy(data["nn_data"]["tokens"][data_id]) for data_id in data_ids]
+    else:
+        tokens = []
+
+    # the inputs are padded in place, shallow copies of the lists are enough
+    ids = [copy.copy(data["nn_data"]["ids"][data_id]) for data_id in data_ids]
+    token_masks = [copy.copy(data["nn_data"]["token_mask"][data_id]) for data_id in data_ids]
+    attention_masks = [copy.copy(data["nn_data"]["attention_mask"][data_id]) for data_id in data_ids]
+    span_indices = [copy.copy(data["nn_data"]["span_indices"][data_id]) for data_id in data_ids]
+    entity_masks = [copy.copy(data["nn_data"]["entity_masks"][data_id]) for data_id in data_ids]
+    trigger_masks = [copy.copy(data["nn_data"]["trigger_masks"][data_id]) for data_id in data_ids]
+
+    # the span terms are rewritten by the model
+    span_terms = copy.deepcopy([data["nn_data"]["span_terms"][data_id] for data_id in data_ids])
+
+    max_span_labels = padding_inputs(
+        tokens,
+        ids,
+        token_masks,
+        attention_masks,
+        span_indices,
+        entity_masks,
+        trigger_masks,
+        params
+    )
+
+    batch_ids = torch.tensor(ids, dtype=torch.long, device=params["device"])
+    batch_token_masks = torch.tensor(
+        token_masks, dtype=torch.uint8, device=params["device"]
+    )
+    batch_attention_masks = torch.tensor(
+        attention_masks, dtype=torch.long, device=params["device"]
+    )
+    batch_span_indices = torch.tensor(
+        span_indices, dtype=torch.long, device=params["device"]
+    )
+    batch_entity_masks = torch.tensor(
+        entity_masks, dtype=torch.int8, device=params["device"]
+    )
+    batch_trigger_masks = torch.tensor(
+        trigger_masks, dtype=torch.int8, device=params["device"]
+    )
+
+    return (
+        tokens,
+        batch_ids,
+        batch_token_masks,
+        batch_attention_masks,
+        batch_span_indices,
+        None,  # span labels
+        None,  # span labels match rel
+        batch_entity_masks,
+        batch_trigger_masks,
+        None,  # gtruths
+        None,  # l2rs
+        span_terms,
+        None,  # truth evs
+        None,  # ev idxs
+        None,  # ev lbls
+        None,  # etypes
+        max_span_labels
+    )
+
+
 def save_best_fscore(current_params, last_params):
     # This means that we skip epochs having fscore <= previous fscore
     return current_params["fscore"] <= last_params["fscore"]
@@ -631,6 +762,19 @@ def save_best_loss(current_params, last_params):
     return current_params["loss"] >= last_params["loss"]
 
 
+def load_checkpoint(checkpoint_file, map_location=None):
+    """Load a checkpoint, memory-mapping the file when the installed PyTorch supports it."""
+    try:
+        return torch.load(checkpoint_file, map_location=map_location, mmap=True)
+    except TypeError:
+        # torch.load has no mmap argument before PyTorch 2.1
+        pass
+    except RuntimeError:
+        # mmap only works with the zipfile serialization format
+        pass
+    return torch.load(checkpoint_file, map_location=map_location)
+
+
 def handle_checkpoints(
         model,
         checkpoint_dir,
@@ -660,7 +804,7 @@ def handle_checkpoints(
                     last_checkpoint = previous_checkpoint
         else:
             # Load the last checkpoint for comparison
-            last_checkpoint = torch.load(checkpoint_files[0], map_location=params['device'])
+            last_checkpoint = load_checkpoint(checkpoint_files[0], map_location=params['device'])
 
         print(checkpoint_files[0])
 
@@ -707,7 +851,7 @@ def handle_checkpoints(
         # Now, we can define filter_func to save the best model
         if filter_func and len(checkpoint_files):
             # Load the last checkpoint for comparison
-            last_checkpoint = torch.load(checkpoint_files[0], map_location=params['device'])
+            last_checkpoint = load_checkpoint(checkpoint_files[0], map_location=params['device'])
 
             if timestamp <= last_checkpoint["timestamp"] or filter_func(
                     params, last_checkpoint["params"]
@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
-from annotator import DeepEMAnnotator, SemELAnnotator
+from annotator import SENTENCE_CACHE_SIZE, DeepEMAnnotator, SemELAnnotator
 from flask import Flask
 from flask_bootstrap import Bootstrap
 
 from .config import config
-from .frontend import make_frontend
+from .frontend import make_combined_frontend, make_frontend
 
 # thanks to https://github.com/mbr/flask-bootstrap
 
@@ -15,6 +15,8 @@ def create_app(configfile=None):
     app = Flask(__name__)
     Bootstrap(app)
 
+    sentence_cache_size = config.getint("sentence_cache_size", SENTENCE_CACHE_SIZE)
+
     ner_model = SemELAnnotator(
         config["ner_dir"],
         config["cg_dir"],
@@ -23,6 +25,10 @@ def create_app(configfile=None):
         config["gss_dir"],
         ".cache",
         False,
+        ner_precision=config.get("ner_precision", "float32"),
+        cg_precision=config.get("cg_precision", "float32"),
+        cr_precision=config.get("cr_precision", "float32"),
+        sentence_cache_size=sentence_cache_size,
     )
     ner_frontend = make_frontend("Named Entity Recognition", ner_model)
     app.register_blueprint(ner_frontend, url_prefix="/named_entity_recognition")
@@ -35,17 +41,39 @@ def create_app(configfile=None):
         config["gss_dir"],
         ".cache",
         True,
+        ner_precision=config.get("ner_precision", "float32"),
+        cg_precision=config.get("cg_precision", "float32"),
+        cr_precision=config.get("cr_precision", "float32"),
+        sentence_cache_size=sentence_cache_size,
     )
     el_frontend = make_frontend("Entity Linking", el_model)
     app.register_blueprint(el_frontend, url_prefix="/entity_linking")
 
-    re_model = DeepEMAnnotator(config["re_cfg"], config["gss_dir"], ".cache")
+    re_model = DeepEMAnnotator(
+        config["re_cfg"],
+        config["gss_dir"],
+        ".cache",
+        sentence_cache_size=sentence_cache_size,
+    )
     re_frontend = make_frontend("DeepEventMine: Relation Extraction", re_model)
     app.register_blueprint(re_frontend, url_prefix="/relation_extraction")
 
-    ev_model = DeepEMAnnotator(config["ev_cfg"], config["gss_dir"], ".cache")
+    ev_model = DeepEMAnnotator(
+        config["ev_cfg"],
+        config["gss_dir"],
+        ".cache",
+        sentence_cache_size=sentence_cache_size,
+    )
     ev_frontend = make_frontend("DeepEventMine: Event Extraction", ev_model)
     app.register_blueprint(ev_frontend, url_prefix="/event_extraction")
 
+    all_frontend = make_combined_frontend(el_model, re_model, ev_model)
+    app.register_blueprint(all_frontend, url_prefix="/annotate_all")
+
+    @app.route("/health")
+    def health():
+        # Used by the API gateways to eject the replicas that are down
+        return {"status": "ok"}
+
     print("Ready")
     return app
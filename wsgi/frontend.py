@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from annotator import model_version, split_document
 from flask import Blueprint, render_template, request
 from sqlitedict import SqliteDict
 from tqdm import tqdm
@@ -77,6 +79,75 @@ def get_doc_data(text, model):
     return doc_data
 
 
+def get_compact_doc_data(text, model):
+    """Columnar annotations for the API gateway, without the brat UI structures."""
+    return compact_doc_data(*model(text))
+
+
+def compact_doc_data(doc, sentence_standoffs, token_standoffs):
+    events = list(doc.get_events())
+
+    # Same entities as get_doc_data: the entities, then the trigger of each event
+    triggers = [doc.get_ann_by_id(event.trigger) for event in events]
+    trigger_ids = {trigger.id for trigger in triggers}
+    entities = [
+        ann for ann in doc.get_textbounds() if ann.id not in trigger_ids
+    ] + triggers
+
+    normalizations = list(doc.get_normalizations())
+    relations = list(doc.get_relations())
+    attributes = list(doc.get_attributes())
+
+    arg_offsets = [0]
+
+    for event in events:
+        arg_offsets.append(arg_offsets[-1] + len(event.args))
+
+    return {
+        "entities": {
+            "ids": [ann.id for ann in entities],
+            "types": [ann.type for ann in entities],
+            "starts": [min(start for start, _ in ann.spans) for ann in entities],
+            "ends": [max(end for _, end in ann.spans) for ann in entities],
+        },
+        "normalizations": {
+            "targets": [ann.target for ann in normalizations],
+            "refids": [ann.refid for ann in normalizations],
+            "names": [
+                namedb.get(ann.refid) if ann.refdb == "UMLS" else None
+                for ann in normalizations
+            ],
+        },
+        "relations": {
+            "ids": [ann.id for ann in relations],
+            "types": [ann.type for ann in relations],
+            "left_arg_ids": [ann.arg1 for ann in relations],
+            "right_arg_ids": [ann.arg2 for ann in relations],
+        },
+        "events": {
+            "ids": [ann.id for ann in events],
+            "trigger_ids": [ann.trigger for ann in events],
+            # The arguments of the i-th event are arg_offsets[i]:arg_offsets[i + 1]
+            "arg_offsets": arg_offsets,
+            "arg_roles": [role for event in events for role, _ in event.args],
+            "arg_ids": [arg_id for event in events for _, arg_id in event.args],
+        },
+        "attributes": {
+            "ids": [ann.id for ann in attributes],
+            "types": [ann.type for ann in attributes],
+            "targets": [ann.target for ann in attributes],
+        },
+        "tokens": {
+            "starts": [start for start, _ in token_standoffs],
+            "ends": [end for _, end in token_standoffs],
+        },
+        "sentences": {
+            "starts": [start for start, _ in sentence_standoffs],
+            "ends": [end for _, end in sentence_standoffs],
+        },
+    }
+
+
 def get_coll_data(visual_conf):
     norm_coll_data = [
         # [
@@ -331,6 +402,53 @@ def make_frontend(frontend_name, model):
             app_name=frontend_name,
         )
 
+    @frontend.route("/version")
+    def version():
+        # Used by the API gateway to key its response cache
+        return {"version": getattr(model, "model_version", None)}
+
+    @frontend.route("/annotate_compact", methods=["POST"])
+    def annotate_compact():
+        # Internal, for the API gateway
+        return get_compact_doc_data(request.form["text"], model)
+
+    if getattr(model, "enable_linking", False):
+
+        @frontend.route("/link_compact", methods=["POST"])
+        def link_compact():
+            # Internal, for the API gateway: links the mentions of the client, without NER
+            data = request.get_json()
+
+            return compact_doc_data(
+                *model.link(
+                    data["text"],
+                    [
+                        (mention["start"], mention["end"], mention["type"])
+                        for mention in data["mentions"]
+                    ],
+                )
+            )
+
+    if hasattr(model, "annotate_with_entities"):
+
+        @frontend.route("/entities_compact", methods=["POST"])
+        def entities_compact():
+            # Internal, for the API gateway: relations or events between the entities of the client
+            data = request.get_json()
+
+            try:
+                result = model.annotate_with_entities(
+                    data["text"],
+                    [
+                        (entity["start"], entity["end"], entity["type"])
+                        for entity in data["entities"]
+                    ],
+                )
+            except ValueError as e:
+                return {"detail": str(e)}, 422
+
+            return compact_doc_data(*result)
+
     @frontend.route("/annotate", methods=["POST"])
     def annotate():
         text = request.form["text"]
@@ -342,3 +460,56 @@ def make_frontend(frontend_name, model):
         return data
 
     return frontend
+
+
+def get_combined_doc_data(text, el_model, re_model, ev_model):
+    """
+    Columnar annotations of the four tasks, for the API gateway.
+
+    The document is split and tokenized once, then the entity linking, relation extraction and
+    event extraction models annotate it in parallel. The named entities are the ones of entity
+    linking without their normalizations, both tasks share the same NER model.
+    """
+    split = split_document(el_model.geniass, text)
+
+    # The threads are per request, so that concurrent requests do not wait for each other's models
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        re_future = executor.submit(re_model.annotate_split, text, split)
+        ev_future = executor.submit(ev_model.annotate_split, text, split)
+
+        el_data = compact_doc_data(*el_model.annotate_many([text], [split])[0])
+
+        re_result = re_future.result()
+        ev_result = ev_future.result()
+
+    ner_data = dict(
+        el_data,
+        normalizations={key: [] for key in el_data["normalizations"]},
+    )
+
+    return {
+        "ner": ner_data,
+        "el": el_data,
+        "re": compact_doc_data(*re_result),
+        "ee": compact_doc_data(*ev_result),
+    }
+
+
+def make_combined_frontend(el_model, re_model, ev_model):
+    frontend = Blueprint("Combined Annotation", __name__)
+
+    @frontend.route("/version")
+    def version():
+        # Used by the API gateway to key its response cache
+        return {
+            "version": model_version(
+                el_model.model_version, re_model.model_version, ev_model.model_version
+            )
+        }
+
+    @frontend.route("/annotate_compact", methods=["POST"])
+    def annotate_compact():
+        # Internal, for the API gateway
+        return get_combined_doc_data(request.form["text"], el_model, re_model, ev_model)
+
+    return frontend